@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save
+import logging
+
+from collector.models import Run
+
+logger = logging.getLogger(__name__)
+
+
+def clear_api_cache(sender, instance, **kwargs):
+    """ Clear the API cache once a collector run has completed successfully and changed something.
+
+    Cached responses are keyed on the latest successful run anyway, so this just stops
+    stale responses hanging around until they expire.
+    """
+
+    if instance.successful and instance.changed:
+        logger.debug("{} completed, clearing the API cache".format(instance.__class__.__name__))
+        caches[settings.API_CACHE].clear()
+
+
+# Runs are saved as one of the Run subclasses, which are what the signal is sent for
+for model in [Run] + Run.__subclasses__():
+    post_save.connect(clear_api_cache, sender=model, dispatch_uid="clear_api_cache_{}".format(model.__name__))
@@ -1,3 +1,232 @@
+from django.conf import settings
+from django.core.cache import caches
 from django.test import TestCase
+from django.urls import reverse
+from datetime import datetime, timedelta
+from unittest import mock
+import json
+import pytz
 
-# Create your tests here.
+from collector.models import DeparturesRun
+from data.models import Ferry, Sailing
+from data.serializers import iter_sailings_as_dicts, sailings_as_dicts
+from data.tests import RouteTestMixin
+
+
+class ApiCacheTestCase(RouteTestMixin, TestCase):
+    """ Check that API responses are cached against the latest run and the time, and cleared by new runs. """
+
+    def setUp(self):
+        super().setUp()
+
+        self.cache = caches[settings.API_CACHE]
+        self.cache.clear()
+
+        step = settings.BCF_API_WINDOW_STEP
+        self.now = datetime.fromtimestamp(datetime.now(pytz.UTC).timestamp() // step * step, pytz.UTC)
+        self.sailing = Sailing.objects.create(route=self.route, scheduled_departure=self.now + timedelta(seconds=30))
+
+        DeparturesRun.objects.create(successful=True)
+
+    def get(self, url, at=None):
+        with mock.patch("django.utils.timezone.now", return_value=at or self.now):
+            return self.client.get(url)
+
+    def test_hit(self):
+        url = reverse("get_sailing", args=[self.sailing.pk])
+        first = self.get(url)
+
+        # Changes that aren't from a run aren't seen until the next one, and only the latest run is looked up
+        Sailing.objects.filter(pk=self.sailing.pk).update(percent_full=50)
+        with self.assertNumQueries(1):
+            second = self.get(url)
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+
+    def test_new_run(self):
+        url = reverse("get_sailing", args=[self.sailing.pk])
+        self.get(url)
+
+        Sailing.objects.filter(pk=self.sailing.pk).update(percent_full=50)
+        DeparturesRun.objects.create(successful=True)
+
+        self.assertEqual(json.loads(self.get(url).content)["response"]["percent_full"], 50)
+
+    def test_time_step(self):
+        url = reverse("get_all_sailings")
+        self.assertEqual(len(json.loads(self.get(url).content)["response"]), 1)
+
+        # Once the sailing has departed it drops out of the window, without waiting for a run
+        later = self.now + timedelta(seconds=settings.BCF_API_WINDOW_STEP)
+        self.assertEqual(len(json.loads(self.get(url, at=later).content)["response"]), 0)
+
+    def test_errors_arent_cached(self):
+        url = reverse("get_sailing", args=[self.sailing.pk + 1])
+        self.assertEqual(self.get(url).status_code, 404)
+
+        Sailing.objects.create(
+            pk=self.sailing.pk + 1, route=self.route, scheduled_departure=self.now + timedelta(hours=1)
+        )
+        self.assertEqual(self.get(url).status_code, 200)
+
+    def test_only_runs_clear_the_cache(self):
+        self.cache.set("key", "value")
+
+        Ferry.objects.create(name="Queen of Nowhere")
+        DeparturesRun.objects.create(successful=False)
+        self.assertEqual(self.cache.get("key"), "value")
+
+        DeparturesRun.objects.create(successful=True)
+        self.assertIsNone(self.cache.get("key"))
+
+
+class ConditionalResponseTestCase(TestCase):
+    """ Check that clients with an up to date response get a 304, until there's a new run or the time moves on. """
+
+    def setUp(self):
+        caches[settings.API_CACHE].clear()
+
+        self.run = DeparturesRun.objects.create(successful=True)
+        step = settings.BCF_API_WINDOW_STEP
+        self.now = datetime.fromtimestamp(datetime.now(pytz.UTC).timestamp() // step * step, pytz.UTC)
+        self.url = reverse("get_all_sailings")
+
+    def get(self, at=None, **headers):
+        with mock.patch("django.utils.timezone.now", return_value=at or self.now):
+            return self.client.get(self.url, **headers)
+
+    def test_if_none_match(self):
+        etag = self.get()["ETag"]
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Later in the same step, the response is the same
+        later = self.now + timedelta(seconds=settings.BCF_API_WINDOW_STEP - 1)
+        self.assertEqual(self.get(at=later, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # In the next step, or after a new run, it isn't
+        later = self.now + timedelta(seconds=settings.BCF_API_WINDOW_STEP)
+        self.assertEqual(self.get(at=later, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        DeparturesRun.objects.create(successful=True)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_modified_since(self):
+        last_modified = self.get()["Last-Modified"]
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        later = self.now + timedelta(seconds=settings.BCF_API_WINDOW_STEP)
+        response = self.get(at=later, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["Last-Modified"], last_modified)
+
+    def test_no_cache(self):
+        self.assertIn("no-cache", self.get()["Cache-Control"])
+
+
+class StreamingSailingsTestCase(RouteTestMixin, TestCase):
+    """ Check that streamed sailings match the ones sent in one go. """
+
+    def setUp(self):
+        super().setUp()
+        ferry = Ferry.objects.create(name="Queen of Nowhere")
+
+        now = datetime.now(pytz.UTC)
+        for hours in range(5):
+            Sailing.objects.create(
+                route=self.route,
+                ferry=ferry if hours % 2 else None,
+                scheduled_departure=now + timedelta(hours=hours),
+                eta_or_arrival_time=now + timedelta(hours=hours, minutes=95)
+            )
+
+    def test_chunks(self):
+        sailings = Sailing.objects.order_by('pk')
+        self.assertEqual(list(iter_sailings_as_dicts(sailings, chunk_size=2)), sailings_as_dicts(sailings))
+
+    def test_json(self):
+        response = self.client.get(reverse("stream_really_all_sailings"))
+        self.assertTrue(response.streaming)
+        streamed = json.loads(b"".join(response.streaming_content))
+
+        expected = json.loads(self.client.get(reverse("get_really_all_sailings")).content)
+        self.assertEqual(streamed["meta"]["request"], "/api/all-sailings/stream")
+        self.assertEqual(streamed["response"], sorted(expected["response"], key=lambda sailing: sailing["id"]))
+
+    def test_ndjson(self):
+        response = self.client.get(reverse("stream_really_all_sailings"), {"format": "ndjson"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], list(
+            Sailing.objects.order_by('pk').values_list('pk', flat=True)
+        ))
+
+
+class SailingPageTestCase(RouteTestMixin, TestCase):
+    """ Check that sailings can be read a page at a time. """
+
+    def setUp(self):
+        super().setUp()
+
+        # Two sailings at each time, so that pages have to be split on the ID too
+        self.now = datetime.now(pytz.UTC).replace(microsecond=0)
+        for hours in [1, 1, 2, 3, 3, 4]:
+            Sailing.objects.create(route=self.route, scheduled_departure=self.now + timedelta(hours=hours))
+
+        self.ids = list(Sailing.objects.order_by('scheduled_departure', 'pk').values_list('pk', flat=True))
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_cursor(self):
+        ids = []
+        params = {"limit": 2}
+
+        while True:
+            data = self.get(reverse("get_all_sailings"), **params)
+            ids += [sailing["id"] for sailing in data["response"]]
+
+            if not data["meta"]["page"]["next_cursor"]:
+                break
+            params["cursor"] = data["meta"]["page"]["next_cursor"]
+
+        self.assertEqual(ids, self.ids)
+
+    def test_cursor_keeps_its_start(self):
+        with mock.patch("django.utils.timezone.now", return_value=self.now):
+            data = self.get(reverse("get_all_sailings"), limit=2)
+
+        start = data["meta"]["page"]["from"]
+        self.assertLessEqual(start, self.now.timestamp())
+        ids = [sailing["id"] for sailing in data["response"]]
+
+        # Following the cursor later on still reads the sailings from the same start, even those that have since left
+        params = {"cursor": data["meta"]["page"]["next_cursor"], "limit": 10}
+        with mock.patch("django.utils.timezone.now", return_value=self.now + timedelta(hours=3, minutes=30)):
+            data = self.get(reverse("get_all_sailings"), **params)
+
+        self.assertEqual(data["meta"]["page"]["from"], start)
+        self.assertEqual(ids + [sailing["id"] for sailing in data["response"]], self.ids)
+
+    def test_time_window(self):
+        data = self.get(reverse("get_sailing_by_route_id", args=[self.route.pk]), **{
+            "from": int((self.now + timedelta(hours=2)).timestamp()),
+            "to": (self.now + timedelta(hours=4)).isoformat()
+        })
+
+        self.assertEqual([sailing["id"] for sailing in data["response"]["sailings"]], self.ids[2:5])
+        self.assertIsNone(data["meta"]["page"]["next_cursor"])
+
+    def test_unpaged(self):
+        data = self.get(reverse("get_sailing_from", args=["tsa"]))
+        self.assertEqual(len(data["response"]), 6)
+        self.assertNotIn("page", data["meta"])
+
+    def test_invalid(self):
+        for params in [{"limit": 0}, {"limit": "lots"}, {"from": "whenever"}, {"cursor": "nope"}, {"cursor": "1-2"}]:
+            self.assertEqual(self.client.get(reverse("get_all_sailings"), params).status_code, 400)
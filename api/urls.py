@@ -6,6 +6,7 @@ urlpatterns = [
     path('ferries', ferry.get_all, name="get_all_ferries"),
     path('sailings', sailing.get_all, name="get_all_sailings"),
     path('all-sailings', sailing.get_really_all, name="get_really_all_sailings"),
+    path('all-sailings/stream', sailing.stream_really_all, name="stream_really_all_sailings"),
     path('sailings/route/<int:route_id>', sailing.get_sailing_by_route_id, name="get_sailing_by_route_id"),
     path('sailings/<int:sailing>', sailing.get_sailing, name="get_sailing"),
     path('sailings/<str:source>', sailing.get_sailing_by_route, name="get_sailing_from"),
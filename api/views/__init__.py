@@ -1,20 +1,213 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from datetime import datetime
+from functools import wraps
+from typing import Iterable, Union
+import hashlib
+import json
+import logging
+import pytz
 
+from collector.models import Run
 
-def response(request, data):
+logger = logging.getLogger(__name__)
+
+
+def latest_run(request) -> Union[datetime, None]:
+    """ Return the time of the latest successful collector run that changed anything.
+
+    The data behind the API only changes when a collector run completes, so this is used to
+    decide whether cached responses are still valid. Runs that found the pages unchanged are
+    skipped. It's looked up once per request.
+
+    :param request: the current request
+    :returns: the timestamp of the latest successful run, if there's been one
+    :rtype: datetime
+    """
+
+    if not hasattr(request, '_latest_run'):
+        request._latest_run = Run.objects.non_polymorphic().filter(
+            successful=True, changed=True
+        ).order_by('-timestamp').values_list('timestamp', flat=True).first()
+
+    return request._latest_run
+
+
+def request_time(request) -> datetime:
+    """ Return the time the API should treat as now for a request.
+
+    The sailings a view returns depend on the time as well as the data, so this is the current time rounded down to
+    BCF_API_WINDOW_STEP seconds. Responses built in the same step are then identical, and can be cached (and given an
+    ETag) against it. It's looked up once per request.
+
+    :param request: the current request
+    :returns: the start of the current step, in UTC
+    :rtype: datetime
+    """
+
+    if not hasattr(request, '_request_time'):
+        step = settings.BCF_API_WINDOW_STEP
+        request._request_time = datetime.fromtimestamp(timezone.now().timestamp() // step * step, pytz.UTC)
+
+    return request._request_time
+
+
+def response_key(request) -> str:
+    """ Return what an API response depends on, for caching it and building its ETag.
+
+    This is the latest successful collector run, the current time step (see request_time()) and the request path
+    (including any parameters), so it changes whenever new data has been collected or the time has moved on.
+
+    :param request: the current request
+    :returns: the key for the response
+    :rtype: str
+    """
+
+    run = latest_run(request)
+    return "{}:{}:{}".format(
+        run.timestamp() if run else 0,
+        int(request_time(request).timestamp()),
+        request.get_full_path()
+    )
+
+
+def response_etag(request, *args, **kwargs) -> str:
+    """ Return the ETag for an API response.
+
+    :param request: the current request
+    :returns: the ETag for the response
+    :rtype: str
+    """
+
+    return hashlib.sha1(response_key(request).encode()).hexdigest()
+
+
+def response_last_modified(request, *args, **kwargs) -> datetime:
+    """ Return the Last-Modified time for an API response.
+
+    :param request: the current request
+    :returns: the later of the latest successful run and the start of the current time step
+    :rtype: datetime
+    """
+
+    run = latest_run(request)
+    return max(run, request_time(request)) if run else request_time(request)
+
+
+def conditional_response(view):
+    """ Decorator to add conditional GET support to a view.
+
+    Requests with a matching If-None-Match or If-Modified-Since header get a 304 Not Modified
+    before the view is called, so nothing is queried or serialized.
+
+    :param view: the view to wrap
+    :returns: the wrapped view
+    """
+
+    view = condition(etag_func=response_etag, last_modified_func=response_last_modified)(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        view_response = view(request, *args, **kwargs)
+
+        # Make sure clients check back with us rather than guessing how long the response is fresh for
+        patch_cache_control(view_response, no_cache=True)
+
+        return view_response
+
+    return wrapper
+
+
+def cached_response(view):
+    """ Decorator to serve a view's JSON from the API cache.
+
+    Responses are cached against the latest successful collector run and the current time step, so they're rebuilt
+    the first time they're requested after new data has been collected, or once the time has moved on.
+
+    :param view: the view to cache
+    :returns: the wrapped view
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        cache = caches[settings.API_CACHE]
+
+        key = response_key(request)
+
+        content = cache.get(key)
+        if content is not None:
+            logger.debug("Serving {} from the cache".format(request.path))
+            return HttpResponse(content, content_type="application/json")
+
+        view_response = view(request, *args, **kwargs)
+
+        # Only cache successful responses
+        if view_response.status_code == 200 and not view_response.streaming:
+            cache.set(key, view_response.content, settings.BCF_API_WINDOW_STEP)
+
+        return view_response
+
+    return wrapper
+
+
+def response(request, data, meta: dict = None):
     now = datetime.now()
 
     response = {
         "meta": {
             "timestamp": now,
-            "request": request.path
+            "request": request.path,
+            **(meta or {})
         },
         "response": data
     }
     return JsonResponse(response)
 
 
+def streaming_response(request, items: Iterable, ndjson: bool = False) -> StreamingHttpResponse:
+    """ Return a response that's sent as it's generated, rather than all in one go.
+
+    By default this is the same JSON as response() gives, with the items as the response list. If ndjson is set, it's
+    newline-delimited JSON instead, with one item per line and no metadata.
+
+    :param request: the current request
+    :param items: the items to send, which can be a generator
+    :type items: Iterable
+    :param ndjson: whether to send newline-delimited JSON
+    :type ndjson: bool
+    :returns: the streaming response
+    :rtype: StreamingHttpResponse
+    """
+
+    encoder = DjangoJSONEncoder()
+
+    def ndjson_lines():
+        for item in items:
+            yield encoder.encode(item) + "\n"
+
+    def json_array():
+        # Send the same envelope as response(), with the items in the middle of it
+        meta = encoder.encode({"timestamp": datetime.now(), "request": request.path})
+        yield '{{"meta": {}, "response": ['.format(meta)
+
+        separator = ""
+        for item in items:
+            yield separator + encoder.encode(item)
+            separator = ", "
+
+        yield "]}"
+
+    if ndjson:
+        return StreamingHttpResponse(ndjson_lines(), content_type="application/x-ndjson")
+
+    return StreamingHttpResponse(json_array(), content_type="application/json")
+
+
 def error(request, status_code, error_text):
     now = datetime.now()
 
@@ -1,6 +1,8 @@
-from . import response
+from . import cached_response, conditional_response, response
 from data.models import Ferry
 
+@conditional_response
+@cached_response
 def get_all(request):
     ferries = [
         ferry.as_dict for ferry in Ferry.objects.all().order_by('-last_updated')
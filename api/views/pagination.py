@@ -0,0 +1,194 @@
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from data.models import Sailing
+from data.serializers import prefetch_sailings
+from datetime import datetime
+from dateutil.parser import parse
+import logging
+import pytz
+
+logger = logging.getLogger(__name__)
+
+
+class PageError(ValueError):
+    """ Raised when the paging parameters of a request aren't valid. """
+    pass
+
+
+def parse_time(value: str) -> datetime:
+    """ Parse a time given as a parameter, either as a Unix timestamp or as an ISO 8601 date/time. Times without a
+    timezone are taken to be local.
+
+    :param value: the parameter
+    :type value: str
+    :returns: the time
+    :rtype: datetime
+    """
+
+    try:
+        return datetime.fromtimestamp(float(value), pytz.UTC)
+    except (ValueError, OverflowError, OSError):
+        pass
+
+    timestamp = parse(value)
+    if timestamp.tzinfo is None:
+        timestamp = pytz.timezone(settings.DISPLAY_TIME_ZONE).localize(timestamp)
+
+    return timestamp
+
+
+def to_microseconds(timestamp: datetime) -> int:
+    """ Return a time as a whole number of microseconds since the epoch, so it can go in a cursor without losing
+    any precision.
+
+    :param timestamp: the time
+    :type timestamp: datetime
+    :returns: microseconds since the epoch
+    :rtype: int
+    """
+
+    timestamp = timestamp.astimezone(pytz.UTC)
+    return int(timestamp.timestamp()) * 1000000 + timestamp.microsecond
+
+
+def from_microseconds(microseconds: int) -> datetime:
+    """ Return the time given as microseconds since the epoch by to_microseconds().
+
+    :param microseconds: microseconds since the epoch
+    :type microseconds: int
+    :returns: the time, in UTC
+    :rtype: datetime
+    """
+
+    seconds, microsecond = divmod(microseconds, 1000000)
+    return datetime.fromtimestamp(seconds, pytz.UTC).replace(microsecond=microsecond)
+
+
+def encode_cursor(start: datetime, sailing: Sailing) -> str:
+    """ Return the cursor for the page after the given sailing, in a set of pages starting at the given time. """
+
+    return "{}-{}-{}".format(to_microseconds(start), to_microseconds(sailing.scheduled_departure), sailing.pk)
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """ Return the start of the pages, and the (scheduled_departure, id) of the last sailing before a page.
+
+    :param cursor: the cursor
+    :type cursor: str
+    :returns: tuple of the start, and a tuple of the scheduled departure and ID of the last sailing
+    :rtype: tuple
+    :raises PageError: if the cursor isn't one returned by encode_cursor()
+    """
+
+    parts = [int(part) for part in cursor.split("-")]
+    if len(parts) != 3:
+        raise PageError("Invalid cursor")
+
+    start, microseconds, pk = parts
+    return from_microseconds(start), (from_microseconds(microseconds), pk)
+
+
+class SailingPage:
+    """ A page of sailings, read in (scheduled_departure, id) order.
+
+    Pages are only used if the request asks for one, with any of these parameters:
+
+    * from: the earliest scheduled departure (a Unix timestamp or an ISO 8601 date/time)
+    * to: the scheduled departure to stop before
+    * limit: how many sailings to return (defaults to BCF_API_PAGE_LIMIT, up to BCF_API_MAX_PAGE_LIMIT)
+    * cursor: where to carry on from, as returned in the meta of the previous page
+
+    Each page picks up after the last sailing on the previous one, rather than skipping over an offset, so it's a
+    bounded range scan on the scheduled departure index however far through the sailings it is.
+
+    Without from, pages start at the default start given by the view, as of the first page. The cursor carries the
+    start along with it, so following the cursors reads one fixed range of sailings, however long it takes.
+    """
+
+    def __init__(self, request, default_start: datetime):
+        """
+        :param request: the current request
+        :param default_start: the earliest scheduled departure if from isn't given
+        :type default_start: datetime
+        :raises PageError: if the parameters aren't valid
+        """
+
+        params = request.GET
+        self.paged = any(name in params for name in ("from", "to", "limit", "cursor"))
+
+        try:
+            self.start = parse_time(params["from"]) if "from" in params else None
+        except (ValueError, OverflowError):
+            raise PageError("Invalid from time")
+
+        try:
+            self.end = parse_time(params["to"]) if "to" in params else None
+        except (ValueError, OverflowError):
+            raise PageError("Invalid to time")
+
+        try:
+            self.limit = int(params.get("limit", settings.BCF_API_PAGE_LIMIT))
+        except ValueError:
+            raise PageError("Invalid limit")
+
+        if not 1 <= self.limit <= settings.BCF_API_MAX_PAGE_LIMIT:
+            raise PageError("Limit must be between 1 and {}".format(settings.BCF_API_MAX_PAGE_LIMIT))
+
+        try:
+            cursor_start, self.after = decode_cursor(params["cursor"]) if "cursor" in params else (None, None)
+        except (ValueError, OverflowError, OSError):
+            raise PageError("Invalid cursor")
+
+        if self.start is None:
+            self.start = cursor_start or default_start
+
+        self.next_cursor = None
+
+    def filter(self, sailings: QuerySet) -> QuerySet:
+        """ Return the sailings on this page, in order.
+
+        :param sailings: QuerySet of Sailings
+        :type sailings: QuerySet
+        :returns: QuerySet of Sailings
+        :rtype: QuerySet
+        """
+
+        sailings = sailings.filter(scheduled_departure__gte=self.start)
+        if self.end is not None:
+            sailings = sailings.filter(scheduled_departure__lt=self.end)
+
+        if self.after:
+            scheduled_departure, pk = self.after
+            sailings = sailings.filter(
+                Q(scheduled_departure__gt=scheduled_departure) | Q(scheduled_departure=scheduled_departure, pk__gt=pk),
+                scheduled_departure__gte=scheduled_departure
+            )
+
+        return sailings.order_by('scheduled_departure', 'pk')
+
+    def sailings(self, sailings: QuerySet) -> list:
+        """ Return the dict representations of the sailings on this page, and work out the cursor for the next one.
+
+        :param sailings: QuerySet of Sailings
+        :type sailings: QuerySet
+        :returns: list of dicts representing each Sailing
+        :rtype: list
+        """
+
+        # Load one more than we need, to tell if there's another page
+        page = prefetch_sailings(self.filter(sailings)[:self.limit + 1])
+
+        if len(page) > self.limit:
+            page = page[:self.limit]
+            self.next_cursor = encode_cursor(self.start, page[-1])
+
+        return [sailing.as_dict for sailing in page]
+
+    @property
+    def as_dict(self) -> dict:
+        return {
+            "from": int(self.start.timestamp()),
+            "to": int(self.end.timestamp()) if self.end else None,
+            "limit": self.limit,
+            "next_cursor": self.next_cursor
+        }
@@ -1,9 +1,11 @@
 import logging
-from . import response
+from . import cached_response, conditional_response, response
 from data.models import Route
 
 logger = logging.getLogger(__name__)
 
+@conditional_response
+@cached_response
 def get_all(request):
     routes = [
         route.as_dict for route in Route.objects.all().order_by('route_code')
@@ -1,54 +1,93 @@
 import logging
-from pytz import timezone
 from django.db.models import Q
-from . import response, error
+from . import cached_response, conditional_response, request_time, response, error, streaming_response
+from .pagination import PageError, SailingPage
 from data.models import Sailing, Route
-from datetime import datetime, timedelta
+from data.serializers import iter_sailings_as_dicts, sailings_as_dicts
+from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 
+@conditional_response
+@cached_response
 def get_all(request):
-    tz = timezone('UTC')
-    now = tz.localize(datetime.now())
+    now = request_time(request)
     hour_ago = now - timedelta(hours=1)
-    sailings = [
-        sailing.as_dict for sailing in Sailing.objects.filter(
-            Q(scheduled_departure__gt=now)|Q(eta_or_arrival_time__gt=hour_ago)
-        ).order_by('scheduled_departure')
-    ]
+    window = Q(scheduled_departure__gt=now)|Q(eta_or_arrival_time__gt=hour_ago)
+
+    try:
+        page = SailingPage(request, now)
+    except PageError as e:
+        return error(request, 400, str(e))
+
+    if page.paged:
+        return response(request, page.sailings(Sailing.objects.all()), meta={"page": page.as_dict})
+
+    sailings = sailings_as_dicts(
+        Sailing.objects.filter(window).order_by('scheduled_departure')
+    )
 
     return response(request, sailings)
 
 
+@conditional_response
+@cached_response
 def get_really_all(request):
-    tz = timezone('UTC')
-    now = tz.localize(datetime.now())
-    sailings = [
-        sailing.as_dict for sailing in Sailing.objects.filter(
+    now = request_time(request)
+    sailings = sailings_as_dicts(
+        Sailing.objects.filter(
             Q(status__status="Cancelled")|Q(eta_or_arrival_time__gt=now)
         )
-    ]
+    )
 
     return response(request, sailings)
 
 
+@conditional_response
+def stream_really_all(request):
+    """ Stream the same sailings as get_really_all, as they're loaded.
+
+    The sailings are read from the database and sent a chunk at a time, so memory use stays flat and the response
+    starts straight away however many sailings there are. Ask for ?format=ndjson (or send an Accept header of
+    application/x-ndjson) to get one sailing per line instead of a JSON array.
+    """
+
+    now = request_time(request)
+    sailings = Sailing.objects.filter(
+        Q(status__status="Cancelled")|Q(eta_or_arrival_time__gt=now)
+    ).order_by('pk')
+
+    ndjson = request.GET.get('format') == "ndjson" or "application/x-ndjson" in request.META.get('HTTP_ACCEPT', "")
+
+    return streaming_response(request, iter_sailings_as_dicts(sailings), ndjson=ndjson)
+
+
+@conditional_response
+@cached_response
 def get_sailing(request, sailing: int):
-    try:
-        sailing = Sailing.objects.get(pk=sailing)
-    except Sailing.DoesNotExist:
+    sailings = sailings_as_dicts(Sailing.objects.filter(pk=sailing))
+
+    if not sailings:
         return error(
             request,
             404,
             "Unknown sailing"
         )
 
-    return response(request, sailing.as_dict)
+    return response(request, sailings[0])
 
 
+@conditional_response
+@cached_response
 def get_sailing_by_route(request, source: str, destination: str = None):
-    tz = timezone('UTC')
-    now = tz.localize(datetime.now())
+    now = request_time(request)
     hour_ago = now - timedelta(hours=1)
+    window = Q(scheduled_departure__gt=now)|Q(eta_or_arrival_time__gt=hour_ago)
+
+    try:
+        page = SailingPage(request, now)
+    except PageError as e:
+        return error(request, 400, str(e))
 
     try:
         logger.debug("Querying for sailings with source {}...".format(source.upper()))
@@ -62,11 +101,12 @@ def get_sailing_by_route(request, source: str, destination: str = None):
                 route__destination__terminal__short_name=destination.upper()
             )
 
-        sailings = [
-            s.as_dict for s in sailings.filter(
-                Q(scheduled_departure__gt=now)|Q(eta_or_arrival_time__gt=hour_ago)
-            ).order_by('scheduled_departure')
-        ]
+        if page.paged:
+            return response(request, page.sailings(sailings), meta={"page": page.as_dict})
+
+        sailings = sailings_as_dicts(
+            sailings.filter(window).order_by('scheduled_departure')
+        )
     except Route.DoesNotExist:
         return error(
             request,
@@ -77,23 +117,32 @@ def get_sailing_by_route(request, source: str, destination: str = None):
     return response(request, sailings)
 
 
+@conditional_response
+@cached_response
 def get_sailing_by_route_id(request, route_id: int):
-    tz = timezone('UTC')
-    now = tz.localize(datetime.now())
+    now = request_time(request)
     hour_ago = now - timedelta(hours=1)
+    window = Q(scheduled_departure__gt=hour_ago)|Q(eta_or_arrival_time__gt=hour_ago)
+
+    try:
+        page = SailingPage(request, hour_ago)
+    except PageError as e:
+        return error(request, 400, str(e))
 
     try:
         logger.debug("Querying for sailings with route ID {}...".format(
             route_id
         ))
         route = Route.objects.get(id=route_id)
-        sailings = [
-            s.as_dict for s in Sailing.objects.filter(
-                route__id=route_id
-            ).filter(
-                Q(scheduled_departure__gt=hour_ago)|Q(eta_or_arrival_time__gt=hour_ago)
-            ).order_by('scheduled_departure')
-        ]
+        sailings = Sailing.objects.filter(route__id=route_id)
+
+        if page.paged:
+            sailings = page.sailings(sailings)
+        else:
+            sailings = sailings_as_dicts(
+                sailings.filter(window).order_by('scheduled_departure')
+            )
+
         data = {
             "route": route.as_dict,
             "sailings": sailings
@@ -105,4 +154,4 @@ def get_sailing_by_route_id(request, route_id: int):
             "Unknown route"
         )
 
-    return response(request, data)
+    return response(request, data, meta={"page": page.as_dict} if page.paged else None)
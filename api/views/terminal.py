@@ -1,12 +1,14 @@
 import logging
 from pytz import timezone
 from django.db.models import Q
-from . import response, error
+from . import cached_response, conditional_response, response, error
 from data.models import Terminal
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+@conditional_response
+@cached_response
 def get_all(request):
     terminals = [
         terminal.as_dict for terminal in Terminal.objects.all()
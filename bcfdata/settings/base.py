@@ -96,6 +96,30 @@ DATABASES = {
 #    }
 #}
 
+# Caches
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+
+# The API cache holds pre-serialized responses. Each process gets its own local memory cache by
+# default - to share the cache between processes, use the file-based backend instead
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api',
+        'TIMEOUT': 600,
+    }
+}
+
+#CACHES['api'] = {
+#    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#    'LOCATION': os.path.join(BASE_DIR, 'cache', 'api'),
+#    'TIMEOUT': 600,
+#}
+
+API_CACHE = 'api'
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -139,6 +163,77 @@ STATIC_ROOT = 'static'
 #BCF_BASE_URL = "https://www.bcferries.com/current_conditions/"
 BCF_BASE_URL = "https://orca.bcferries.com/cc/marqui/"
 
+# How many pages can be fetched from BC Ferries at once, and how many requests per second can be
+# made to each host
+BCF_FETCH_CONCURRENCY = 4
+BCF_FETCH_RATE_LIMIT = 2
+
+# Timeout (in seconds) for each request to BC Ferries, and how many times to retry failed requests
+# with exponential backoff
+BCF_HTTP_TIMEOUT = 30
+BCF_HTTP_RETRIES = 3
+BCF_HTTP_BACKOFF = 0.5
+
+# BeautifulSoup tree builder for parsing pages - falls back to html.parser if it isn't installed
+BCF_HTML_PARSER = "lxml"
+
+# How many pending updates a collector run holds before writing them in bulk
+BCF_WRITE_BATCH_SIZE = 500
+
+# How long (in seconds) the collectors keep terminals, routes, ferries and the like cached before reloading them
+BCF_REFERENCE_CACHE_TTL = 300
+
+# How often (in seconds) the worker runs each job (an update runs departures and conditions, and poll_locations
+# fetches the ferry locations for the routes that are due), the most each run can be delayed to spread them out,
+# and what to do about runs that are missed because the last one overran ("skip" or "run_once")
+BCF_SCHEDULE = {
+    "update": {"interval": 600, "jitter": 15, "missed": "run_once"},
+    "poll_locations": {"interval": 30, "jitter": 0, "missed": "skip"},
+    "sailing_detail": {"interval": 3600, "jitter": 60, "missed": "skip"},
+    "ferry_details": {"interval": 86400, "jitter": 300, "missed": "skip"},
+}
+
+# How often (in seconds) updates run around departures and arrivals ("active"), while sailings are underway, and when
+# nothing is happening ("idle"). Sailings are active from "boarding" minutes before they depart until "departing"
+# minutes after, and for "arriving" minutes either side of their scheduled arrival. Sailings are looked for between
+# "lookback" hours ago and "lookahead" hours from now.
+BCF_CADENCE = {
+    "active": 120,
+    "underway": 600,
+    "idle": 1800,
+    "boarding": 45,
+    "departing": 10,
+    "arriving": 15,
+    "lookback": 12,
+    "lookahead": 24,
+}
+
+# How often (in seconds) to fetch the ferry locations for each route while they're changing, how much to back off by
+# each time a route's page is unchanged, and the longest to go without fetching a route. Routes 2 and 13 show headings,
+# which change more often.
+BCF_LOCATION_POLLING = {
+    "interval": 120,
+    "backoff": 2,
+    "max_interval": 1800,
+    "routes": {
+        "2": {"interval": 60},
+        "13": {"interval": 60},
+    }
+}
+
+# The most requests to make to BC Ferries each hour, however busy the timetable is. Every job the worker runs counts
+# against the same budget (0 for no limit).
+BCF_REQUEST_BUDGET = 600
+
+# How many sailings the API returns per page when a client asks for pages (with from, to, limit or cursor), and the
+# most a client can ask for at once
+BCF_API_PAGE_LIMIT = 100
+BCF_API_MAX_PAGE_LIMIT = 1000
+
+# Which sailings the API returns depends on the time, so it works out its windows from the time rounded down to this
+# many seconds. Responses are cached (and given ETags) for each step, so they're never more than this out of date.
+BCF_API_WINDOW_STEP = 60
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -6,6 +6,7 @@ class RunAdmin(admin.ModelAdmin):
     list_display = (
         'timestamp',
         'successful',
+        'changed',
         'status',
         'html'
     )
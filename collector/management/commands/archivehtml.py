@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from collector.models import RawHTML, RawHTMLBlob
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Move stored pages into the compressed archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--vacuum', action='store_true', help="Vacuum the database afterwards")
+
+    def handle(self, *args, **options):
+        pages = 0
+        before = 0
+        after = 0
+        blobs = 0
+
+        while True:
+            # Archived rows drop out of the queryset, so keep taking the first batch until none are left
+            with transaction.atomic():
+                batch = list(
+                    RawHTML.objects.non_polymorphic().filter(
+                        data__isnull=False
+                    ).order_by('pk')[:options['batch_size']]
+                )
+
+                if not batch:
+                    break
+
+                for raw_html in batch:
+                    raw_html.digest = raw_html.digest or raw_html.hash(raw_html.data)
+
+                # Only count the blobs this batch adds, not ones that were already there (or that the collectors
+                # have stored since we started)
+                existing = set(RawHTMLBlob.objects.filter(
+                    digest__in={raw_html.digest for raw_html in batch}
+                ).values_list('digest', flat=True))
+
+                for raw_html in batch:
+                    before += len(raw_html.data.encode())
+                    raw_html.archive()
+
+                    if raw_html.digest not in existing:
+                        existing.add(raw_html.digest)
+                        after += raw_html.blob.compressed_size
+                        blobs += 1
+
+                RawHTML.objects.bulk_update(batch, ['data', 'digest', 'blob'])
+
+            pages += len(batch)
+            logger.debug("Archived {} pages".format(pages))
+
+        self.stdout.write("Archived {} pages into {} new blobs: {} bytes -> {} bytes ({} bytes reclaimed)".format(
+            pages, blobs, before, after, before - after
+        ))
+
+        if options['vacuum']:
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
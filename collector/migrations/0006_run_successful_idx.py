@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collector', '0005_run_info'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['successful', 'timestamp'], name='run_successful_idx'),
+        ),
+    ]
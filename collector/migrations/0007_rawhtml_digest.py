@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collector', '0006_run_successful_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawhtml',
+            name='digest',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='rawhtml',
+            name='etag',
+            field=models.CharField(blank=True, max_length=256, null=True),
+        ),
+        migrations.AddField(
+            model_name='rawhtml',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
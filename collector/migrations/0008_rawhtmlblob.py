@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collector', '0007_rawhtml_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RawHTMLBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('data', models.BinaryField()),
+                ('size', models.IntegerField(default=0)),
+                ('compressed_size', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='rawhtml',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='collector.RawHTMLBlob'),
+        ),
+    ]
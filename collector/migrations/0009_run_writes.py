@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collector', '0008_rawhtmlblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='commit_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='writes',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
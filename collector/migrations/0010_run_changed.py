@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:11
+
+from django.db import migrations, models
+
+
+def mark_unchanged_runs(apps, schema_editor):
+    """ Mark the runs that found nothing new as unchanged. """
+
+    Run = apps.get_model('collector', 'Run')
+    Run.objects.filter(status="Unchanged").update(changed=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collector', '0009_run_writes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='run',
+            name='run_successful_idx',
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='changed',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['successful', 'changed', 'timestamp'], name='run_latest_changed_idx'),
+        ),
+        migrations.RunPython(mark_unchanged_runs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:24
+
+import data.clock
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collector', '0010_run_changed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='run',
+            name='timestamp',
+            field=models.DateTimeField(default=data.clock.now),
+        ),
+    ]
@@ -1,15 +1,33 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
 from polymorphic.models import PolymorphicModel
+from data import clock
+import gzip
+import hashlib
 import pytz
 
 
 class Run(PolymorphicModel):
-    timestamp = models.DateTimeField(auto_now=True)
+    # Set whenever the run is saved. When pages are processed again later, that's the time they were captured.
+    timestamp = models.DateTimeField(default=clock.now)
     successful = models.BooleanField(default=False)
     status = models.CharField(max_length=256, null=True, blank=True)
     info = models.TextField(null=True, blank=True)
 
+    # Whether the run found anything new. Runs where the pages hadn't changed are still successful, but the data
+    # behind the API is the same as it was after the last one.
+    changed = models.BooleanField(default=True)
+
+    # How many rows the run wrote, and how long it took to commit them (in seconds)
+    writes = models.IntegerField(null=True, blank=True)
+    commit_time = models.FloatField(null=True, blank=True)
+
+    class Meta(PolymorphicModel.Meta):
+        indexes = [
+            # Used to find the latest successful run that changed anything
+            models.Index(fields=["successful", "changed", "timestamp"], name="run_latest_changed_idx"),
+        ]
+
     @property
     def local_timestamp(self):
         tz = pytz.timezone(settings.DISPLAY_TIME_ZONE)
@@ -23,9 +41,14 @@ class Run(PolymorphicModel):
     def html(self) -> list:
         return self.rawhtml_set.all()
 
-    def set_status(self, status, successful: bool = False):
+    def save(self, *args, **kwargs):
+        self.timestamp = clock.now()
+        super().save(*args, **kwargs)
+
+    def set_status(self, status, successful: bool = False, changed: bool = True):
         self.status = status
         self.successful = successful
+        self.changed = changed
         self.save()
 
     def __repr__(self) -> str:
@@ -51,9 +74,149 @@ class SailingDetailRun(Run):
     pass
 
 
+class RawHTMLBlob(models.Model):
+    """ Compressed page content, stored once per unique page. """
+
+    digest = models.CharField(max_length=64, unique=True, null=False, blank=False)
+    data = models.BinaryField()
+
+    # Size of the page before and after compression, in bytes
+    size = models.IntegerField(default=0)
+    compressed_size = models.IntegerField(default=0)
+
+    @property
+    def text(self) -> str:
+        """ Return the decompressed page.
+
+        :returns: the page content
+        :rtype: str
+        """
+
+        return gzip.decompress(bytes(self.data)).decode()
+
+    @classmethod
+    def store(cls, text: str, digest: str) -> "RawHTMLBlob":
+        """ Return the blob for a page, compressing and storing it if we haven't seen it before.
+
+        :param text: the page content
+        :type text: str
+        :param digest: the SHA-256 digest of the page
+        :type digest: str
+        :returns: the blob for the page
+        :rtype: RawHTMLBlob
+        """
+
+        blob = cls.objects.filter(digest=digest).first()
+        if blob:
+            return blob
+
+        raw = text.encode()
+        compressed = gzip.compress(raw)
+        blob = cls(digest=digest, data=compressed, size=len(raw), compressed_size=len(compressed))
+
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # Someone else stored the same page in the meantime
+            blob = cls.objects.get(digest=digest)
+
+        return blob
+
+    def __repr__(self) -> str:
+        return "<RawHTMLBlob: {} ({} -> {} bytes)>".format(
+            self.digest[:12], self.size, self.compressed_size
+        )
+
+
 class RawHTML(PolymorphicModel):
     run = models.ForeignKey(Run, null=False, blank=False, on_delete=models.CASCADE)
+
+    # Pages are stored in the archive - data is only used by rows which haven't been archived yet
     data = models.TextField(null=True, blank=True)
+    blob = models.ForeignKey(RawHTMLBlob, null=True, blank=True, on_delete=models.PROTECT)
+
+    # SHA-256 digest of the data, used to tell if a page has changed since the last run
+    digest = models.CharField(max_length=64, null=True, blank=True)
+
+    # Validators sent back by the server, used for conditional requests
+    etag = models.CharField(max_length=256, null=True, blank=True)
+    last_modified = models.CharField(max_length=64, null=True, blank=True)
+
+    @staticmethod
+    def hash(data: str) -> str:
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    @classmethod
+    def latest(cls, **kwargs) -> "RawHTML":
+        """ Return the most recent page that was successfully processed.
+
+        :returns: the latest RawHTML from a successful run (or None)
+        :rtype: RawHTML
+        """
+
+        return cls.objects.filter(run__successful=True, **kwargs).order_by('-pk').first()
+
+    @property
+    def conditional_headers(self) -> dict:
+        """ Return the headers needed to make a conditional request for this page.
+
+        :returns: dict of If-None-Match/If-Modified-Since headers
+        :rtype: dict
+        """
+
+        headers = {}
+
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        return headers
+
+    @property
+    def content(self) -> str:
+        """ Return the page content, wherever it's stored.
+
+        :returns: the page content
+        :rtype: str
+        """
+
+        return self.blob.text if self.blob_id else self.data
+
+    def archive(self) -> None:
+        """ Move the page content into the archive.
+
+        :returns: nothing
+        :rtype: None
+        """
+
+        if not self.digest:
+            self.digest = self.hash(self.data)
+
+        self.blob = RawHTMLBlob.store(self.data, self.digest)
+        self.data = None
+
+    def is_unchanged(self, response) -> bool:
+        """ Check whether a response has the same page as this one.
+
+        :param response: the response to check
+        :returns: whether the server said the page wasn't modified, or the content is identical
+        :rtype: bool
+        """
+
+        if response.status_code == 304:
+            return True
+
+        return response.status_code == 200 and self.digest == self.hash(response.text)
+
+    def save(self, *args, **kwargs):
+        # New pages always go straight into the archive
+        if self.data is not None:
+            self.archive()
+
+        super(RawHTML, self).save(*args, **kwargs)
 
 
 class ConditionsRawHTML(RawHTML):
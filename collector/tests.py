@@ -1,3 +1,116 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
 from django.test import TestCase
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from .models import ConditionsRawHTML, ConditionsRun, DeparturesRawHTML, DeparturesRun, RawHTMLBlob, Run
+from api.views import latest_run
+from data.utils import get_actual_departures, get_current_conditions
+
+
+class ArchiveHTMLTestCase(TestCase):
+    """ Check that stored pages are compressed into the archive once per unique page, and can be read back. """
+
+    def setUp(self):
+        self.run = DeparturesRun.objects.create(successful=True)
+        self.pages = ["<html>{}</html>".format("departures " * 100), "<html>{}</html>".format("conditions " * 100)]
+
+    def add_pages(self, *pages):
+        # Pages are archived as they're saved now, so put them back the way older rows were stored
+        for page in pages:
+            raw_html = DeparturesRawHTML.objects.create(run=self.run, data=page)
+            DeparturesRawHTML.objects.filter(pk=raw_html.pk).update(data=page, digest=None, blob=None)
+
+        RawHTMLBlob.objects.filter(rawhtml__isnull=True).delete()
+
+    def archive(self, **options):
+        out = StringIO()
+        call_command("archivehtml", stdout=out, batch_size=2, **options)
+        return out.getvalue()
+
+    def test_archive(self):
+        self.add_pages(self.pages[0], self.pages[1], self.pages[0])
+        output = self.archive()
+
+        pages = DeparturesRawHTML.objects.order_by('pk')
+        self.assertEqual([page.content for page in pages], [self.pages[0], self.pages[1], self.pages[0]])
+        self.assertTrue(all(page.data is None for page in pages))
+
+        # The repeated page is only stored once, compressed
+        self.assertEqual(RawHTMLBlob.objects.count(), 2)
+        self.assertEqual(pages[0].blob_id, pages[2].blob_id)
+
+        blob = pages[0].blob
+        self.assertEqual(blob.size, len(self.pages[0]))
+        self.assertLess(blob.compressed_size, blob.size)
+
+        before = sum(len(page) for page in self.pages) + len(self.pages[0])
+        after = sum(RawHTMLBlob.objects.values_list('compressed_size', flat=True))
+        self.assertEqual(output.strip(), "Archived 3 pages into 2 new blobs: {} bytes -> {} bytes ({} bytes "
+                                         "reclaimed)".format(before, after, before - after))
+
+    def test_other_blobs_arent_counted(self):
+        # One page is already in the archive, and another page is stored by a collector while the command runs
+        DeparturesRawHTML.objects.create(run=self.run, data=self.pages[0])
+        self.add_pages(self.pages[0], self.pages[1])
+
+        store = RawHTMLBlob.store
+
+        def store_concurrently(text, digest):
+            if not RawHTMLBlob.objects.filter(digest="other").exists():
+                RawHTMLBlob.objects.create(digest="other", data=b"", size=1000000, compressed_size=1000000)
+            return store(text, digest)
+
+        with mock.patch.object(RawHTMLBlob, "store", side_effect=store_concurrently):
+            output = self.archive()
+
+        new = RawHTMLBlob.objects.get(digest=DeparturesRawHTML.hash(self.pages[1]))
+        self.assertIn("into 1 new blobs: {} bytes -> {} bytes".format(
+            len(self.pages[0]) + len(self.pages[1]), new.compressed_size
+        ), output)
+
+
+class UnchangedRunTestCase(TestCase):
+    """ Check that runs which find the pages unchanged don't count as new data for the API. """
+
+    def setUp(self):
+        self.cache = caches[settings.API_CACHE]
+        self.cache.clear()
+
+        for run_model, page_model in [(DeparturesRun, DeparturesRawHTML), (ConditionsRun, ConditionsRawHTML)]:
+            run = run_model.objects.create(successful=True)
+            page_model.objects.create(run=run, data="<html></html>", etag='"1"')
+
+        self.latest = Run.objects.non_polymorphic().latest('timestamp')
+
+    def fetch(self, collector, status_code=304, text=""):
+        response = mock.Mock(status_code=status_code, text=text)
+        with mock.patch("data.utils.get_client") as get_client:
+            get_client.return_value.get.return_value = response
+            self.assertTrue(collector())
+
+        self.assertEqual(get_client.return_value.get.call_args[1]["headers"], {"If-None-Match": '"1"'})
+        return Run.objects.non_polymorphic().latest('pk')
+
+    def assertUnchanged(self, run):
+        self.assertEqual(run.status, "Unchanged")
+        self.assertTrue(run.successful)
+        self.assertFalse(run.changed)
+        self.assertGreater(run.timestamp, self.latest.timestamp)
+
+        request = mock.Mock(spec=[])
+        self.assertEqual(latest_run(request), self.latest.timestamp)
+
+    def test_not_modified(self):
+        self.cache.set("key", "value")
+
+        self.assertUnchanged(self.fetch(get_actual_departures))
+        self.assertUnchanged(self.fetch(get_current_conditions))
+
+        # The cached responses are still good
+        self.assertEqual(self.cache.get("key"), "value")
+
+    def test_same_content(self):
+        self.assertUnchanged(self.fetch(get_actual_departures, status_code=200, text="<html></html>"))
@@ -0,0 +1,102 @@
+import logging
+from django.conf import settings
+from django.utils import timezone as tz
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from .client import Client, get_client
+from .models import Sailing
+
+logger = logging.getLogger(__name__)
+
+
+class TimetableCadence:
+    """ Work out how often to poll BC Ferries from the sailing timetable.
+
+    Around each scheduled departure (while the sailing is boarding and leaving) and each scheduled arrival (worked out
+    from the route's duration), the pages change quickly, so we poll at the active interval. While sailings are
+    underway but nowhere near departing or arriving we poll at the underway interval, and when nothing is happening
+    we back off to the idle interval - but never past the start of the next departure or arrival window.
+
+    However often the timetable says to poll, each update costs a number of requests, which come out of the same
+    request budget as everything else the worker fetches. When the other jobs have used up the budget, the next
+    update waits until there's room for all of its requests.
+    """
+
+    def __init__(self, requests: int, client: Client = None, cadence: dict = None):
+        """
+        :param requests: how many requests each update makes
+        :type requests: int
+        :param client: the client whose request budget updates come out of (defaults to the shared client)
+        :type client: Client
+        :param cadence: intervals and windows to use instead of BCF_CADENCE
+        :type cadence: dict
+        """
+
+        self.requests = requests
+        self.client = client or get_client()
+        self.cadence = dict(settings.BCF_CADENCE, **(cadence or {}))
+
+    def windows(self, now: datetime) -> Tuple[List[Tuple[datetime, datetime]], List[Tuple[datetime, datetime]]]:
+        """ Return the busy windows around departures and arrivals, and the times sailings are underway.
+
+        :param now: the time to look around
+        :type now: datetime
+        :returns: tuple of the list of busy windows and the list of times sailings are underway, as (start, end)
+        :rtype: tuple
+        """
+
+        boarding = timedelta(minutes=self.cadence["boarding"])
+        departing = timedelta(minutes=self.cadence["departing"])
+        arriving = timedelta(minutes=self.cadence["arriving"])
+
+        sailings = Sailing.objects.filter(
+            scheduled_departure__gte=now - timedelta(hours=self.cadence["lookback"]),
+            scheduled_departure__lt=now + timedelta(hours=self.cadence["lookahead"]),
+            cancelled=False
+        ).values_list('scheduled_departure', 'route__duration')
+
+        busy = []
+        underway = []
+        for departure, duration in sailings:
+            busy.append((departure - boarding, departure + departing))
+
+            if duration:
+                arrival = departure + timedelta(minutes=duration)
+                busy.append((arrival - arriving, arrival + arriving))
+                underway.append((departure, arrival))
+
+        return busy, underway
+
+    def interval(self, now: datetime = None) -> float:
+        """ Return how long to wait until the next update, in seconds.
+
+        :param now: the time to work it out for (defaults to now)
+        :type now: datetime
+        :returns: the interval, in seconds
+        :rtype: float
+        """
+
+        now = now or tz.now()
+        busy, underway = self.windows(now)
+
+        if any(start <= now < end for start, end in busy):
+            state, interval = "active", self.cadence["active"]
+        elif any(start <= now < end for start, end in underway):
+            state, interval = "underway", self.cadence["underway"]
+        else:
+            state, interval = "idle", self.cadence["idle"]
+
+        # Don't sleep through the start of the next busy window
+        upcoming = [start for start, _ in busy if start > now]
+        if upcoming:
+            interval = min(interval, (min(upcoming) - now).total_seconds())
+
+        # Never poll faster than the active interval, or before the budget has room for the update
+        interval = max(interval, self.cadence["active"], self.client.budget.wait_time(self.requests))
+        logger.debug("Polling in {:.0f}s ({})".format(interval, state))
+
+        return interval
+
+    def __call__(self) -> float:
+        return self.interval()
@@ -0,0 +1,279 @@
+import requests
+import logging
+import threading
+from collections import deque
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from time import monotonic
+from typing import Optional
+from urllib.parse import urlsplit
+from urllib3.util.retry import Retry
+
+from .scheduler import Clock
+
+logger = logging.getLogger(__name__)
+
+
+class BudgetExceeded(requests.RequestException):
+    """ Raised instead of making a request that would go over the request budget. """
+
+
+class RequestBudget:
+    """ Keep count of the requests made over the last hour, across everything that fetches from BC Ferries.
+
+    Every request the Client makes takes a slot, and slots are freed up an hour after they were taken. Once all of
+    the slots are taken, requests are refused until the oldest one frees up.
+    """
+
+    def __init__(self, budget: int, period: float = 3600, clock: Clock = None):
+        """
+        :param budget: the most requests to make in each period (0 for no limit)
+        :type budget: int
+        :param period: the period the budget is for, in seconds
+        :type period: float
+        :param clock: the time source (defaults to the system clock)
+        :type clock: Clock
+        """
+
+        self.budget = budget
+        self.period = period
+        self.clock = clock or Clock()
+        self.taken = deque()
+        self.refused = 0
+        self.lock = threading.Lock()
+
+    def expire(self, now: float) -> None:
+        """ Free up the slots taken more than a period ago. This should be called with the lock held. """
+
+        while self.taken and self.taken[0] <= now - self.period:
+            self.taken.popleft()
+
+    def take(self) -> bool:
+        """ Take a slot for a request, if there's one free.
+
+        :returns: whether the request can be made
+        :rtype: bool
+        """
+
+        if not self.budget:
+            return True
+
+        with self.lock:
+            now = self.clock.monotonic()
+            self.expire(now)
+
+            if len(self.taken) >= self.budget:
+                self.refused += 1
+                return False
+
+            self.taken.append(now)
+            return True
+
+    def wait_time(self, requests: int = 1) -> float:
+        """ Return how long until the given number of requests can be made, in seconds.
+
+        :param requests: how many requests are going to be made
+        :type requests: int
+        :returns: how long to wait, in seconds
+        :rtype: float
+        """
+
+        if not self.budget:
+            return 0
+
+        with self.lock:
+            now = self.clock.monotonic()
+            self.expire(now)
+
+            short = min(requests, self.budget) - (self.budget - len(self.taken))
+            if short <= 0:
+                return 0
+
+            return self.taken[short - 1] + self.period - now
+
+    @property
+    def remaining(self) -> Optional[int]:
+        """ How many more requests can be made right now, or None if there's no limit. """
+
+        if not self.budget:
+            return None
+
+        with self.lock:
+            self.expire(self.clock.monotonic())
+            return max(self.budget - len(self.taken), 0)
+
+    @property
+    def as_dict(self) -> dict:
+        """ Return a dict representation of the budget.
+
+        :returns: dict representation of the budget
+        :rtype: dict
+        """
+
+        return {
+            "budget": self.budget,
+            "remaining": self.remaining,
+            "refused": self.refused
+        }
+
+
+class HostStats:
+    """ Running totals for the requests made to a single host. """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.decoded_bytes = 0
+        self.latency = 0.0
+
+    @property
+    def as_dict(self) -> dict:
+        """ Return a dict representation of the stats.
+
+        :returns: dict representation of the stats
+        :rtype: dict
+        """
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "decoded_bytes": self.decoded_bytes,
+            "average_latency": self.latency / self.requests if self.requests else None
+        }
+
+
+class Client:
+    """ HTTP client used for all requests to the BC Ferries website.
+
+    This keeps a single session, so connections are pooled and kept alive between requests. Every
+    request has a timeout, and failed connections and server errors are retried with exponential
+    backoff. The number of bytes transferred and the latency are counted for each host.
+
+    Every request, whichever collector makes it, counts against BCF_REQUEST_BUDGET requests an hour. Requests over
+    the budget raise BudgetExceeded without being made.
+    """
+
+    def __init__(self, timeout: float = None, retries: int = None, backoff: float = None,
+                 pool_size: int = None, budget: RequestBudget = None):
+        """
+        :param timeout: timeout for each request, in seconds
+        :type timeout: float
+        :param retries: how many times to retry a failed request
+        :type retries: int
+        :param backoff: backoff factor between retries, in seconds
+        :type backoff: float
+        :param pool_size: how many connections to keep open to each host
+        :type pool_size: int
+        :param budget: the request budget to count requests against (defaults to BCF_REQUEST_BUDGET an hour)
+        :type budget: RequestBudget
+        """
+
+        self.timeout = timeout or settings.BCF_HTTP_TIMEOUT
+
+        retry = Retry(
+            total=settings.BCF_HTTP_RETRIES if retries is None else retries,
+            backoff_factor=settings.BCF_HTTP_BACKOFF if backoff is None else backoff,
+            status_forcelist=[500, 502, 503, 504],
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry,
+            pool_maxsize=pool_size or settings.BCF_FETCH_CONCURRENCY
+        )
+
+        self.session = requests.Session()
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.budget = budget or RequestBudget(settings.BCF_REQUEST_BUDGET)
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """ Make a GET request.
+
+        :param url: the URL to request
+        :type url: str
+        :returns: the response
+        :rtype: requests.Response
+        """
+
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).netloc
+
+        if not self.budget.take():
+            logger.warning("Not requesting {}, as the request budget has been used up".format(url))
+            raise BudgetExceeded("Request budget of {} requests has been used up".format(self.budget.budget))
+
+        start = monotonic()
+
+        try:
+            response = self.session.get(url, **kwargs)
+        except Exception:
+            self.record(host, monotonic() - start, error=True)
+            raise
+
+        # The raw stream reports how many (possibly compressed) bytes came over the wire
+        content = response.content
+        self.record(
+            host,
+            monotonic() - start,
+            error=response.status_code >= 400,
+            size=response.raw.tell() if response.raw else len(content),
+            decoded_size=len(content)
+        )
+
+        return response
+
+    def record(self, host: str, latency: float, error: bool = False, size: int = 0,
+               decoded_size: int = 0) -> None:
+        """ Add a request to the stats for a host.
+
+        :returns: nothing
+        :rtype: None
+        """
+
+        with self.lock:
+            stats = self.stats.setdefault(host, HostStats())
+            stats.requests += 1
+            stats.latency += latency
+            stats.bytes += size
+            stats.decoded_bytes += decoded_size
+            if error:
+                stats.errors += 1
+
+        logger.debug("{} responded in {:.3f}s ({} bytes)".format(host, latency, size))
+
+    @property
+    def host_stats(self) -> dict:
+        """ Return the request stats for each host.
+
+        :returns: dict of host to stats
+        :rtype: dict
+        """
+
+        with self.lock:
+            return {host: stats.as_dict for host, stats in self.stats.items()}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> Client:
+    """ Return the shared Client, creating it if need be.
+
+    :returns: the shared Client
+    :rtype: Client
+    """
+
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            _client = Client()
+
+    return _client
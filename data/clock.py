@@ -0,0 +1,37 @@
+import threading
+from contextlib import contextmanager
+from django.utils import timezone as tz
+from datetime import datetime
+
+_local = threading.local()
+
+
+def now() -> datetime:
+    """ Return the time the collectors should treat as now.
+
+    This is the current time, unless a page captured earlier is being processed inside captured_at(), in which case
+    it's the time the page was captured.
+
+    :returns: the current (or captured) time, in UTC
+    :rtype: datetime
+    """
+
+    captured = getattr(_local, "captured_at", None)
+    return captured if captured is not None else tz.now()
+
+
+@contextmanager
+def captured_at(timestamp: datetime):
+    """ Treat the given time as now while processing a page captured at that time, on this thread.
+
+    :param timestamp: the time the page was captured
+    :type timestamp: datetime
+    """
+
+    previous = getattr(_local, "captured_at", None)
+    _local.captured_at = timestamp
+
+    try:
+        yield
+    finally:
+        _local.captured_at = previous
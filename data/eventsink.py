@@ -0,0 +1,200 @@
+import logging
+from collections import defaultdict
+from django.db import connection, models
+from typing import Iterable, List, Optional
+
+from . import clock
+from .models import EventLog
+
+logger = logging.getLogger(__name__)
+
+
+def reserve_ids(model, count: int) -> Optional[List[int]]:
+    """ Reserve a block of primary keys for a model from its sequence, so rows can be inserted with known IDs.
+
+    :param model: the model to reserve IDs for
+    :type model: models.Model
+    :param count: how many IDs to reserve
+    :type count: int
+    :returns: list of reserved IDs, or None if this database doesn't have sequences
+    :rtype: list
+    """
+
+    if connection.vendor != "postgresql":
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+            [model._meta.db_table, model._meta.pk.column, count]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def insert_sql(model, fields: list) -> str:
+    """ Return the SQL to insert a row into a model's table.
+
+    :param model: the model whose table the row goes in
+    :type model: models.Model
+    :param fields: the fields to insert
+    :type fields: list
+    :returns: the INSERT statement, with a placeholder for each field
+    :rtype: str
+    """
+
+    return "INSERT INTO {} ({}) VALUES ({})".format(
+        connection.ops.quote_name(model._meta.db_table),
+        ", ".join(connection.ops.quote_name(field.column) for field in fields),
+        ", ".join(["%s"] * len(fields))
+    )
+
+
+def row_values(obj: models.Model, fields: list) -> list:
+    """ Return the values to insert for an object, as the database stores them. """
+
+    return [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+
+
+def insert_rows(model, objs: List[models.Model], fields: list) -> None:
+    """ Insert a row into a model's table for each object, with a single statement.
+
+    :param model: the model whose table the rows go in
+    :type model: models.Model
+    :param objs: the objects to insert, with their values already filled in
+    :type objs: list
+    :param fields: the fields to insert
+    :type fields: list
+    :returns: nothing
+    :rtype: None
+    """
+
+    with connection.cursor() as cursor:
+        cursor.executemany(insert_sql(model, fields), [row_values(obj, fields) for obj in objs])
+
+
+def insert_base_rows(model, objs: List[models.Model]) -> None:
+    """ Insert the base table rows for some events, and give them the IDs the database picked.
+
+    This needs to be called inside a transaction. Where the database has sequences, the IDs are taken from the
+    sequence first. SQLite hands out IDs in order and holds the write lock until the transaction ends, so once the
+    rows are in, the newest IDs in the table are theirs. Anything else inserts the rows one at a time, to get each ID
+    back from the database.
+
+    :param model: the base model
+    :type model: models.Model
+    :param objs: the events to insert
+    :type objs: list
+    :returns: nothing
+    :rtype: None
+    """
+
+    pk = model._meta.pk
+    fields = [field for field in model._meta.local_concrete_fields if field is not pk]
+
+    ids = reserve_ids(model, len(objs))
+    if ids is not None:
+        for obj, id in zip(objs, ids):
+            setattr(obj, pk.attname, id)
+        insert_rows(model, objs, [pk] + fields)
+
+    elif connection.vendor == "sqlite":
+        insert_rows(model, objs, fields)
+        ids = list(model._base_manager.order_by('-pk').values_list('pk', flat=True)[:len(objs)])
+        for obj, id in zip(objs, reversed(ids)):
+            setattr(obj, pk.attname, id)
+
+    else:
+        logger.warning("Can't insert {} rows in bulk on {}, inserting them one at a time".format(
+            model.__name__, connection.vendor
+        ))
+        with connection.cursor() as cursor:
+            for obj in objs:
+                cursor.execute(insert_sql(model, fields), row_values(obj, fields))
+                setattr(obj, pk.attname, connection.ops.last_insert_id(cursor, model._meta.db_table, pk.column))
+
+
+class EventSink:
+    """ Collect the events from a collector run, and insert them in bulk.
+
+    The events are django-polymorphic multi-table models, so saving one writes a row to the base table (such as
+    SailingEvent) and another to the table for its type (such as FerryEvent). Django can't bulk_create these, so
+    the sink inserts the base table rows first, then the rows for each table below them in one go with the same IDs.
+    The entries for the flat event log are inserted along with them.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def add(self, events: Iterable[models.Model]) -> None:
+        """ Queue events to be inserted.
+
+        :param events: the events to insert
+        :type events: Iterable[models.Model]
+        :returns: nothing
+        :rtype: None
+        """
+
+        self.events.extend(events)
+
+    def prepare(self, event: models.Model) -> None:
+        """ Fill in what save() would have filled in before inserting an event. """
+
+        # Related objects may not have had IDs when they were assigned to the event
+        for field in event._meta.concrete_fields:
+            if field.is_relation and field.is_cached(event):
+                related = field.get_cached_value(event)
+                if related is not None:
+                    setattr(event, field.attname, related.pk)
+
+        event.pre_save_polymorphic()
+
+        # Set the auto_now timestamps (to the time the page was captured, if we're processing an older page)
+        now = clock.now()
+        for field in event._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                setattr(event, field.attname, now)
+            else:
+                field.pre_save(event, True)
+
+    def flush(self) -> int:
+        """ Insert all of the queued events. This should be called inside a transaction.
+
+        :returns: the number of events inserted
+        :rtype: int
+        """
+
+        events = self.events
+        self.events = []
+
+        # Group the events by the base table they share IDs with, keeping them in the order they were added
+        bases = defaultdict(list)
+        for event in events:
+            self.prepare(event)
+            bases[event._meta.get_parent_list()[-1] if event._meta.parents else type(event)].append(event)
+
+        for base, base_events in bases.items():
+            insert_base_rows(base, base_events)
+
+            # Every table below the base shares its primary key value
+            tables = defaultdict(list)
+            for event in base_events:
+                pk = getattr(event, base._meta.pk.attname)
+                for model in [type(event)] + event._meta.get_parent_list()[:-1] if event._meta.parents else []:
+                    setattr(event, model._meta.pk.attname, pk)
+                    tables[model].append(event)
+
+            # Insert the tables closest to the base first
+            for model in sorted(tables, key=lambda model: len(model._meta.get_parent_list())):
+                insert_rows(model, tables[model], model._meta.local_concrete_fields)
+                logger.debug("Inserted {} {} rows".format(len(tables[model]), model.__name__))
+
+            for event in base_events:
+                event._state.adding = False
+                event._state.db = connection.alias
+
+            EventLog.objects.bulk_create([EventLog.from_event(event) for event in base_events])
+
+        return len(events)
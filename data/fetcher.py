@@ -0,0 +1,135 @@
+import requests
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from time import monotonic, sleep
+from typing import Iterable, List, Tuple, Union
+from urllib.parse import urlsplit
+
+from .client import Client, get_client
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """ Limit how often requests can be started against each host. """
+
+    def __init__(self, rate: float):
+        """
+        :param rate: maximum number of requests per second for each host (0 for no limit)
+        :type rate: float
+        """
+
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host: str) -> None:
+        """ Wait until a request can be made to the given host.
+
+        :param host: the host the request is for
+        :type host: str
+        :returns: nothing
+        :rtype: None
+        """
+
+        if not self.interval:
+            return
+
+        # Reserve the next slot for this host, then sleep outside of the lock until it comes around
+        with self.lock:
+            now = monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+
+        if slot > now:
+            sleep(slot - now)
+
+
+class Fetcher:
+    """ Fetch a number of pages concurrently, while being polite to the BC Ferries website.
+
+    Pages are fetched on a bounded thread pool sharing the client's connection pool, and requests to
+    each host are rate limited. Wall-clock time for a batch of pages therefore depends on the rate
+    limit rather than on the number of pages multiplied by the latency.
+    """
+
+    def __init__(self, concurrency: int = None, rate_limit: float = None, client: Client = None):
+        """
+        :param concurrency: the maximum number of requests in flight at once
+        :type concurrency: int
+        :param rate_limit: the maximum number of requests per second for each host
+        :type rate_limit: float
+        :param client: the client to make requests with (defaults to the shared client)
+        :type client: Client
+        """
+
+        self.concurrency = concurrency or settings.BCF_FETCH_CONCURRENCY
+        self.limiter = RateLimiter(
+            settings.BCF_FETCH_RATE_LIMIT if rate_limit is None else rate_limit
+        )
+        self.client = client or get_client()
+
+    def get(self, url: str, headers: dict = None) -> requests.Response:
+        """ Fetch a single page, respecting the rate limit.
+
+        :param url: the URL to fetch
+        :type url: str
+        :param headers: optional extra headers to send
+        :type headers: dict
+        :returns: the response
+        :rtype: requests.Response
+        """
+
+        self.limiter.wait(urlsplit(url).netloc)
+        logger.debug("Querying {}...".format(url))
+        return self.client.get(url, headers=headers)
+
+    def _get(self, url: str, headers: dict = None) -> Union[requests.Response, Exception]:
+        try:
+            return self.get(url, headers)
+        except Exception as e:
+            return e
+
+    def fetch_all(self, urls: Iterable[str], headers: dict = None) -> List[Tuple[str, Union[requests.Response, Exception]]]:
+        """ Fetch a number of pages concurrently.
+
+        Errors don't stop the other pages being fetched - they're returned in place of the response
+        for the page that failed.
+
+        :param urls: the URLs to fetch
+        :type urls: Iterable[str]
+        :param headers: optional dict of URL to extra headers to send for that URL
+        :type headers: dict
+        :returns: list of (url, response or exception) tuples, in the same order as the URLs
+        :rtype: list
+        """
+
+        urls = list(urls)
+        headers = headers or {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(self._get, urls, [headers.get(url) for url in urls]))
+
+        return list(zip(urls, results))
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> Fetcher:
+    """ Return the shared Fetcher, creating it if need be.
+
+    :returns: the shared Fetcher
+    :rtype: Fetcher
+    """
+
+    global _fetcher
+
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = Fetcher()
+
+    return _fetcher
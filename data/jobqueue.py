@@ -0,0 +1,215 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from django.utils import timezone as tz
+from time import monotonic
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+
+class QueuedJob:
+    """ A single run of a task submitted to the JobQueue. """
+
+    def __init__(self, name: str):
+        """
+        :param name: the name of the task to run
+        :type name: str
+        """
+
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = QUEUED
+        self.submitted = tz.now()
+        self.started = None
+        self.finished = None
+        self.duration = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout: float = None) -> bool:
+        """ Wait for the job to finish.
+
+        :param timeout: the longest to wait, in seconds (defaults to waiting for as long as it takes)
+        :type timeout: float
+        :returns: whether the job finished
+        :rtype: bool
+        """
+
+        return self.done.wait(timeout)
+
+    @property
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "submitted": self.submitted.isoformat(),
+            "started": self.started.isoformat() if self.started else None,
+            "finished": self.finished.isoformat() if self.finished else None,
+            "duration": self.duration,
+            "result": self.result if isinstance(self.result, (bool, int, float, str, type(None))) else None,
+            "error": self.error
+        }
+
+
+class JobQueue:
+    """ Run tasks in the background when they're asked for.
+
+    Each task runs on its own thread, and only one run of a task happens at once. Asking for a task that's already
+    running queues up another run to start once it's finished, and asking for a task that's already queued just
+    returns the queued run, so however many times a task is asked for, it's never run twice in parallel or queued up
+    more than once.
+
+    A task made up of other tasks can run them with run(), so they're deduplicated against runs of the same tasks asked
+    for on their own.
+
+    Finished runs are kept around (up to a limit) so their status can be looked up by ID.
+    """
+
+    def __init__(self, tasks: Dict[str, Callable], history: int = 100):
+        """
+        :param tasks: dict of task name to the function to run
+        :type tasks: dict
+        :param history: how many runs to keep for looking up
+        :type history: int
+        """
+
+        self.tasks = tasks
+        self.history = history
+        self.executor = ThreadPoolExecutor(max_workers=max(len(tasks), 1))
+        self.lock = threading.Lock()
+
+        self.jobs = OrderedDict()
+        self.running = {}
+        self.queued = {}
+        self.last = {}
+
+    def submit(self, name: str) -> QueuedJob:
+        """ Ask for a task to be run.
+
+        :param name: the name of the task
+        :type name: str
+        :returns: the run of the task, which may have been queued already
+        :rtype: QueuedJob
+        """
+
+        if name not in self.tasks:
+            raise KeyError("Unknown task {}".format(name))
+
+        with self.lock:
+            if name in self.queued:
+                logger.debug("Task {} is already queued as {}".format(name, self.queued[name].id))
+                return self.queued[name]
+
+            job = QueuedJob(name)
+            self.jobs[job.id] = job
+
+            # Forget about the oldest runs, as long as they've finished
+            while len(self.jobs) > self.history:
+                oldest = next(iter(self.jobs.values()))
+                if not oldest.done.is_set():
+                    break
+                self.jobs.popitem(last=False)
+
+            if name in self.running:
+                logger.debug("Task {} is running, queued {} to run after it".format(name, job.id))
+                self.queued[name] = job
+            else:
+                self.start(job)
+
+        return job
+
+    def run(self, name: str) -> Any:
+        """ Ask for a task to be run, and wait for it to finish. If the task is already queued, this waits for the
+        queued run rather than asking for another.
+
+        :param name: the name of the task
+        :type name: str
+        :returns: the task's result
+        :rtype: Any
+        """
+
+        job = self.submit(name)
+        job.wait()
+
+        if job.status == FAILED:
+            raise RuntimeError("Task {} failed: {}".format(name, job.error))
+
+        return job.result
+
+    def start(self, job: QueuedJob) -> None:
+        """ Start a run. This should be called with the lock held. """
+
+        self.running[job.name] = job
+        self.executor.submit(self.execute, job)
+
+    def execute(self, job: QueuedJob) -> None:
+        """ Run a task, and record how it went. """
+
+        job.status = RUNNING
+        job.started = tz.now()
+        start = monotonic()
+        logger.info("Running {} ({})".format(job.name, job.id))
+
+        try:
+            job.result = self.tasks[job.name]()
+            job.status = FINISHED
+        except Exception as e:
+            logger.exception("Task {} ({}) failed".format(job.name, job.id))
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            # Each task runs on its own thread, so don't leave its connection open
+            connection.close()
+
+        job.duration = monotonic() - start
+        job.finished = tz.now()
+        logger.info("Finished {} ({}) in {:.3f}s".format(job.name, job.id, job.duration))
+
+        with self.lock:
+            del self.running[job.name]
+            self.last[job.name] = job
+
+            # Start the next run of this task if one was asked for while this one was running
+            queued = self.queued.pop(job.name, None)
+            if queued:
+                self.start(queued)
+
+        job.done.set()
+
+    def get(self, job_id: str) -> Optional[QueuedJob]:
+        """ Return the run with the given ID, if we still have it. """
+
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def shutdown(self) -> None:
+        """ Stop taking new runs, and wait for the ones that have already started. """
+
+        self.executor.shutdown(wait=True)
+
+    @property
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                "queue_depth": len(self.queued),
+                "running": [job.as_dict for job in self.running.values()],
+                "queued": [job.as_dict for job in self.queued.values()],
+                "tasks": {
+                    name: {
+                        "last_run": self.last[name].as_dict if name in self.last else None,
+                        "running": name in self.running,
+                        "queued": name in self.queued
+                    } for name in self.tasks
+                }
+            }
@@ -0,0 +1,221 @@
+import logging
+import threading
+from django.conf import settings
+from typing import List
+
+from .scheduler import Clock
+
+logger = logging.getLogger(__name__)
+
+# Routes with a ferry locations map
+LOCATION_ROUTES = ['0', '1', '2', '3', '4', '5', '6', '7', '13']
+
+
+class RouteState:
+    """ When to next fetch the ferry locations for a route, and how often they've been changing.
+
+    Each route starts out at its own interval. Every time the page comes back unchanged, the interval is multiplied by
+    the backoff (up to the maximum), and as soon as it changes the interval drops back to where it started. Routes that
+    are quiet for hours are fetched rarely, while busy routes are fetched every time they're due.
+    """
+
+    def __init__(self, route_number: str, interval: float, max_interval: float, backoff: float, start: float = 0):
+        """
+        :param route_number: the route number of the locations map
+        :type route_number: str
+        :param interval: how often to fetch the route while it's changing, in seconds
+        :type interval: float
+        :param max_interval: the longest to go without fetching the route, in seconds
+        :type max_interval: float
+        :param backoff: how much to multiply the interval by each time the route is unchanged
+        :type backoff: float
+        :param start: when the route is first due, by the poller's clock
+        :type start: float
+        """
+
+        self.route_number = route_number
+        self.base_interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        self.interval = interval
+        self.due = start
+        self.started = start
+
+        self.fetches = 0
+        self.changes = 0
+        self.errors = 0
+        self.last_fetched = None
+        self.last_changed = None
+
+    def record(self, now: float, changed: bool, error: bool = False) -> None:
+        """ Record a fetch of the route, and work out when it's next due.
+
+        :param now: when the route was fetched, by the poller's clock
+        :type now: float
+        :param changed: whether the page had changed
+        :type changed: bool
+        :param error: whether the fetch failed
+        :type error: bool
+        :returns: nothing
+        :rtype: None
+        """
+
+        self.fetches += 1
+        self.last_fetched = now
+
+        if error:
+            # Try again at the same interval
+            self.errors += 1
+        elif changed:
+            self.changes += 1
+            self.last_changed = now
+            self.interval = self.base_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+
+        self.due = now + self.interval
+
+    def as_dict(self, now: float) -> dict:
+        """ Return the state of the route, and its fetch and change rates.
+
+        :param now: the current time, by the poller's clock
+        :type now: float
+        :returns: dict representation of the route's state
+        :rtype: dict
+        """
+
+        hours = (now - self.started) / 3600
+
+        return {
+            "route_number": self.route_number,
+            "interval": self.interval,
+            "due_in": max(self.due - now, 0),
+            "fetches": self.fetches,
+            "changes": self.changes,
+            "errors": self.errors,
+            "fetches_per_hour": self.fetches / hours if hours else None,
+            "changes_per_hour": self.changes / hours if hours else None,
+            "change_rate": self.changes / self.fetches if self.fetches else None,
+            "last_fetched": now - self.last_fetched if self.last_fetched is not None else None,
+            "last_changed": now - self.last_changed if self.last_changed is not None else None
+        }
+
+
+class LocationPoller:
+    """ Keep track of which ferry locations maps are due to be fetched.
+
+    get_ferry_locations() records how every route it fetches went, so the poller's state is kept up to date however
+    the routes were fetched.
+    """
+
+    def __init__(self, routes: List[str] = None, config: dict = None, clock: Clock = None):
+        """
+        :param routes: the route numbers to poll (defaults to every route with a locations map)
+        :type routes: list
+        :param config: intervals and backoff to use instead of BCF_LOCATION_POLLING
+        :type config: dict
+        :param clock: the time source (defaults to the system clock)
+        :type clock: Clock
+        """
+
+        routes = LOCATION_ROUTES if routes is None else routes
+        config = config or settings.BCF_LOCATION_POLLING
+
+        self.clock = clock or Clock()
+        self.lock = threading.Lock()
+
+        now = self.clock.monotonic()
+        self.routes = {}
+        for route_number in routes:
+            route_config = dict(config, **config.get("routes", {}).get(route_number, {}))
+            self.routes[route_number] = RouteState(
+                route_number, route_config["interval"], route_config["max_interval"], route_config["backoff"], now
+            )
+
+    def due(self) -> List[str]:
+        """ Return the routes that are due to be fetched.
+
+        :returns: list of route numbers
+        :rtype: list
+        """
+
+        now = self.clock.monotonic()
+
+        with self.lock:
+            return [route_number for route_number, state in self.routes.items() if state.due <= now]
+
+    def expedite(self, route_numbers: List[str] = None) -> None:
+        """ Make routes due straight away, so they're fetched the next time the due routes are.
+
+        :param route_numbers: the routes to make due (defaults to all of them)
+        :type route_numbers: list
+        :returns: nothing
+        :rtype: None
+        """
+
+        now = self.clock.monotonic()
+
+        with self.lock:
+            for route_number, state in self.routes.items():
+                if route_numbers is None or route_number in route_numbers:
+                    state.due = min(state.due, now)
+
+    def next_due(self) -> float:
+        """ Return how long until the next route is due, in seconds. """
+
+        with self.lock:
+            return max(min(state.due for state in self.routes.values()) - self.clock.monotonic(), 0)
+
+    def record(self, route_number: str, changed: bool, error: bool = False) -> None:
+        """ Record a fetch of a route.
+
+        :param route_number: the route number that was fetched
+        :type route_number: str
+        :param changed: whether the page had changed
+        :type changed: bool
+        :param error: whether the fetch failed
+        :type error: bool
+        :returns: nothing
+        :rtype: None
+        """
+
+        with self.lock:
+            state = self.routes.get(route_number)
+            if state is None:
+                return
+
+            state.record(self.clock.monotonic(), changed, error)
+
+        logger.debug("Locations for route {} {}, next due in {:.0f}s".format(
+            route_number, "failed" if error else "changed" if changed else "unchanged", state.interval
+        ))
+
+    @property
+    def as_dict(self) -> dict:
+        now = self.clock.monotonic()
+
+        with self.lock:
+            return {
+                route_number: state.as_dict(now) for route_number, state in self.routes.items()
+            }
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_location_poller() -> LocationPoller:
+    """ Return the shared LocationPoller, creating it if need be.
+
+    :returns: the shared LocationPoller
+    :rtype: LocationPoller
+    """
+
+    global _poller
+
+    with _poller_lock:
+        if _poller is None:
+            _poller = LocationPoller()
+
+    return _poller
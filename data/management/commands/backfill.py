@@ -0,0 +1,304 @@
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from collector.models import ConditionsRawHTML, DeparturesRawHTML, LocationsRawHTML, RawHTML
+from data import clock
+from data.models import EventLog, Sailing, SailingEvent, SailingNorm
+from data.references import get_reference_cache
+from data.utils import get_actual_departures, get_current_conditions, get_ferry_locations
+from dateutil.parser import parse
+from multiprocessing import Pool
+from time import perf_counter
+from typing import List, Tuple
+import logging
+import os
+import pytz
+import re
+
+logger = logging.getLogger(__name__)
+
+# Sailings after midnight belong to the previous day's service until this many hours past midnight
+SERVICE_DAY_START = 3
+
+# How many pages to load from the database at once
+CHUNK_SIZE = 200
+
+PAGE_MODELS = OrderedDict([
+    ("departures", DeparturesRawHTML),
+    ("conditions", ConditionsRawHTML),
+    ("locations", LocationsRawHTML)
+])
+
+
+def service_day(timestamp: datetime) -> date:
+    """ Return the service day a page captured at the given time belongs to.
+
+    :param timestamp: when the page was captured
+    :type timestamp: datetime
+    :returns: the (local) service day
+    :rtype: date
+    """
+
+    local = timestamp.astimezone(pytz.timezone(settings.DISPLAY_TIME_ZONE))
+    return (local - timedelta(hours=SERVICE_DAY_START)).date()
+
+
+def load_pages(pages: List[Tuple[int, str]]):
+    """ Yield the given pages, in the order given, loading them from the database a chunk at a time.
+
+    :param pages: list of (page ID, page type)
+    :type pages: list
+    """
+
+    for offset in range(0, len(pages), CHUNK_SIZE):
+        chunk = pages[offset:offset + CHUNK_SIZE]
+
+        loaded = {}
+        for kind, model in PAGE_MODELS.items():
+            ids = [page_id for page_id, page_kind in chunk if page_kind == kind]
+            if ids:
+                loaded.update(model.objects.filter(pk__in=ids).select_related('blob', 'run').in_bulk())
+
+        for page_id, kind in chunk:
+            if page_id in loaded:
+                yield kind, loaded[page_id]
+
+
+def backfill_partition(partition: Tuple[str, List[Tuple[int, str]]]) -> dict:
+    """ Run the pages in one partition back through the collectors, as of the time each one was captured.
+
+    This runs in a worker process, so it's kept at the module level where it can be pickled.
+
+    :param partition: the name of the partition, and its list of (page ID, page type) in the order to process them
+    :type partition: tuple
+    :returns: dict of the partition's name, and how many pages and runs were processed
+    :rtype: dict
+    """
+
+    name, pages = partition
+    start = perf_counter()
+    stats = {"partition": name, "pages": 0, "runs": 0, "failures": 0}
+
+    # Don't trust anything cached by the parent process before it forked
+    get_reference_cache().invalidate()
+
+    def run(collector, captured, **kwargs):
+        with clock.captured_at(captured):
+            succeeded = collector(**kwargs)
+
+        stats["runs"] += 1
+        stats["failures"] += 0 if succeeded else 1
+
+    try:
+        group = {}
+        group_run = None
+
+        for kind, page in load_pages(pages):
+            stats["pages"] += 1
+
+            # Location maps from the same run are processed together, as they were originally
+            if group and (kind != "locations" or page.run_id != group_run):
+                run(get_ferry_locations, group_captured, pages=group)
+                group = {}
+
+            if kind == "departures":
+                run(get_actual_departures, page.run.timestamp, page=page)
+            elif kind == "conditions":
+                run(get_current_conditions, page.run.timestamp, page=page)
+            else:
+                group[re.search(r'route(\d+)\.html', page.url).group(1)] = page
+                group_run = page.run_id
+                group_captured = page.run.timestamp
+
+        if group:
+            run(get_ferry_locations, group_captured, pages=group)
+    finally:
+        connections.close_all()
+
+    stats["seconds"] = perf_counter() - start
+    return stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild sailings and events from the stored pages, processing each one as of the time it was captured"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from-id', type=int, help="First stored page to process")
+        parser.add_argument('--to-id', type=int, help="Last stored page to process")
+        parser.add_argument('--since', type=parse, help="Process pages captured since this time")
+        parser.add_argument('--until', type=parse, help="Process pages captured before this time")
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help="Number of worker processes (defaults to the number of CPUs)")
+        parser.add_argument('--clear', action='store_true',
+                            help="Delete the sailings and events already derived for the period first")
+
+    def localize(self, timestamp):
+        if timestamp and timestamp.tzinfo is None:
+            return pytz.timezone(settings.DISPLAY_TIME_ZONE).localize(timestamp)
+        return timestamp
+
+    def select(self, options: dict) -> list:
+        """ Return (page ID, page type, run ID, capture time) for each selected page, in the order captured.
+
+        :returns: list of tuples
+        :rtype: list
+        """
+
+        kinds = {
+            ContentType.objects.get_for_model(model, for_concrete_model=False).pk: kind
+            for kind, model in PAGE_MODELS.items()
+        }
+
+        pages = RawHTML.objects.non_polymorphic().filter(polymorphic_ctype__in=list(kinds))
+
+        if options['from_id']:
+            pages = pages.filter(pk__gte=options['from_id'])
+        if options['to_id']:
+            pages = pages.filter(pk__lte=options['to_id'])
+        if options['since']:
+            pages = pages.filter(run__timestamp__gte=self.localize(options['since']))
+        if options['until']:
+            pages = pages.filter(run__timestamp__lt=self.localize(options['until']))
+
+        return [
+            (page_id, kinds[ctype], run_id, timestamp)
+            for page_id, ctype, run_id, timestamp in pages.order_by('pk').values_list(
+                'pk', 'polymorphic_ctype', 'run', 'run__timestamp'
+            ).iterator()
+        ]
+
+    def partition(self, pages: list) -> list:
+        """ Split the pages into stages, each made up of partitions that can be processed in parallel.
+
+        Departures pages are split up by service day, as those are the sailings they update. Ferry locations and
+        conditions carry their state over from one run to the next (the ferries, and the waits on each route), so
+        they're each kept in a single partition, in the order they were captured. Conditions update the sailings that
+        departures create, so they're processed in a second stage, once all of the departures have been.
+
+        :returns: list of stages, each a list of (name, [(page ID, page type)])
+        :rtype: list
+        """
+
+        days = OrderedDict()
+        locations = []
+        conditions = []
+
+        for page_id, kind, run_id, timestamp in pages:
+            if kind == "locations":
+                locations.append((page_id, kind))
+            elif kind == "conditions":
+                conditions.append((page_id, kind))
+            else:
+                days.setdefault(service_day(timestamp).isoformat(), []).append((page_id, kind))
+
+        partitions = list(days.items())
+        if locations:
+            partitions.append(("locations", locations))
+
+        # Start the biggest partitions first, so a big one isn't left running on its own at the end
+        stages = [sorted(partitions, key=lambda partition: len(partition[1]), reverse=True)]
+        if conditions:
+            stages.append([("conditions", conditions)])
+
+        return [stage for stage in stages if stage]
+
+    def clear(self, pages: list) -> None:
+        """ Delete everything derived from the pages for the period they cover. """
+
+        tz = pytz.timezone(settings.DISPLAY_TIME_ZONE)
+        days = sorted({service_day(timestamp) for page_id, kind, run_id, timestamp in pages if kind != "locations"})
+
+        if days:
+            first = tz.localize(datetime.combine(days[0], datetime.min.time())) + timedelta(hours=SERVICE_DAY_START)
+            last = tz.localize(datetime.combine(days[-1], datetime.min.time())) + timedelta(
+                days=1, hours=SERVICE_DAY_START
+            )
+
+            sailings = list(Sailing.objects.filter(
+                scheduled_departure__gte=first, scheduled_departure__lt=last
+            ).values_list('pk', flat=True))
+
+            for offset in range(0, len(sailings), 500):
+                batch = sailings[offset:offset + 500]
+                EventLog.objects.filter(entity="sailing", entity_id__in=batch).delete()
+                SailingEvent.objects.non_polymorphic().filter(sailing__in=batch).delete()
+                Sailing.objects.filter(pk__in=batch).delete()
+
+            logger.info("Cleared {} sailings between {} and {}".format(len(sailings), first, last))
+
+        start = min(timestamp for page_id, kind, run_id, timestamp in pages)
+        end = max(timestamp for page_id, kind, run_id, timestamp in pages)
+
+        # Events that aren't for a sailing are cleared by when they happened
+        for base, entity, field in EventLog.ENTITIES:
+            if base is SailingEvent:
+                continue
+
+            base.objects.non_polymorphic().filter(timestamp__gte=start, timestamp__lte=end).delete()
+            EventLog.objects.filter(entity=entity, timestamp__gte=start, timestamp__lte=end).delete()
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        if processes < 1:
+            raise CommandError("--processes must be at least 1")
+
+        if processes > 1 and connection.vendor == "sqlite":
+            # SQLite only allows one writer at a time, so the workers would just wait on each other
+            logger.warning("SQLite doesn't support parallel writes, using a single process")
+            print("WARNING: SQLite doesn't support parallel writes, using a single process")
+            processes = 1
+
+        pages = self.select(options)
+        if not pages:
+            print("No pages to process")
+            return
+
+        if options['clear']:
+            self.clear(pages)
+
+        stages = self.partition(pages)
+        print("Processing {} pages in {} partitions with {} processes".format(
+            len(pages), sum(len(stage) for stage in stages), processes
+        ))
+
+        start = perf_counter()
+        totals = {"pages": 0, "runs": 0, "failures": 0}
+
+        def report(stats):
+            for key in totals:
+                totals[key] += stats[key]
+
+            print("{:<12} {:>6} pages {:>6} runs {:>8.2f}s".format(
+                stats["partition"], stats["pages"], stats["runs"], stats["seconds"]
+            ))
+
+            if stats["failures"]:
+                print("  WARNING: {} runs failed".format(stats["failures"]))
+
+        if processes == 1:
+            for stage in stages:
+                for partition in stage:
+                    report(backfill_partition(partition))
+        else:
+            # Don't share the parent's database connections with the workers
+            connections.close_all()
+
+            with Pool(processes) as pool:
+                # Each stage is finished before the next one starts
+                for stage in stages:
+                    for stats in pool.imap_unordered(backfill_partition, stage):
+                        report(stats)
+
+        # The norms are built from every arrived sailing, so rebuild them in one go at the end
+        SailingNorm.rebuild()
+
+        elapsed = perf_counter() - start
+        print("Processed {} pages in {} runs in {:.2f}s ({:.1f} pages/s)".format(
+            totals["pages"], totals["runs"], elapsed, totals["pages"] / elapsed if elapsed else 0
+        ))
+
+        if totals["failures"]:
+            print("WARNING: {} runs failed".format(totals["failures"]))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from data.models import EventLog
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Rebuild the flat event log from the events"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--if-empty', action='store_true',
+                            help="Only build the log if it's empty, such as just after it has been added")
+
+    def handle(self, *args, **options):
+        if options['if_empty'] and EventLog.objects.exists():
+            self.stdout.write("The event log has already been built")
+            return
+
+        # The event text is rendered by the event models themselves, so this is done here with the current models
+        # rather than in a migration
+        count = EventLog.rebuild()
+        self.stdout.write("Logged {} events".format(count))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from data.models import SailingNorm
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Rebuild the historical sailing norms"
+
+    def handle(self, *args, **options):
+        count = SailingNorm.rebuild()
+        self.stdout.write("Rebuilt norms for {} sailings".format(count))
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from collector.models import ConditionsRawHTML, DeparturesRawHTML, LocationsRawHTML
+from data.parsers import available_parsers, make_soup, location_rows, soup_location_rows
+from time import perf_counter
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Benchmark the HTML parsers against the stored pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100, help="Maximum number of pages of each type")
+        parser.add_argument('--repeat', type=int, default=3, help="Number of times to parse each page")
+
+    def time(self, pages: list, parse, repeat: int) -> float:
+        """ Return the average time in milliseconds to parse a page. """
+
+        start = perf_counter()
+        for _ in range(repeat):
+            for page in pages:
+                parse(page)
+
+        return (perf_counter() - start) * 1000 / (len(pages) * repeat)
+
+    def handle(self, *args, **options):
+        corpus = {
+            "departures": DeparturesRawHTML,
+            "conditions": ConditionsRawHTML,
+            "locations": LocationsRawHTML
+        }
+
+        for name, model in corpus.items():
+            pages = [
+                page.content for page in model.objects.select_related('blob').order_by('-pk')[:options['limit']]
+            ]
+
+            if not pages:
+                print("{}: no stored pages".format(name))
+                continue
+
+            print("{} ({} pages, {:.1f}KB average)".format(
+                name, len(pages), sum(len(page) for page in pages) / len(pages) / 1024
+            ))
+
+            for parser in available_parsers():
+                print("  {:<12} {:8.3f}ms/page".format(
+                    parser, self.time(pages, lambda page: make_soup(page, parser), options['repeat'])
+                ))
+
+            if name == "locations":
+                print("  {:<12} {:8.3f}ms/page".format(
+                    "regex", self.time(pages, location_rows, options['repeat'])
+                ))
+
+                # Make sure the regex extraction agrees with the tree builders
+                mismatches = sum(
+                    1 for page in pages if location_rows(page) != soup_location_rows(page, "html.parser")
+                )
+                if mismatches:
+                    print("  WARNING: regex extraction differs on {} pages".format(mismatches))
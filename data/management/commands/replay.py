@@ -0,0 +1,292 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from collector.models import (ConditionsRawHTML, ConditionsRun, DeparturesRawHTML, DeparturesRun, LocationsRawHTML,
+                              LocationsRun, RawHTML)
+from data import clock
+from data.parsers import parse_conditions, parse_departures, parse_locations, ParseError
+from data.references import get_reference_cache
+from data.utils import get_actual_departures, get_current_conditions, get_ferry_locations
+from dateutil.parser import parse
+from time import perf_counter
+import json
+import logging
+import os
+import pytz
+import re
+import tempfile
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# Page file names, as written by --dump - anything before the page type groups location maps into runs
+PAGE_FILE = re.compile(r'^(?P<key>.*?)(?P<kind>departures|conditions|route(?P<route>\d+))[^/]*\.html?$')
+
+
+class Stats:
+    """ Timings and counts for replaying one type of page. """
+
+    def __init__(self):
+        self.pages = 0
+        self.runs = 0
+        self.failures = 0
+        self.total = 0.0
+        self.parse = 0.0
+        self.write = 0.0
+        self.queries = 0
+        self.peak_memory = 0
+
+    @property
+    def as_dict(self) -> dict:
+        return {
+            "pages": self.pages,
+            "runs": self.runs,
+            "failures": self.failures,
+            "seconds": self.total,
+            "pages_per_second": self.pages / self.total if self.total else None,
+            "parse_seconds": self.parse,
+            "reconcile_seconds": max(self.total - self.parse - self.write, 0),
+            "write_seconds": self.write,
+            "queries": self.queries,
+            "queries_per_page": self.queries / self.pages if self.pages else None,
+            "peak_memory": self.peak_memory
+        }
+
+
+class Command(BaseCommand):
+    help = "Replay stored pages through the collectors against a scratch database, and report how long it took"
+
+    collectors = {
+        "departures": (get_actual_departures, DeparturesRun),
+        "conditions": (get_current_conditions, ConditionsRun),
+        "locations": (get_ferry_locations, LocationsRun)
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', help="Replay the pages in this directory instead of the stored pages")
+        parser.add_argument('--dump', help="Write the stored pages to this directory instead of replaying them")
+        parser.add_argument('--from-id', type=int, help="First stored page to replay")
+        parser.add_argument('--to-id', type=int, help="Last stored page to replay")
+        parser.add_argument('--since', type=parse, help="Replay pages captured since this time")
+        parser.add_argument('--until', type=parse, help="Replay pages captured before this time")
+        parser.add_argument('--limit', type=int, help="Maximum number of stored pages to replay")
+        parser.add_argument('--no-memory', action='store_true',
+                            help="Don't trace memory use (tracing slows the replay down)")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+
+    def localize(self, timestamp):
+        if timestamp and timestamp.tzinfo is None:
+            return pytz.timezone(settings.DISPLAY_TIME_ZONE).localize(timestamp)
+        return timestamp
+
+    def dump(self, directory: str, options: dict) -> int:
+        """ Write the selected stored pages to a directory, in the order they were captured.
+
+        :returns: the number of pages written
+        :rtype: int
+        """
+
+        pages = RawHTML.objects.instance_of(DeparturesRawHTML, ConditionsRawHTML, LocationsRawHTML)
+
+        if options['from_id']:
+            pages = pages.filter(pk__gte=options['from_id'])
+        if options['to_id']:
+            pages = pages.filter(pk__lte=options['to_id'])
+        if options['since']:
+            pages = pages.filter(run__timestamp__gte=self.localize(options['since']))
+        if options['until']:
+            pages = pages.filter(run__timestamp__lt=self.localize(options['until']))
+
+        pages = pages.select_related('blob').order_by('pk')
+        if options['limit']:
+            pages = pages[:options['limit']]
+
+        os.makedirs(directory, exist_ok=True)
+
+        count = 0
+        sequence = 0
+        last_run = None
+        for page in pages.iterator():
+            # Keep the location maps from the same run together
+            if not isinstance(page, LocationsRawHTML) or page.run_id != last_run:
+                sequence += 1
+            last_run = page.run_id
+
+            if isinstance(page, LocationsRawHTML):
+                name = "route{}".format(re.search(r'route(\d+)\.html', page.url).group(1))
+            elif isinstance(page, DeparturesRawHTML):
+                name = "departures"
+            else:
+                name = "conditions"
+
+            with open(os.path.join(directory, "{:08d}-{}.html".format(sequence, name)), 'w') as fp:
+                fp.write(page.content)
+            count += 1
+
+        return count
+
+    def pages(self, directory: str):
+        """ Yield (type, input) for each collector run to replay from a directory, in name order.
+
+        Departures and conditions pages are replayed one at a time. Consecutive location maps with the same prefix
+        are replayed together, as a single run.
+        """
+
+        group = {}
+        group_key = None
+
+        for name in sorted(os.listdir(directory)):
+            match = PAGE_FILE.match(name)
+            if not match:
+                continue
+
+            path = os.path.join(directory, name)
+            route = match.group('route')
+
+            if group and (route is None or match.group('key') != group_key or route in group):
+                yield "locations", group
+                group = {}
+
+            if route is None:
+                yield match.group('kind'), path
+            else:
+                group[route] = path
+                group_key = match.group('key')
+
+        if group:
+            yield "locations", group
+
+    def parse_time(self, kind: str, paths: list) -> float:
+        """ Time the parse stage on its own. The collectors parse each page before applying it, so this is taken as
+        the parse share of their time, and whatever isn't parsing or writing is reconciling.
+        """
+
+        parsers = {"departures": parse_departures, "conditions": parse_conditions, "locations": parse_locations}
+        captured_at = clock.now()
+        start = perf_counter()
+
+        for path in paths:
+            with open(path, 'r') as fp:
+                data = fp.read()
+
+            try:
+                parsers[kind](data, captured_at)
+            except ParseError:
+                # The collector will report this too
+                pass
+
+        return perf_counter() - start
+
+    def replay(self, directory: str, trace_memory: bool) -> dict:
+        """ Replay the pages in a directory through the collectors.
+
+        :returns: dict of page type to Stats
+        :rtype: dict
+        """
+
+        stats = {kind: Stats() for kind in self.collectors}
+        current = None
+
+        def count(execute, sql, params, many, context):
+            start = perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                if current:
+                    current.queries += 1
+                    if sql.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+                        current.write += perf_counter() - start
+
+        # Don't carry over reference data from the real database
+        get_reference_cache().invalidate()
+
+        if trace_memory:
+            tracemalloc.start()
+
+        with connection.execute_wrapper(count):
+            for kind, source in self.pages(directory):
+                collector, run_model = self.collectors[kind]
+                paths = list(source.values()) if kind == "locations" else [source]
+
+                current = stats[kind]
+                current.parse += self.parse_time(kind, paths)
+
+                if trace_memory:
+                    tracemalloc.reset_peak()
+
+                # Remember the last run, so we only pick up the one this collector records (if it gets that far)
+                last_run = run_model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+                start = perf_counter()
+                if kind == "locations":
+                    succeeded = collector(input_files=source)
+                else:
+                    succeeded = collector(input_file=source)
+                current.total += perf_counter() - start
+
+                if trace_memory:
+                    current.peak_memory = max(current.peak_memory, tracemalloc.get_traced_memory()[1])
+
+                current.pages += len(paths)
+                current.runs += 1
+                current.failures += 0 if succeeded else 1
+
+                # Commits don't go through the execute wrapper, so add on the commit time from the run
+                current = None
+                run = run_model.objects.filter(pk__gt=last_run).order_by('-pk').first()
+                if run is not None:
+                    stats[kind].write += run.commit_time or 0
+
+        if trace_memory:
+            tracemalloc.stop()
+
+        return stats
+
+    def handle(self, *args, **options):
+        if options['dump']:
+            count = self.dump(options['dump'], options)
+            self.stdout.write("Wrote {} pages to {}".format(count, options['dump']))
+            return
+
+        with tempfile.TemporaryDirectory() as temp:
+            directory = options['directory']
+
+            if directory is None:
+                # Take the pages out of the real database before switching to the scratch one
+                directory = temp
+                self.dump(directory, options)
+
+            if not os.path.isdir(directory):
+                raise CommandError("{} isn't a directory".format(directory))
+
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+            try:
+                stats = self.replay(directory, not options['no_memory'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        results = {kind: stat.as_dict for kind, stat in stats.items()}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write("{:<12} {:>6} {:>6} {:>9} {:>9} {:>9} {:>10} {:>9} {:>8} {:>8} {:>10}".format(
+            "", "pages", "runs", "pages/s", "total", "parse", "reconcile", "write", "queries", "q/page", "peak"
+        ))
+
+        for kind, result in results.items():
+            if not result["pages"]:
+                continue
+
+            self.stdout.write("{:<12} {:>6} {:>6} {:>9.1f} {:>8.2f}s {:>8.2f}s {:>9.2f}s {:>8.2f}s {:>8} {:>8.1f} {:>10}".format(
+                kind, result["pages"], result["runs"], result["pages_per_second"], result["seconds"],
+                result["parse_seconds"], result["reconcile_seconds"], result["write_seconds"], result["queries"],
+                result["queries_per_page"],
+                "-" if options['no_memory'] else "{:.1f}MB".format(result["peak_memory"] / 1024 / 1024)
+            ))
+
+            if result["failures"]:
+                self.stdout.write("  WARNING: {} runs failed".format(result["failures"]))
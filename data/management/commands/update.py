@@ -1,6 +1,5 @@
 from django.core.management.base import BaseCommand
-from data.utils import (get_actual_departures, get_current_conditions,
-                        get_ferry_locations)
+from data.tasks import get_update_graph
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,6 +8,4 @@ class Command(BaseCommand):
     help = "Query and parse all information"
 
     def handle(self, *args, **options):
-        get_actual_departures()
-        get_current_conditions()
-        get_ferry_locations()
+        get_update_graph().run()
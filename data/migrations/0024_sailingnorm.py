@@ -0,0 +1,78 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:14
+
+import data.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_norms(apps, schema_editor):
+    """ Build the initial norms from the sailings we already have. """
+    Sailing = apps.get_model('data', 'Sailing')
+    SailingNorm = apps.get_model('data', 'SailingNorm')
+
+    norms = [
+        ("percent_full", "percent_full"),
+        ("leaving", "late_leaving"),
+        ("arriving", "late_arriving")
+    ]
+
+    groups = Sailing.objects.filter(
+        arrived=True,
+        duration__isnull=False
+    ).values(
+        "route", "sailing_time", "day_of_week"
+    ).annotate(
+        sailings=models.Count("id"),
+        **{
+            "{}_{}".format(name, suffix): aggregate(field)
+            for name, field in norms
+            for suffix, aggregate in [
+                ("count", models.Count), ("total", models.Sum), ("minimum", models.Min), ("maximum", models.Max)
+            ]
+        }
+    ).order_by()
+
+    objects = []
+    for group in groups:
+        group["route_id"] = group.pop("route")
+        for name, field in norms:
+            group["{}_total".format(name)] = group["{}_total".format(name)] or 0
+        objects.append(SailingNorm(**group))
+
+    SailingNorm.objects.bulk_create(objects)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0023_auto_20190302_0448'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SailingNorm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sailing_time', models.CharField(max_length=8)),
+                ('day_of_week', models.CharField(choices=[(data.models.DayOfWeek('Monday'), 'Monday'), (data.models.DayOfWeek('Tuesday'), 'Tuesday'), (data.models.DayOfWeek('Wednesday'), 'Wednesday'), (data.models.DayOfWeek('Thursday'), 'Thursday'), (data.models.DayOfWeek('Friday'), 'Friday'), (data.models.DayOfWeek('Saturday'), 'Saturday'), (data.models.DayOfWeek('Sunday'), 'Sunday')], max_length=16)),
+                ('sailings', models.IntegerField(default=0)),
+                ('percent_full_count', models.IntegerField(default=0)),
+                ('percent_full_total', models.FloatField(default=0)),
+                ('percent_full_minimum', models.IntegerField(blank=True, null=True)),
+                ('percent_full_maximum', models.IntegerField(blank=True, null=True)),
+                ('leaving_count', models.IntegerField(default=0)),
+                ('leaving_total', models.FloatField(default=0)),
+                ('leaving_minimum', models.IntegerField(blank=True, null=True)),
+                ('leaving_maximum', models.IntegerField(blank=True, null=True)),
+                ('arriving_count', models.IntegerField(default=0)),
+                ('arriving_total', models.FloatField(default=0)),
+                ('arriving_minimum', models.IntegerField(blank=True, null=True)),
+                ('arriving_maximum', models.IntegerField(blank=True, null=True)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='data.Route')),
+            ],
+            options={
+                'unique_together': {('route', 'sailing_time', 'day_of_week')},
+            },
+        ),
+        migrations.RunPython(populate_norms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0024_sailingnorm'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sailing',
+            index=models.Index(fields=['route', 'scheduled_departure'], name='sailing_route_departure_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sailing',
+            index=models.Index(fields=['scheduled_departure'], name='sailing_departure_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sailing',
+            index=models.Index(fields=['eta_or_arrival_time'], name='sailing_eta_arrival_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sailing',
+            index=models.Index(condition=models.Q(('arrived', True), ('duration__isnull', False)), fields=['route', 'sailing_time', 'day_of_week'], name='sailing_norms_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0025_sailing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(max_length=16)),
+                ('entity_id', models.IntegerField()),
+                ('event_type', models.CharField(max_length=32)),
+                ('event_id', models.IntegerField()),
+                ('timestamp', models.DateTimeField()),
+                ('old_value', models.CharField(blank=True, max_length=64, null=True)),
+                ('new_value', models.CharField(blank=True, max_length=64, null=True)),
+                ('text', models.TextField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='eventlog',
+            index=models.Index(fields=['entity', 'entity_id', 'timestamp'], name='eventlog_entity_idx'),
+        ),
+    ]
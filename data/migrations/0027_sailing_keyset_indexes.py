@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0026_eventlog'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='sailing',
+            name='sailing_route_departure_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='sailing',
+            name='sailing_departure_idx',
+        ),
+        migrations.AddIndex(
+            model_name='sailing',
+            index=models.Index(fields=['route', 'scheduled_departure', 'id'], name='sailing_route_departure_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sailing',
+            index=models.Index(fields=['scheduled_departure', 'id'], name='sailing_departure_idx'),
+        ),
+    ]
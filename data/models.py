@@ -1,6 +1,9 @@
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models import Avg, Max, Min, QuerySet
+from django.db.models import Count, F, Max, Min, Q, QuerySet, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.conf import settings
+from django.utils.functional import cached_property
 from polymorphic.models import PolymorphicModel
 from datetime import datetime, timedelta
 from typing import Union
@@ -9,6 +12,8 @@ from enum import Enum
 import logging
 import math
 
+from . import clock
+
 logger = logging.getLogger(__name__)
 
 BCF_URL_BASE = "https://www.bcferries.com/current_conditions"
@@ -17,14 +22,14 @@ BCF_URL_BASE = "https://www.bcferries.com/current_conditions"
 # TODO - check and replace with function in .utils
 def get_local_time():
     tz = pytz.timezone(settings.DISPLAY_TIME_ZONE)
-    now = datetime.now().astimezone(tz)
+    now = clock.now().astimezone(tz)
     return now
 
 
 # TODO - move this to .utils
-def get_local_midnight():
+def get_local_midnight(now: datetime = None):
     tz = pytz.timezone(settings.DISPLAY_TIME_ZONE)
-    tomorrow = datetime.now().astimezone(tz) + timedelta(days=1)
+    tomorrow = (now or clock.now()).astimezone(tz) + timedelta(days=1)
     midnight = tomorrow.replace(hour=0, minute=0, second=0, microsecond=0)
     return midnight
 
@@ -156,9 +161,20 @@ class Route(models.Model):
         :rtype: QuerySet
         """
 
+        return self.get_sailings_today()
+
+    def get_sailings_today(self, now: datetime = None) -> QuerySet:
+        """ Return a Django QuerySet containing the rest of the day's Sailings for this Route, as of the given time.
+
+        :param now: the time to count from (defaults to now)
+        :type now: datetime
+        :returns: QuerySet of Sailings for this Route
+        :rtype: QuerySet
+        """
+
         # Get the current local time and the local midnight time
-        now = get_local_time()
-        midnight = get_local_midnight()
+        now = now or get_local_time()
+        midnight = get_local_midnight(now)
 
         # Get the QuerySet of Sailings for this Route
         sailings = Sailing.objects.filter(
@@ -177,6 +193,8 @@ class Route(models.Model):
         :rtype: dict
         """
 
+        next_sailing = self.next_sailing
+
         # Build dict
         response = {
             "id": self.pk,
@@ -185,7 +203,7 @@ class Route(models.Model):
             "destination": self.destination.name,
             "car_waits": self.car_waits,
             "oversize_waits": self.oversize_waits,
-            "next_sailing": self.next_sailing.as_dict if self.next_sailing else None,
+            "next_sailing": next_sailing.as_dict if next_sailing else None,
             "duration": self.duration
         }
 
@@ -303,22 +321,29 @@ class Ferry(models.Model):
         if self.heading:
             response['heading'] = self.heading
 
-        if self.current_sailing:
+        # The current and next sailings may have been loaded along with a number of other ferries, by
+        # serializers.prefetch_ferries()
+        if hasattr(self, '_prefetched_sailings'):
+            current_sailing, next_sailing = self._prefetched_sailings
+        else:
+            current_sailing, next_sailing = self.current_sailing, self.next_sailing
+
+        if current_sailing:
             response['current_sailing'] = {
-                "id": self.current_sailing.id,
-                "route_id": self.current_sailing.route.id,
-                "route_name": self.current_sailing.route.name,
+                "id": current_sailing.id,
+                "route_id": current_sailing.route.id,
+                "route_name": current_sailing.route.name,
             }
 
-            if self.current_sailing.eta_or_arrival_time:
-                response['current_sailing']['eta'] = self.current_sailing.eta_or_arrival_time_hour_minute
+            if current_sailing.eta_or_arrival_time:
+                response['current_sailing']['eta'] = current_sailing.eta_or_arrival_time_hour_minute
 
-        if self.next_sailing:
+        if next_sailing:
             response['next_sailing'] = {
-                "id": self.next_sailing.id,
-                "route_id": self.next_sailing.route.id,
-                "route_name": self.next_sailing.route.name,
-                "scheduled_departure": self.next_sailing.scheduled_departure_hour_minute
+                "id": next_sailing.id,
+                "route_id": next_sailing.route.id,
+                "route_name": next_sailing.route.name,
+                "scheduled_departure": next_sailing.scheduled_departure_hour_minute
             }
 
         return response
@@ -394,6 +419,19 @@ class Sailing(models.Model):
     # Boolean for if the sailing is cancelled
     cancelled = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Looking up a sailing on a route (the scrapers, and the per-route API views). The ID is included so pages
+            # of the API can be read in (scheduled_departure, id) order straight from the index.
+            models.Index(fields=["route", "scheduled_departure", "id"], name="sailing_route_departure_idx"),
+            # The time windows used by the API views
+            models.Index(fields=["scheduled_departure", "id"], name="sailing_departure_idx"),
+            models.Index(fields=["eta_or_arrival_time"], name="sailing_eta_arrival_idx"),
+            # Arrived sailings, as used to build the historical norms
+            models.Index(fields=["route", "sailing_time", "day_of_week"], name="sailing_norms_idx",
+                         condition=Q(arrived=True, duration__isnull=False)),
+        ]
+
     @property
     def local_date(self) -> str:
         """ Returns a human-readable date in local time for this sailing.
@@ -516,8 +554,9 @@ class Sailing(models.Model):
 
         if self.is_full:
             # Sailing is full, so get the 100% status event
-            e = self.sailingevent_set.instance_of(PercentFullEvent).\
-                filter(percentfullevent__new_value=100).get()
+            e = EventLog.objects.filter(
+                entity="sailing", entity_id=self.pk, event_type="PercentFullEvent", new_value="100"
+            ).get()
             return e.timestamp
         else:
             # Sailing isn't full, so there's no timestamp to return
@@ -540,71 +579,80 @@ class Sailing(models.Model):
             # Sailing isn't full, so no delta to calculate
             return None
 
+    @cached_property
+    def norm(self) -> Union["SailingNorm", None]:
+        """ Return the historical norms for this sailing, if we have any.
+
+        :returns: the SailingNorm for this sailing's route, time and day of the week
+        :rtype: SailingNorm
+        """
+
+        return SailingNorm.objects.filter(
+            route_id=self.route_id,
+            sailing_time=self.sailing_time,
+            day_of_week=self.day_of_week
+        ).first()
+
+    @property
+    def counts_towards_norms(self) -> bool:
+        """ Returns whether this sailing should be included in the historical norms.
+
+        :returns: whether the sailing has arrived and has a duration
+        :rtype: bool
+        """
+
+        return self.arrived is True and self.duration is not None
+
     @property
     def aggregate_percent_full(self) -> dict:
-        """ Calculate the aggregate min/max/avg for how full this sailing normally is.
+        """ Return the aggregate min/max/avg for how full this sailing normally is.
 
         :returns: min/max/average percentage full norms for this sailing
         :rtype: dict
         """
 
-        aggregate = Sailing.objects.filter(
-            route__id=self.route.id,
-            sailing_time=self.sailing_time,
-            day_of_week=self.day_of_week,
-            arrived=True,
-            duration__isnull=False
-        ).aggregate(
-            average=Avg('percent_full'),
-            minimum=Min('percent_full'),
-            maximum=Max('percent_full')
-        )
+        if self.norm:
+            return self.norm.percent_full
 
-        return aggregate
+        return {"average": None, "minimum": None, "maximum": None}
 
     @property
     def aggregate_leaving(self) -> dict:
-        """ Calculate the aggregate min/max/avg for how early/late leaving this sailing normally is.
+        """ Return the aggregate min/max/avg for how early/late leaving this sailing normally is.
 
         :returns: min/max/average early/late leaving norms for this sailing
         :rtype: dict
         """
 
-        aggregate = Sailing.objects.filter(
-            route__id=self.route.id,
-            sailing_time=self.sailing_time,
-            day_of_week=self.day_of_week,
-            arrived=True,
-            duration__isnull=False
-        ).aggregate(
-            average=Avg('late_leaving'),
-            minimum=Min('late_leaving'),
-            maximum=Max('late_leaving')
-        )
+        if self.norm:
+            return self.norm.leaving
 
-        return aggregate
+        return {"average": None, "minimum": None, "maximum": None}
 
     @property
     def aggregate_arriving(self) -> dict:
-        """ Calculate the aggregate min/max/avg for how early/late arriving this sailing normally is.
+        """ Return the aggregate min/max/avg for how early/late arriving this sailing normally is.
 
          :returns: min/max/average early/late arriving norms for this sailing
          :rtype: dict
          """
 
-        aggregate = Sailing.objects.filter(
-            route__id=self.route.id,
-            sailing_time=self.sailing_time,
-            day_of_week=self.day_of_week,
-            arrived=True,
-            duration__isnull=False
-        ).aggregate(
-            average=Avg('late_arriving'),
-            minimum=Min('late_arriving'),
-            maximum=Max('late_arriving')
-        )
+        if self.norm:
+            return self.norm.arriving
+
+        return {"average": None, "minimum": None, "maximum": None}
+
+    @cached_property
+    def events(self) -> list:
+        """ Return the events for this sailing, oldest first.
 
-        return aggregate
+        :returns: list of EventLog entries for this sailing
+        :rtype: list
+        """
+
+        return list(
+            EventLog.objects.filter(entity="sailing", entity_id=self.pk).order_by('timestamp', 'event_id')
+        )
 
     @property
     def as_dict(self) -> dict:
@@ -671,15 +719,15 @@ class Sailing(models.Model):
             response['late_arriving'] = self.late_arriving
 
         response['events'] = [
-            event.as_dict for event in self.sailingevent_set.all().order_by('timestamp')
+            event.as_dict for event in self.events
         ]
 
         percent_full_data = []
-        for event in self.sailingevent_set.all().order_by('timestamp'):
-            if type(event) == PercentFullEvent:
+        for event in self.events:
+            if event.event_type == "PercentFullEvent":
                 percent_full_data.append({
                     'timestamp': int(event.timestamp.timestamp()),
-                    'percent_full': event.new_value
+                    'percent_full': None if event.new_value is None else int(event.new_value)
                 })
 
         response['percent_full_data'] = percent_full_data
@@ -729,10 +777,13 @@ class Sailing(models.Model):
 
         return info
 
-    def save(self, *args, **kwargs) -> None:
-        """ Override the standard save() method and calculate a few things before saving.
+    # The fields set by calculate()
+    DERIVED_FIELDS = ["day_of_week", "sailing_time", "duration", "scheduled_arrival", "late_leaving", "late_arriving"]
+
+    def calculate(self) -> None:
+        """ Calculate the fields derived from the departure and arrival times.
 
-        We override the standard save() method to set a few things before saving:-
+        This sets:-
         * the day of the week
         * the sailing time in HH:MM format
         * the actual duration of the sailing, if available
@@ -758,7 +809,7 @@ class Sailing(models.Model):
         # If there's no duration, and the sailing has arrived, calculate and set the duration
         if not self.duration and self.arrived is True:
             td = self.eta_or_arrival_time - self.actual_departure
-            self.duration = td.seconds / 60
+            self.duration = int(td.seconds / 60)
             logger.debug("Sailing duration was {}".format(self.duration))
 
         # If no scheduled arrival is set, set it
@@ -779,7 +830,8 @@ class Sailing(models.Model):
                     td = self.actual_departure - self.scheduled_departure
                     early = False
 
-                difference = td.seconds / 60
+                # Whole minutes, the same as the database stores
+                difference = int(td.seconds / 60)
 
                 if early:
                     self.late_leaving = -difference
@@ -803,7 +855,8 @@ class Sailing(models.Model):
                 td = self.eta_or_arrival_time - self.scheduled_arrival
                 early = False
 
-            difference = td.seconds / 60
+            # Whole minutes, the same as the database stores
+            difference = int(td.seconds / 60)
 
             if early:
                 self.late_arriving = -difference
@@ -818,9 +871,76 @@ class Sailing(models.Model):
                 "early" if early else "late"
             ))
 
+    @property
+    def norm_values(self) -> Union[tuple, None]:
+        """ Return what this sailing adds to the historical norms.
+
+        :returns: tuple of the route ID, sailing time and day of the week the norm is for, followed by the value of
+            each norm as the database stores it, or None if the sailing doesn't count towards the norms
+        :rtype: tuple
+        """
+
+        if not self.counts_towards_norms:
+            return None
+
+        return (self.route_id, self.sailing_time, self.day_of_week) + tuple(
+            self._meta.get_field(field).to_python(getattr(self, field)) for name, field in SailingNorm.NORMS
+        )
+
+    def update_norms(self) -> None:
+        """ Bring the historical norms up to date with this sailing. This should be called once it has been saved.
+
+        A sailing that has just arrived is added to the running totals for its norm. If a sailing that was already
+        in the norms has changed since, the norms it was in are recalculated from the stored sailings instead, as a
+        minimum or maximum can't be taken back out of the running totals.
+
+        :returns: nothing
+        :rtype: None
+        """
+
+        previous = getattr(self, '_norm_values', None)
+        current = self.norm_values
+
+        if current == previous:
+            return
+
+        if previous is None:
+            SailingNorm.record(self)
+        else:
+            SailingNorm.refresh(*previous[:3])
+            if current is not None and current[:3] != previous[:3]:
+                SailingNorm.refresh(*current[:3])
+
+        self._norm_values = current
+
+    def save(self, *args, **kwargs) -> None:
+        """ Override the standard save() method to calculate the derived fields before saving, and update the
+        historical norms afterwards.
+
+        :returns: nothing
+        :rtype: None
+        """
+
+        self.calculate()
+
         # Call the original save()  method
         super(Sailing, self).save(*args, **kwargs)
 
+        # If the sailing has just arrived (or has changed since), update the historical norms
+        self.update_norms()
+
+    @classmethod
+    def from_db(cls, db, field_names, values) -> "Sailing":
+        """ Override the standard from_db() method to remember what the sailing has already added to the norms.
+
+        :returns: the loaded Sailing
+        :rtype: Sailing
+        """
+
+        instance = super(Sailing, cls).from_db(db, field_names, values)
+        instance._norm_values = instance.norm_values
+        return instance
+
     def __str__(self) -> str:
         """ Return a string representation of the object.
 
@@ -831,6 +951,210 @@ class Sailing(models.Model):
         return "{} @ {}".format(self.route, self.scheduled_departure_local)
 
 
+class SailingNorm(models.Model):
+    """ Model representing the historical norms for a sailing.
+
+    This holds running totals for all of the arrived sailings on a route at a particular time and day of the
+    week, so that the min/max/average for a sailing can be looked up rather than calculated each time.
+    """
+
+    NORMS = [
+        ("percent_full", "percent_full"),
+        ("leaving", "late_leaving"),
+        ("arriving", "late_arriving")
+    ]
+
+    route = models.ForeignKey(Route, null=False, blank=False, on_delete=models.DO_NOTHING)
+    sailing_time = models.CharField(max_length=8, null=False, blank=False)
+    day_of_week = models.CharField(max_length=16, choices=[
+        (tag, tag.value) for tag in DayOfWeek
+    ], null=False, blank=False)
+
+    # How many arrived sailings these norms are built from
+    sailings = models.IntegerField(default=0)
+
+    # Count, total, minimum and maximum for how full the sailing was
+    percent_full_count = models.IntegerField(default=0)
+    percent_full_total = models.FloatField(default=0)
+    percent_full_minimum = models.IntegerField(null=True, blank=True)
+    percent_full_maximum = models.IntegerField(null=True, blank=True)
+
+    # ...how late the sailing was leaving
+    leaving_count = models.IntegerField(default=0)
+    leaving_total = models.FloatField(default=0)
+    leaving_minimum = models.IntegerField(null=True, blank=True)
+    leaving_maximum = models.IntegerField(null=True, blank=True)
+
+    # ...and how late the sailing was arriving
+    arriving_count = models.IntegerField(default=0)
+    arriving_total = models.FloatField(default=0)
+    arriving_minimum = models.IntegerField(null=True, blank=True)
+    arriving_maximum = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ("route", "sailing_time", "day_of_week")
+
+    def aggregate(self, name: str) -> dict:
+        """ Return the min/max/average for one of the norms.
+
+        :param name: the norm to return (one of percent_full, leaving or arriving)
+        :type name: str
+        :returns: min/max/average for the norm
+        :rtype: dict
+        """
+
+        count = getattr(self, "{}_count".format(name))
+
+        return {
+            "average": getattr(self, "{}_total".format(name)) / count if count else None,
+            "minimum": getattr(self, "{}_minimum".format(name)),
+            "maximum": getattr(self, "{}_maximum".format(name))
+        }
+
+    @property
+    def percent_full(self) -> dict:
+        """ Return the min/max/average for how full this sailing normally is.
+
+        :returns: min/max/average percentage full norms
+        :rtype: dict
+        """
+
+        return self.aggregate("percent_full")
+
+    @property
+    def leaving(self) -> dict:
+        """ Return the min/max/average for how early/late leaving this sailing normally is.
+
+        :returns: min/max/average early/late leaving norms
+        :rtype: dict
+        """
+
+        return self.aggregate("leaving")
+
+    @property
+    def arriving(self) -> dict:
+        """ Return the min/max/average for how early/late arriving this sailing normally is.
+
+        :returns: min/max/average early/late arriving norms
+        :rtype: dict
+        """
+
+        return self.aggregate("arriving")
+
+    @classmethod
+    def record(cls, sailing: Sailing) -> None:
+        """ Add an arrived sailing to the norms for its route, time and day of the week.
+
+        :param sailing: the arrived Sailing to add
+        :type sailing: Sailing
+        :returns: nothing
+        :rtype: None
+        """
+
+        norm, created = cls.objects.get_or_create(
+            route_id=sailing.route_id,
+            sailing_time=sailing.sailing_time,
+            day_of_week=sailing.day_of_week
+        )
+
+        # Update the totals in the database, so that concurrent updates don't clobber each other
+        updates = {"sailings": F("sailings") + 1}
+
+        for (name, field), value in zip(cls.NORMS, sailing.norm_values[3:]):
+            # Nulls are ignored, the same as they would be by Avg/Min/Max
+            if value is None:
+                continue
+
+            updates.update({
+                "{}_count".format(name): F("{}_count".format(name)) + 1,
+                "{}_total".format(name): F("{}_total".format(name)) + value,
+                "{}_minimum".format(name): Least(Coalesce("{}_minimum".format(name), Value(value)), Value(value)),
+                "{}_maximum".format(name): Greatest(Coalesce("{}_maximum".format(name), Value(value)), Value(value))
+            })
+
+        cls.objects.filter(pk=norm.pk).update(**updates)
+        logger.debug("Added {} to the norms".format(sailing))
+
+    @classmethod
+    def groups(cls, **filters) -> list:
+        """ Calculate the norms from the stored sailings, grouped by route, sailing time and day of the week.
+
+        :param filters: filters for the sailings to include
+        :returns: list of dicts of the fields for each SailingNorm
+        :rtype: list
+        """
+
+        groups = Sailing.objects.filter(
+            arrived=True,
+            duration__isnull=False,
+            **filters
+        ).values(
+            "route", "sailing_time", "day_of_week"
+        ).annotate(
+            sailings=Count("id"),
+            **{
+                "{}_{}".format(name, suffix): aggregate(field)
+                for name, field in cls.NORMS
+                for suffix, aggregate in [("count", Count), ("total", Sum), ("minimum", Min), ("maximum", Max)]
+            }
+        ).order_by()
+
+        for group in groups:
+            group["route_id"] = group.pop("route")
+            for name, field in cls.NORMS:
+                group["{}_total".format(name)] = group["{}_total".format(name)] or 0
+
+        return list(groups)
+
+    @classmethod
+    def refresh(cls, route_id: int, sailing_time: str, day_of_week: str) -> None:
+        """ Recalculate one of the norms from the stored sailings.
+
+        :param route_id: the ID of the route the norm is for
+        :type route_id: int
+        :param sailing_time: the sailing time the norm is for
+        :type sailing_time: str
+        :param day_of_week: the day of the week the norm is for
+        :type day_of_week: str
+        :returns: nothing
+        :rtype: None
+        """
+
+        key = {"route_id": route_id, "sailing_time": sailing_time, "day_of_week": day_of_week}
+        groups = cls.groups(**key)
+
+        if groups:
+            cls.objects.update_or_create(defaults=groups[0], **key)
+        else:
+            cls.objects.filter(**key).delete()
+
+        logger.debug("Recalculated the norms for route {} at {} on {}".format(route_id, sailing_time, day_of_week))
+
+    @classmethod
+    def rebuild(cls) -> int:
+        """ Rebuild all of the norms from scratch.
+
+        Sailings keep their norms up to date as they're saved, so this is only needed if sailings were changed
+        without going through Sailing.save() or Sailing.update_norms().
+
+        :returns: the number of norms created
+        :rtype: int
+        """
+
+        norms = [cls(**group) for group in cls.groups()]
+
+        cls.objects.all().delete()
+        cls.objects.bulk_create(norms)
+
+        return len(norms)
+
+    def __str__(self) -> str:
+        return "{} @ {} on {}".format(self.route, self.sailing_time, self.day_of_week)
+
+    def __repr__(self) -> str:
+        return "<SailingNorm: {}>".format(str(self))
+
+
 class SailingEvent(PolymorphicModel):
     """ Model representing a sailing event. """
 
@@ -994,6 +1318,16 @@ class DepartureTimeEvent(SailingEvent):
             self.departure
         )
 
+    @property
+    def log_values(self) -> tuple:
+        """ Return the old and new values for the event log.
+
+        :returns: tuple of the old and new departure times
+        :rtype: tuple
+        """
+
+        return self.old_departure, self.new_departure
+
     def __repr__(self) -> str:
         return "<DepartureTimeEvent: [{}] {}>".format(
             self.time, self.departure
@@ -1038,6 +1372,16 @@ class ArrivalTimeEvent(SailingEvent):
                 self.arrival
             )
 
+    @property
+    def log_values(self) -> tuple:
+        """ Return the old and new values for the event log.
+
+        :returns: tuple of the old and new arrival times
+        :rtype: tuple
+        """
+
+        return self.old_arrival, self.new_arrival
+
     def __repr__(self) -> str:
         return "<ArrivalTimeEvent: [{}] {}{}>".format(
             self.time,
@@ -1103,6 +1447,16 @@ class StatusEvent(SailingEvent):
 
         return "Status changed to {}".format(self.new_status)
 
+    @property
+    def log_values(self) -> tuple:
+        """ Return the old and new values for the event log.
+
+        :returns: tuple of the old and new statuses
+        :rtype: tuple
+        """
+
+        return self.old_status, self.new_status
+
     def __repr__(self) -> str:
         return "<StatusEvent: [{}] {}>".format(
             self.time, self.new_status
@@ -1131,6 +1485,16 @@ class FerryEvent(SailingEvent):
 
         return "Ferry changed to {}".format(self.new_ferry.name)
 
+    @property
+    def log_values(self) -> tuple:
+        """ Return the old and new values for the event log.
+
+        :returns: tuple of the old and new ferries
+        :rtype: tuple
+        """
+
+        return self.old_ferry, self.new_ferry
+
     def __repr__(self) -> str:
         return "<FerryEvent: [{}] {}>".format(
             self.time, self.new_ferry
@@ -1323,7 +1687,175 @@ class DestinationEvent(LocationEvent):
     # Destination object this event is in reference to
     destination = models.ForeignKey(Destination, null=True, blank=True, on_delete=models.DO_NOTHING)
 
+    @property
+    def log_values(self) -> tuple:
+        """ Return the old and new values for the event log.
+
+        :returns: tuple of no old value and the new destination
+        :rtype: tuple
+        """
+
+        return None, self.destination
+
     def __repr__(self) -> str:
         return "<DestinationEvent: [{}]>".format(
             self.last_updated
         )
+
+
+class EventLog(models.Model):
+    """ Model representing an entry in the flat event log.
+
+    Every event is also written here, as a single row with its text already rendered. Reading a sailing's events back
+    is then one range scan on a single table, rather than a polymorphic query across all of the event tables.
+    """
+
+    # The event types, the entity each one is for, and the field referencing the entity
+    ENTITIES = [
+        (SailingEvent, "sailing", "sailing_id"),
+        (RouteEvent, "route", "route_id"),
+        (TerminalEvent, "terminal", "terminal_id"),
+        (LocationEvent, "ferry", "ferry_id")
+    ]
+
+    # What the event happened to
+    entity = models.CharField(max_length=16, null=False, blank=False)
+    entity_id = models.IntegerField(null=False, blank=False)
+
+    # The type of event, and the ID of the original event
+    event_type = models.CharField(max_length=32, null=False, blank=False)
+    event_id = models.IntegerField(null=False, blank=False)
+
+    # The time the event was created
+    timestamp = models.DateTimeField(null=False, blank=False)
+
+    # The old and new values, and the text of the event
+    old_value = models.CharField(max_length=64, null=True, blank=True)
+    new_value = models.CharField(max_length=64, null=True, blank=True)
+    text = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["entity", "entity_id", "timestamp"], name="eventlog_entity_idx"),
+        ]
+
+    @classmethod
+    def from_event(cls, event: models.Model) -> "EventLog":
+        """ Return a (not yet saved) log entry for an event.
+
+        :param event: the event to log
+        :type event: models.Model
+        :returns: the log entry
+        :rtype: EventLog
+        """
+
+        entity, field = next((entity, field) for base, entity, field in cls.ENTITIES if isinstance(event, base))
+
+        if hasattr(event, 'log_values'):
+            values = event.log_values
+        else:
+            values = (getattr(event, 'old_value', None), getattr(event, 'new_value', None))
+
+        old_value, new_value = [
+            value.isoformat() if isinstance(value, datetime) else value for value in values
+        ]
+
+        return cls(
+            entity=entity,
+            entity_id=getattr(event, field),
+            event_type=type(event).__name__,
+            event_id=event.pk,
+            timestamp=event.timestamp,
+            old_value=None if old_value is None else str(old_value),
+            new_value=None if new_value is None else str(new_value),
+            text=getattr(event, 'text', None)
+        )
+
+    @classmethod
+    def event_models(cls) -> list:
+        """ Return every event model, along with the entity it's for and the field referencing the entity.
+
+        :returns: list of tuples of the event model, the entity and the field, with each base class before the
+            classes below it
+        :rtype: list
+        """
+
+        event_models = []
+        for base, entity, field in cls.ENTITIES:
+            pending = [base]
+            while pending:
+                model = pending.pop(0)
+                event_models.append((model, entity, field))
+                pending.extend(model.__subclasses__())
+
+        return event_models
+
+    @classmethod
+    def rebuild(cls, batch_size: int = 500) -> int:
+        """ Rebuild the event log from the events.
+
+        The events are read back a batch at a time, so this doesn't need to hold them all in memory.
+
+        :param batch_size: how many events to read and log at a time
+        :type batch_size: int
+        :returns: the number of events logged
+        :rtype: int
+        """
+
+        cls.objects.all().delete()
+
+        count = 0
+        for model, entity, field in cls.event_models():
+            # Load anything the event text or values refer to along with the events
+            related = [
+                f.name for f in model._meta.local_concrete_fields if f.is_relation and not f.remote_field.parent_link
+            ]
+
+            # Only take the events of exactly this type, as the ones below it are logged for their own type
+            events = model.objects.non_polymorphic().filter(
+                polymorphic_ctype=ContentType.objects.get_for_model(model, for_concrete_model=False)
+            ).select_related(*related).order_by('pk')
+
+            entries = []
+            for event in events.iterator(chunk_size=batch_size):
+                entries.append(cls.from_event(event))
+
+                if len(entries) >= batch_size:
+                    cls.objects.bulk_create(entries)
+                    count += len(entries)
+                    entries = []
+
+            cls.objects.bulk_create(entries)
+            count += len(entries)
+
+        return count
+
+    @property
+    def time(self) -> str:
+        """ Return the time of the event in HH:MM format.
+
+        :returns: time of the event in HH:MM format
+        :rtype: str
+        """
+
+        tz = pytz.timezone(settings.DISPLAY_TIME_ZONE)
+        return self.timestamp.astimezone(tz).strftime("%H:%M")
+
+    @property
+    def as_dict(self) -> dict:
+        """ Return a dict representation of of the object.
+
+        :returns: dict representation of the object
+        :rtype: dict
+        """
+
+        return {
+            "timestamp": self.timestamp,
+            "local_time": self.time,
+            "text": self.text
+        }
+
+    def __repr__(self) -> str:
+        return "<EventLog: [{}] {} {} {}>".format(
+            self.timestamp, self.entity, self.entity_id, self.event_type
+        )
@@ -0,0 +1,578 @@
+import re
+import logging
+import pytz
+from bs4 import BeautifulSoup, FeatureNotFound
+from collections import deque
+from dateutil.parser import parse
+from datetime import datetime, timedelta
+from django.conf import settings
+from html import unescape
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+timezone = pytz.timezone("America/Vancouver")
+
+
+class ParseError(Exception):
+    """ Raised when a page doesn't have the layout we expect. """
+
+    def __init__(self, message: str, info=None):
+        """
+        :param message: what went wrong
+        :type message: str
+        :param info: the part of the page that couldn't be parsed
+        """
+
+        super().__init__(message)
+        self.info = info
+
+# Tree builders we know about, fastest first
+PARSERS = ["lxml", "html.parser"]
+
+_available = None
+
+
+def available_parsers() -> List[str]:
+    """ Return the tree builders that are installed, fastest first.
+
+    :returns: list of tree builder names
+    :rtype: list
+    """
+
+    global _available
+
+    if _available is None:
+        _available = []
+        for parser in PARSERS:
+            try:
+                BeautifulSoup("", parser)
+                _available.append(parser)
+            except FeatureNotFound:
+                logger.debug("{} parser isn't available".format(parser))
+
+    return _available
+
+
+def get_parser() -> str:
+    """ Return the tree builder to use, falling back to html.parser if the configured one isn't
+    available.
+
+    :returns: tree builder name
+    :rtype: str
+    """
+
+    parser = getattr(settings, "BCF_HTML_PARSER", "html.parser")
+
+    if parser not in available_parsers():
+        logger.debug("{} parser isn't available, using html.parser".format(parser))
+        return "html.parser"
+
+    return parser
+
+
+def make_soup(data: str, parser: str = None) -> BeautifulSoup:
+    """ Parse a page.
+
+    :param data: the page content
+    :type data: str
+    :param parser: the tree builder to use (defaults to the configured one)
+    :type parser: str
+    :returns: the parsed page
+    :rtype: BeautifulSoup
+    """
+
+    return BeautifulSoup(data, parser or get_parser())
+
+
+TABLE = re.compile(r"<table\b.*?</table>", re.I | re.S)
+ROW = re.compile(r"<tr\b.*?</tr>", re.I | re.S)
+CELL = re.compile(r"<td\b[^>]*>(.*?)</td>", re.I | re.S)
+TAG = re.compile(r"<[^>]*>")
+
+
+def soup_location_rows(data: str, parser: str = None) -> List[Tuple[str, str, str, str]]:
+    """ Parse the ferry rows out of a route location page with BeautifulSoup.
+
+    :param data: the page content
+    :type data: str
+    :param parser: the tree builder to use (defaults to the configured one)
+    :type parser: str
+    :returns: list of (ferry, status, destination, time) tuples
+    :rtype: list
+    """
+
+    b = make_soup(data, parser)
+
+    return [
+        tuple(td.text for td in tr.find_all('td'))
+        for tr in b.body.table.find_all('tr')[1:]
+        if len(tr.find_all('td')) == 4
+    ]
+
+
+def location_rows(data: str) -> List[Tuple[str, str, str, str]]:
+    """ Parse the ferry rows out of a route location page.
+
+    These pages are a single small table, so the rows are pulled out with regular expressions
+    rather than building a tree. Anything that doesn't look like the usual layout (such as nested
+    tables) is handed to BeautifulSoup instead.
+
+    :param data: the page content
+    :type data: str
+    :returns: list of (ferry, status, destination, time) tuples
+    :rtype: list
+    """
+
+    tables = [m.group(0) for m in TABLE.finditer(data)]
+
+    if len(tables) != 1 or tables[0].lower().count("<table") != 1:
+        logger.debug("Unexpected layout, falling back to BeautifulSoup")
+        return soup_location_rows(data)
+
+    rows = []
+    for tr in ROW.findall(tables[0])[1:]:
+        cells = CELL.findall(tr)
+        if len(cells) == 4:
+            rows.append(tuple(unescape(TAG.sub("", cell)) for cell in cells))
+
+    return rows
+
+
+def local_time(day: datetime, time: str) -> datetime:
+    """ Return a time on the given (local) day.
+
+    :param day: the day the time is on
+    :type day: datetime
+    :param time: the time, as shown on the page
+    :type time: str
+    :returns: the local time
+    :rtype: datetime
+    """
+
+    return timezone.localize(parse("{} {}".format(day.strftime("%Y-%m-%d"), time)))
+
+
+def parse_departures(data: str, captured_at: datetime) -> dict:
+    """ Parse the actualDepartures.asp page.
+
+    This doesn't touch the database, so it can be run anywhere (such as in another process) and always gives the
+    same records for the same page.
+
+    :param data: the page content
+    :type data: str
+    :param captured_at: when the page was captured
+    :type captured_at: datetime
+    :returns: dict with the date on the page, terminal names to codes, and the routes with their sailings
+    :rtype: dict
+    :raises ParseError: if a sailing couldn't be parsed
+    """
+
+    # Load data into the BeautifulSoup parser
+    b = make_soup(data)
+
+    # Parse out the routes
+    # Create a deque object containing the routes and sailings
+    routes = deque(
+        b.find('td', class_='content').find('table').find_all('table')
+    )
+
+    # Parse out the current date
+    date = b.find('span', class_='titleSmInv').text
+
+    routes_list = []
+    terminals = {}
+
+    # Iterate over the routes
+    while len(routes) != 0:
+        # Pop off the next route
+        route = routes.popleft()
+
+        # Parse out the route name and the sailing time
+        route_name, sailing_time = route.span.decode_contents().split('<br/>')
+
+        # Parse out the source, destination, the source code and route code
+        source, destination = re.search(r'(.*) to (.*)', route_name).groups()
+        source_code, route_code = re.search(r'#([A-Z]+)(\d+)', route.find_previous_sibling().attrs['name']).groups()
+
+        # Parse out the sailing time
+        sailing_time = re.search("Sailing time: (.*)", sailing_time).groups()[0]
+
+        # Some sailings (i.e. those to the Gulf Islands) are variable as BC Ferries doesn't provide live details for
+        # them. For these, we can't get a duration - so skip them.
+        if sailing_time != "Variable":
+            # Sailing time is fixed, so parse out the hours and minutes for the duration
+            times = re.search(r'(([0-9]+) hours?\s?)?(([0-9]+) minutes)?.*', sailing_time).groups()
+
+            # Convert minutes to an integer
+            if times[3]:
+                minutes = int(times[3])
+            else:
+                minutes = 0
+
+            # Convert hours to minutes
+            if times[1]:
+                minutes += int(times[1]) * 60
+
+            logger.debug("Minutes: {}".format(minutes))
+
+        # Add a mapping of terminal name to terminal source code
+        terminals[source] = source_code
+
+        # Pop off the sailings
+        sailings = routes.popleft()
+
+        # Create a dict with the details we've parsed out so far
+        # TODO - minutes could potentially be unassigned
+        route_details = {
+            "source_code": source_code,
+            "source": source,
+            "destination": destination,
+            "route_name": route_name,
+            "route_code": route_code,
+            "sailing_time": minutes
+        }
+
+        sailings_list = []
+
+        # Iterate over the sailings
+        for sailing in sailings.find_all('tr')[1:]:
+            # Parse out the ferry, the scheduled departure time, the actual departure time, the ETA (or arrival time)
+            # and the current status for this sailing
+            try:
+                ferry, scheduled, actual, eta_arrival, status = [td.text.strip() for td in sailing.find_all('td')]
+            except ValueError as e:
+                logger.error("Couldn't parse out sailing details: {}".format(e))
+                logger.error("Tried parsing: {}".format(sailing.find_all('td')))
+                raise ParseError("Couldn't parse out sailing details: {}".format(e), sailing.find_all('td'))
+
+            sailings_list.append(parse_departure(date, ferry, scheduled, actual, eta_arrival, status))
+
+        route_details.update({"sailings": sailings_list})
+        routes_list.append(route_details)
+
+    return {
+        "captured_at": captured_at,
+        "date": timezone.localize(parse(date)),
+        "terminals": terminals,
+        "routes": routes_list
+    }
+
+
+def parse_departure(date: str, ferry: str, scheduled: str, actual: str, eta_arrival: str, status: str) -> dict:
+    """ Work out the times and state of a sailing from its row on the departures page.
+
+    :returns: dict of the sailing's details
+    :rtype: dict
+    """
+
+    # Parse and convert the scheduled departure time
+    scheduled_departure = timezone.localize(parse("{} {}".format(date, scheduled)))
+
+    if actual:
+        # This sailing has left, so parse and convert the actual departure time...
+        actual_departure = timezone.localize(parse("{} {}".format(date, actual)))
+        # ...and set the sailing to departed
+        departed = True
+    else:
+        # No actual departure time found
+        logger.debug("No actual departure time for this sailing")
+        actual_departure = None
+        departed = False
+
+    # Usefully (not), the ETA/arrival time can be '...' (unknown). We need to handle this gracefully
+    if eta_arrival and eta_arrival != '...':
+        if 'ETA' in eta_arrival:
+            # We have an ETA, so parse it out
+            eta = re.search(r'ETA: (.*)', eta_arrival).groups()[0]
+            eta_or_arrival = timezone.localize(parse("{} {}".format(date, eta)))
+            logger.debug("ETA for this sailing is {}".format(eta_or_arrival))
+            # Since we have an ETA, this means this sailing hasn't arrived yet
+            arrived = False
+        else:
+            # No ETA but an arrival time means this sailing has arrived
+            eta_or_arrival = timezone.localize(parse("{} {}".format(date, eta_arrival)))
+            logger.debug("Arrival time for this sailing was {}".format(eta_or_arrival))
+            arrived = True
+    else:
+        logger.debug("No ETA or arrival time")
+        eta_or_arrival = None
+        arrived = False
+
+    return {
+        "ferry": ferry,
+        "scheduled_departure": scheduled_departure,
+        "actual_departure": actual_departure,
+        "departed": departed,
+        "eta_or_arrival": eta_or_arrival,
+        "arrived": arrived,
+        "status": status
+    }
+
+
+def parse_conditions(data: str, captured_at: datetime) -> dict:
+    """ Parse the current conditions/"at-a-glance" page.
+
+    The page only gives times, so they're taken to be on the day the page was captured (or the day after, for later
+    sailings marked with a *). This doesn't touch the database.
+
+    :param data: the page content
+    :type data: str
+    :param captured_at: when the page was captured
+    :type captured_at: datetime
+    :returns: dict with the time the page was captured and the routes on it
+    :rtype: dict
+    """
+
+    # Load data into the BeautifulSoup parser
+    s = make_soup(data)
+
+    today = captured_at.astimezone(timezone)
+    tomorrow = today + timedelta(days=1)
+
+    j_routes = []
+    full_routes = []
+
+    # Iterate over each section
+    for section in s.find_all('tbody'):
+        if section.span:
+            continue
+
+        # Parse out each sailing
+        previously_parsed = None
+
+        # Iterate over each sailing row
+        for route in section.find_all('tr', recursive=False)[1:-1]:
+            j_route = {}
+            route_name = route.td.text
+            details = route.find_all('td', recursive=False)
+
+            route_id = None
+
+            try:
+                # Match the route ID
+                route_id = re.match(r'.*route=(\d+)&dept=(\w+).*', details[7].a.get('href')).groups()[0]
+            except IndexError as e:
+                # If matching the above didn't work, it's possible the sailing is fully booked
+                if 'Vehicle space on this route is fully booked' in details[0].text:
+                    logger.debug("All sailings today on the previously-parsed route are fully booked")
+                    logger.debug("This was: {}".format(previously_parsed))
+                    full_routes.append(previously_parsed)
+                else:
+                    # Who knows?
+                    logger.error("Unknown error: {}".format(e))
+
+            if not route_id:
+                continue
+
+            # Store the route ID and route name
+            j_route['route_id'] = route_id
+            j_route['route_name'] = route_name
+
+            if details[1].div.text == "N/A":
+                # Sometimes the sailing details are "N/A" - so not much we can do with them
+                j_route['sailings'] = None
+            else:
+                j_sailings = []
+
+                # Iterate over each sailing
+                for sailing in details[1].div.table.find_all('tr'):
+                    # Get the next sailing
+                    next_sailing = sailing.td.text
+                    sailing_time = local_time(today, next_sailing)
+
+                    # Check if the sailing has been cancelled
+                    if sailing.td.next_sibling.text == "Cancelled":
+                        # Sailing is cancelled
+                        j_sailings.append({
+                            'time': next_sailing,
+                            'scheduled_departure': sailing_time,
+                            'cancelled': True
+                        })
+                    else:
+                        # Sailing isn't cancelled, so parse out how full this sailing is
+                        j_sailings.append({
+                            'time': next_sailing,
+                            'scheduled_departure': sailing_time,
+                            'percent_full': int(sailing.td.next_sibling.text.split('% ')[0]),
+                        })
+
+                # Save this sailings
+                j_route['sailings'] = j_sailings
+
+                # Parse out the number of car and oversize waits
+                j_route['car_waits'] = int(details[2].text.rstrip('\n'))
+                j_route['oversize_waits'] = int(details[3].text.rstrip('\n'))
+
+            # Parse out later sailings. These are the ones which we don't have full details for yet
+            j_route['later_sailings'] = parse_later_sailings(details[4].text.lstrip(' ').split(' '), today, tomorrow)
+
+            # Save all the sailings for this route
+            j_routes.append(j_route)
+            previously_parsed = route_name
+
+    for j_route in j_routes:
+        # The "fully booked" row comes after the route it's for
+        j_route['full'] = j_route['route_name'] in full_routes
+
+    return {
+        "captured_at": captured_at,
+        "routes": j_routes
+    }
+
+
+def parse_later_sailings(sailings: List[str], today: datetime, tomorrow: datetime) -> List[datetime]:
+    """ Work out when each of a route's later sailings is.
+
+    For some sailings (i.e. Tsawwassen to Southern Gulf Islands) the later sailings can actually include the day
+    *after* tomorrow as well as tomorrow - e.g. "*11:10am *5:40pm *9:05pm *9:55am". This is as dumb as all hell but
+    we have to handle it or we end up with phantom sailings being created.
+
+    :param sailings: the later sailings, as shown on the page
+    :type sailings: list
+    :param today: the local day the page was captured
+    :type today: datetime
+    :param tomorrow: the day after
+    :type tomorrow: datetime
+    :returns: list of the sailing times
+    :rtype: list
+    """
+
+    latest_time = None
+    times = []
+
+    # Iterate over the later sailings
+    for sailing in sailings:
+        logger.debug("Found later sailing {}".format(sailing))
+
+        # Check if the sailing is cancelled
+        if re.search('-Cancelled', sailing):
+            # Sailing is cancelled
+            logger.debug("Later sailing is cancelled")
+            (sailing, _) = sailing.split('-')
+
+        # Check if the sailing is tomorrow
+        if sailing.startswith('*'):
+            # Sailing is tomorrow
+            sailing_time = local_time(tomorrow, sailing[1:])
+
+            # Check for the aforementioned stupidity
+            if latest_time and sailing_time < latest_time:
+                # Sailing is for the day after tomorrow
+                sailing_time = sailing_time + timedelta(days=1)
+                logger.debug("Later sailing is for the DAY AFTER tomorrow: {}".format(sailing_time))
+            else:
+                # Sailing is for tomorrow
+                logger.debug("Later sailing is tomorrow: {}".format(sailing_time))
+        else:
+            # Sailing is today
+            sailing_time = local_time(today, sailing)
+            logger.debug("Later sailing is today: {}".format(sailing_time))
+
+        latest_time = sailing_time
+        times.append(sailing_time)
+
+    return times
+
+
+def parse_locations(data: str, captured_at: datetime) -> List[dict]:
+    """ Parse a route location page.
+
+    The page only gives the time each ferry was last updated, so that's taken to be on the day the page was captured,
+    unless that would put it after the page was captured, in which case it was yesterday. This doesn't touch the
+    database.
+
+    :param data: the page content
+    :type data: str
+    :param captured_at: when the page was captured
+    :type captured_at: datetime
+    :returns: list of dicts of each ferry's name, status, destination and last updated time
+    :rtype: list
+    """
+
+    now = captured_at.astimezone(timezone)
+    yesterday = now - timedelta(days=1)
+
+    ferries = []
+
+    # Parse out the ferry name, status, destination and the last updated time for each ferry
+    for (ferry, status, destination, time) in location_rows(data):
+        logger.debug("Found {} (-> {}, {} @ {})".format(ferry, destination, status, time))
+
+        # Localise the times
+        updated_time = local_time(now, time)
+
+        # Handle times that were yesterday
+        if updated_time > now:
+            logger.debug("Updated time was yesterday")
+            updated_time = local_time(yesterday, time)
+
+        ferries.append({
+            "ferry": ferry,
+            "status": status,
+            "destination": destination,
+            "time": time,
+            "updated": updated_time
+        })
+
+    return ferries
+
+
+def parse_sailing_detail(data: str, captured_at: datetime) -> dict:
+    """ Parse a sailing detail page.
+
+    This only pulls out what's on the page, and doesn't touch the database. The details of the sailing (and the ferry)
+    are only there if there are more sailings today, and the ferry and deck space are only there if the sailing isn't
+    cancelled. The page only gives the time of the sailing, so it's taken to be on the day the page was captured.
+
+    :param data: the page content
+    :type data: str
+    :param captured_at: when the page was captured
+    :type captured_at: datetime
+    :returns: dict of the route name, terminal code, sailing details and scheduled departure, whether the sailing is
+        cancelled, the ferry, how full the car and oversize decks are, parking and the pages for the other sailings
+        on the route
+    :rtype: dict
+    """
+
+    b = make_soup(data)
+
+    detail = {
+        "route_name": b.font.text,
+        "terminal_code": re.search(r'.*arrivals-departures.html\?dept=(\w+)&.*', data).groups()[0],
+        "sailing_details": None,
+        "scheduled_departure": None,
+        "cancelled": False,
+        "ferry": None,
+        "car_percent_full": None,
+        "oversize_percent_full": None,
+        "other_sailings": []
+    }
+
+    # Check for the "No more scheduled sailings for today" message
+    if "No more scheduled sailings for today" not in data:
+        detail["other_sailings"] = [option['value'] for option in b.find('select').find_all('option')]
+        detail["sailing_details"] = next(span.text for span in b.find_all('span') if 'Sailing Details' in span.text)
+
+        # Parse the sailing time, on the day the page was captured
+        sailing_time = re.search(r'.*:\s(\S+ \w+)', detail["sailing_details"]).groups()[0]
+        detail["scheduled_departure"] = local_time(captured_at.astimezone(timezone), sailing_time)
+
+        if "CANCELLED" in detail["sailing_details"]:
+            detail["cancelled"] = True
+        else:
+            detail["ferry"] = next(a.text for a in b.find_all('a') if 'onboard' in a['href'] and a.text)
+
+            # Parse out the amount of deck space already committed by both cars and oversize vehicles
+            deck_space = re.search(r'.*"DeckSpace_pop.asp\?os=(-?\d+)&uh=(-?\d+)&tm=(\d+)".*', data)
+            if deck_space:
+                oversize_space, car_space, timestamp = deck_space.groups()
+                detail["car_percent_full"] = int(car_space)
+                detail["oversize_percent_full"] = int(oversize_space)
+
+    # Parse out the parking available at the source terminal
+    detail["parking"] = int(re.search(r'\s(\d+)%.*', next(
+        td.text for td in b.find_all('td') if (len(td.find_all('a')) == 1 and td.a.text == "Parking")
+    )).groups()[0])
+
+    return detail
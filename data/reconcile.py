@@ -0,0 +1,129 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Tuple
+
+from . import clock
+from .models import Route, Sailing, SailingEvent
+
+logger = logging.getLogger(__name__)
+
+
+class DeparturesReconciler:
+    """ Reconcile parsed departures against the database in memory.
+
+    The day's sailings are loaded up front in a single query, and sailing() stands in for get_or_create against them.
+    Changes to sailings, and the events for those changes, are held until save() writes them in bulk. Terminals,
+    routes, ferries and the like come from the run's References.
+    """
+
+    # Sailing fields that can change during reconciliation (sailing_created is set by hand, as bulk_update skips
+    # auto_now fields)
+    SAILING_FIELDS = [
+        "ferry", "actual_departure", "eta_or_arrival_time", "status", "departed", "arrived", "sailing_time",
+        "day_of_week", "duration", "scheduled_arrival", "late_leaving", "late_arriving", "sailing_created"
+    ]
+
+    def __init__(self, day: datetime):
+        """
+        :param day: local midnight at the start of the day the departures are for
+        :type day: datetime
+        """
+
+        self.sailings = {
+            (sailing.route_id, sailing.scheduled_departure): sailing
+            for sailing in Sailing.objects.filter(
+                scheduled_departure__gte=day,
+                scheduled_departure__lt=day + timedelta(days=1)
+            ).select_related('ferry', 'status')
+        }
+
+        self.new_sailings = []
+        self.changed_sailings = {}
+        self.events = []
+
+    def sailing(self, route: Route, scheduled_departure: datetime) -> Tuple[Sailing, bool]:
+        """ Get a Sailing, or a new unsaved one if we don't have it yet. New sailings are written by save().
+
+        :returns: tuple of the Sailing and whether it was created
+        :rtype: tuple
+        """
+
+        key = (route.pk, scheduled_departure)
+        sailing = self.sailings.get(key)
+        if sailing:
+            sailing.route = route
+            return sailing, False
+
+        sailing = Sailing(route=route, scheduled_departure=scheduled_departure)
+        self.sailings[key] = sailing
+        self.new_sailings.append(sailing)
+        return sailing, True
+
+    def changed(self, sailing: Sailing, *events: SailingEvent) -> None:
+        """ Mark a Sailing as changed, and queue up the events for the change.
+
+        :param sailing: the Sailing that has changed
+        :type sailing: Sailing
+        :param events: the events to save for the change, in order
+        :type events: SailingEvent
+        :returns: nothing
+        :rtype: None
+        """
+
+        if sailing.pk:
+            self.changed_sailings[sailing.pk] = sailing
+
+        self.events.extend(events)
+
+    def save(self, uow) -> int:
+        """ Write the new and changed sailings, and queue up their events.
+
+        :param uow: the UnitOfWork for the run
+        :type uow: UnitOfWork
+        :returns: the number of sailings written
+        :rtype: int
+        """
+
+        now = clock.now()
+        new = self.new_sailings
+        changed = list(self.changed_sailings.values())
+
+        for sailing in new + changed:
+            sailing.calculate()
+            sailing.sailing_created = now
+
+        if new:
+            Sailing.objects.bulk_create(new)
+
+            if any(sailing.pk is None for sailing in new):
+                # We need the IDs for the events, and this database can't give them back from a bulk insert, so look
+                # them up by route and scheduled departure (the newest row wins, if there are duplicates)
+                ids = dict(
+                    ((route_id, scheduled_departure), pk)
+                    for route_id, scheduled_departure, pk in Sailing.objects.filter(
+                        route_id__in={sailing.route_id for sailing in new},
+                        scheduled_departure__in={sailing.scheduled_departure for sailing in new}
+                    ).order_by('pk').values_list('route_id', 'scheduled_departure', 'pk')
+                )
+
+                for sailing in new:
+                    sailing.pk = ids[(sailing.route_id, sailing.scheduled_departure)]
+
+        if changed:
+            Sailing.objects.bulk_update(changed, self.SAILING_FIELDS)
+
+        # Now that the sailings all have IDs, the events can be inserted
+        uow.add(*self.events)
+
+        for sailing in new + changed:
+            sailing.update_norms()
+
+        logger.debug("Wrote {} new and {} changed sailings, with {} events".format(
+            len(new), len(changed), len(self.events)
+        ))
+
+        self.new_sailings = []
+        self.changed_sailings = {}
+        self.events = []
+
+        return len(new) + len(changed)
@@ -0,0 +1,333 @@
+import logging
+import threading
+import zlib
+from django.conf import settings
+from django.db import connection, models
+from time import monotonic
+from typing import List, Tuple
+
+from .models import Terminal, Destination, Route, Ferry, Status
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceCache:
+    """ Process-wide cache of the reference data the collectors look up by name.
+
+    Terminals, destinations, routes, ferries and statuses are small tables that rarely change, so they're loaded in
+    one go and kept in memory between runs. The cache is reloaded when a lookup misses (someone may have added a row)
+    and after BCF_REFERENCE_CACHE_TTL seconds, so that changes made by other processes are picked up eventually.
+
+    Only the fields the rows are looked up by are cached. The rest (a ferry's status, a route's waits, and so on) are
+    updated by every run, so each run reads them fresh from the database rather than trusting a copy that another
+    process may have since changed.
+
+    Collector runs don't use the cached rows directly - each run gets its own References from session().
+    """
+
+    MODELS = [Terminal, Destination, Route, Ferry, Status]
+
+    # Fields that collector runs update, which are never cached
+    MUTABLE_FIELDS = {
+        Terminal: ["parking"],
+        Route: ["car_waits", "oversize_waits", "duration"],
+        Ferry: ["destination", "status", "last_updated", "heading"]
+    }
+
+    def __init__(self, ttl: float = None):
+        """
+        :param ttl: how long to keep the cache before reloading it, in seconds
+        :type ttl: float
+        """
+
+        self.ttl = settings.BCF_REFERENCE_CACHE_TTL if ttl is None else ttl
+        self.rows = None
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def cached_fields(cls, model) -> list:
+        """ Return the fields of a model that are cached. """
+
+        mutable = cls.MUTABLE_FIELDS.get(model, [])
+        return [field for field in model._meta.concrete_fields if field.name not in mutable]
+
+    @classmethod
+    def values(cls, obj: models.Model) -> dict:
+        """ Return the cached field values for an object, keyed by attname. """
+
+        values = {}
+        for field in cls.cached_fields(type(obj)):
+            value = getattr(obj, field.attname)
+            # Objects created by a run may still have the values they were created with (e.g. strings for integers)
+            values[field.attname] = value if field.is_relation else field.to_python(value)
+
+        return values
+
+    def load(self) -> None:
+        """ Load all of the reference data from the database.
+
+        :returns: nothing
+        :rtype: None
+        """
+
+        rows = {
+            model: {
+                obj.pk: self.values(obj)
+                for obj in model.objects.only(*[field.name for field in self.cached_fields(model)])
+            }
+            for model in self.MODELS
+        }
+
+        with self.lock:
+            self.rows = rows
+            self.loaded_at = monotonic()
+
+        logger.debug("Loaded reference data ({})".format(
+            ", ".join("{} {}".format(len(rows[model]), model.__name__) for model in self.MODELS)
+        ))
+
+    def get_rows(self, model) -> dict:
+        """ Return the cached rows for a model, loading them if need be.
+
+        :param model: the model to get rows for
+        :type model: models.Model
+        :returns: dict of primary key to field values
+        :rtype: dict
+        """
+
+        with self.lock:
+            rows = self.rows
+            expired = monotonic() - self.loaded_at > self.ttl
+
+        if rows is None or expired:
+            self.load()
+            rows = self.rows
+
+        return rows[model]
+
+    def invalidate(self) -> None:
+        """ Throw away the cache, so that it's reloaded on the next lookup.
+
+        :returns: nothing
+        :rtype: None
+        """
+
+        with self.lock:
+            self.rows = None
+
+    def publish(self, objs: List[models.Model]) -> None:
+        """ Add some objects to the cache, once they've been committed.
+
+        :param objs: the objects to add
+        :type objs: list
+        :returns: nothing
+        :rtype: None
+        """
+
+        with self.lock:
+            if self.rows is None:
+                return
+
+            # Replace rather than modify the dicts, as lookups may be reading them without the lock
+            rows = dict(self.rows)
+            for model in {type(obj) for obj in objs}:
+                rows[model] = dict(rows[model])
+
+            for obj in objs:
+                rows[type(obj)][obj.pk] = self.values(obj)
+
+            self.rows = rows
+
+    def session(self) -> "References":
+        """ Return a new References for a collector run.
+
+        :returns: References backed by this cache
+        :rtype: References
+        """
+
+        return References(self)
+
+
+class References:
+    """ Reference data lookups for a single collector run.
+
+    The lookups behave like the equivalent get() and get_or_create() calls, but are answered from the ReferenceCache.
+    Each row is only turned into an object once per run, so every lookup of the same row within a run returns the
+    same object, and changes made to it earlier in the run are visible. The fields that aren't cached are read from
+    the database the first time a run turns one of a model's rows into an object, in a single query for the model.
+    """
+
+    def __init__(self, cache: ReferenceCache):
+        """
+        :param cache: the cache to look rows up in
+        :type cache: ReferenceCache
+        """
+
+        self.cache = cache
+        self.objects = {}
+        self.created = []
+        self.mutable = {}
+
+    def mutable_values(self, model, pk: int) -> dict:
+        """ Return the current values of the fields of a row that aren't cached, keyed by attname. """
+
+        names = ReferenceCache.MUTABLE_FIELDS.get(model)
+        if not names:
+            return {}
+
+        if model not in self.mutable:
+            attnames = [model._meta.get_field(name).attname for name in names]
+            self.mutable[model] = {
+                row[0]: dict(zip(attnames, row[1:])) for row in model.objects.values_list('pk', *attnames)
+            }
+
+        # Rows that have gone since they were cached are left with the fields deferred
+        return self.mutable[model].get(pk, {})
+
+    def instance(self, model, pk: int, values: dict) -> models.Model:
+        """ Return the object for a row, creating it if we haven't seen it this run. """
+
+        key = (model, pk)
+        if key not in self.objects:
+            values = dict(values, **self.mutable_values(model, pk))
+            self.objects[key] = model.from_db(connection.alias, list(values), list(values.values()))
+
+        return self.objects[key]
+
+    def filter(self, model, **kwargs) -> List[models.Model]:
+        """ Return the objects matching the given lookups. Only exact and startswith lookups are supported.
+
+        :param model: the model to look up
+        :type model: models.Model
+        :returns: list of matching objects
+        :rtype: list
+        """
+
+        lookups = []
+        for key, expected in kwargs.items():
+            name, _, lookup = key.partition("__")
+            field = model._meta.get_field(name)
+
+            if isinstance(expected, models.Model):
+                expected = expected.pk
+            elif not field.is_relation:
+                expected = field.to_python(expected)
+
+            lookups.append((field.attname, lookup, expected))
+
+        def matches(values):
+            for attname, lookup, expected in lookups:
+                value = values[attname]
+                if lookup == "startswith":
+                    if value is None or not value.startswith(expected):
+                        return False
+                elif value != expected:
+                    return False
+            return True
+
+        return [
+            self.instance(model, pk, values) for pk, values in self.cache.get_rows(model).items() if matches(values)
+        ]
+
+    def get(self, model, **kwargs) -> models.Model:
+        """ Look up a single object, in the same way as get().
+
+        :param model: the model to look up
+        :type model: models.Model
+        :returns: the matching object
+        :rtype: models.Model
+        """
+
+        objs = self.filter(model, **kwargs)
+
+        if not objs:
+            # It may have been added since we loaded the cache
+            self.cache.load()
+            objs = self.filter(model, **kwargs)
+
+        if not objs:
+            raise model.DoesNotExist("{} matching {} does not exist".format(model.__name__, kwargs))
+        elif len(objs) > 1:
+            raise model.MultipleObjectsReturned("{} {} objects match {}".format(len(objs), model.__name__, kwargs))
+
+        return objs[0]
+
+    def get_or_create(self, model, **kwargs) -> Tuple[models.Model, bool]:
+        """ Look up a single object, creating it if it doesn't exist, in the same way as get_or_create().
+
+        :param model: the model to look up
+        :type model: models.Model
+        :returns: tuple of the object and whether it was created
+        :rtype: tuple
+        """
+
+        try:
+            return self.get(model, **kwargs), False
+        except model.DoesNotExist:
+            pass
+
+        if self.lock(model, kwargs):
+            # Someone else may have created it while we were waiting for the lock
+            try:
+                return self.get(model, **kwargs), False
+            except model.DoesNotExist:
+                pass
+
+        obj = model.objects.create(**kwargs)
+        self.objects[(model, obj.pk)] = obj
+        self.created.append(obj)
+        return obj, True
+
+    @staticmethod
+    def lock(model, kwargs: dict) -> bool:
+        """ Stop other processes creating the same object until this run's transaction finishes.
+
+        The reference tables don't have unique constraints, so without this, two runs in parallel could both create
+        the same row. Only PostgreSQL is supported - on SQLite, writes are serialised anyway.
+
+        :returns: whether the lock was taken
+        :rtype: bool
+        """
+
+        if connection.vendor != "postgresql" or not connection.in_atomic_block:
+            return False
+
+        values = sorted(
+            (name, value.pk if isinstance(value, models.Model) else value) for name, value in kwargs.items()
+        )
+        key = zlib.crc32(repr((model._meta.label, values)).encode())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [key])
+
+        return True
+
+    def publish(self) -> None:
+        """ Add the objects this run created to the cache. This should only be called once the run's changes have
+        been committed.
+
+        :returns: nothing
+        :rtype: None
+        """
+
+        self.cache.publish(self.created)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_reference_cache() -> ReferenceCache:
+    """ Return the shared ReferenceCache, creating it if need be.
+
+    :returns: the shared ReferenceCache
+    :rtype: ReferenceCache
+    """
+
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = ReferenceCache()
+
+    return _cache
@@ -0,0 +1,341 @@
+import logging
+import random
+import threading
+from django.utils import timezone as tz
+from datetime import datetime
+from time import monotonic
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# What to do when a job's run is missed (because the last run overran, or the worker was busy)
+SKIP = "skip"
+RUN_ONCE = "run_once"
+
+MISSED_POLICIES = [SKIP, RUN_ONCE]
+
+
+class Clock:
+    """ The time source for a Scheduler. Tests swap this out for a fake clock. """
+
+    def monotonic(self) -> float:
+        """ Return the time used to schedule jobs, in seconds. """
+
+        return monotonic()
+
+    def now(self) -> datetime:
+        """ Return the current wall-clock time, for reporting. """
+
+        return tz.now()
+
+    def wait(self, event: threading.Event, timeout: float) -> bool:
+        """ Wait until the event is set or the timeout passes.
+
+        :param event: the event to wait on
+        :type event: threading.Event
+        :param timeout: how long to wait, in seconds
+        :type timeout: float
+        :returns: whether the event was set
+        :rtype: bool
+        """
+
+        return event.wait(timeout)
+
+
+class Job:
+    """ A function run by the Scheduler on a fixed interval.
+
+    Runs are scheduled against fixed slots (start, start + interval, start + 2 * interval, ...) rather than from when
+    the last run finished, so a slow run doesn't shift the cadence. Each run can be delayed by up to jitter seconds
+    past its slot, so that jobs with the same interval don't all hit BC Ferries at the same moment.
+
+    A job is never run while its previous run is still going. If one or more slots are missed, the missed policy
+    decides what happens: SKIP waits for the next slot, and RUN_ONCE runs straight away (once, however many slots were
+    missed) and then carries on from the next slot.
+
+    Jobs with a cadence ask it for the interval each time they start, so the gap to the next slot can change from run
+    to run.
+    """
+
+    def __init__(self, name: str, func: Callable, interval: float, jitter: float = 0, missed: str = SKIP,
+                 start: float = 0, cadence: Callable[[], float] = None):
+        """
+        :param name: the name of the job
+        :type name: str
+        :param func: the function to run
+        :type func: Callable
+        :param interval: how often to run the job, in seconds
+        :type interval: float
+        :param jitter: the most a run can be delayed past its slot, in seconds
+        :type jitter: float
+        :param missed: what to do about missed runs (SKIP or RUN_ONCE)
+        :type missed: str
+        :param start: the time of the first slot, by the scheduler's clock
+        :type start: float
+        :param cadence: called to get the interval before each run, in seconds
+        :type cadence: Callable
+        """
+
+        if interval <= 0:
+            raise ValueError("Interval for {} must be positive".format(name))
+
+        if missed not in MISSED_POLICIES:
+            raise ValueError("Unknown missed run policy {} for {}".format(missed, name))
+
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.missed = missed
+        self.cadence = cadence
+
+        self.slot = start
+        self.due = start
+
+        self.running = False
+        self.runs = 0
+        self.missed_runs = 0
+        self.failures = 0
+        self.last_started = None
+        self.last_finished = None
+        self.last_duration = None
+        self.last_error = None
+
+    def advance(self, slots: int, jitter: float = 0) -> None:
+        """ Move the job on by a number of slots.
+
+        :param slots: how many slots to move on by
+        :type slots: int
+        :param jitter: the delay to add to the new slot
+        :type jitter: float
+        :returns: nothing
+        :rtype: None
+        """
+
+        self.slot += slots * self.interval
+        self.due = self.slot + jitter
+
+    def start(self, now: float, jitter: float = 0) -> bool:
+        """ Decide whether a job that's due should be started now, and move it on to its next slot.
+
+        :param now: the current time, by the scheduler's clock
+        :type now: float
+        :param jitter: the delay to add to the next slot
+        :type jitter: float
+        :returns: whether the job should be started
+        :rtype: bool
+        """
+
+        # How many slots have passed since the one we're due for
+        behind = int((now - self.slot) // self.interval)
+
+        if self.running:
+            logger.info("Job {} is still running, not starting it again".format(self.name))
+            self.missed_runs += behind + 1
+            self.advance(behind + 1, jitter)
+            return False
+
+        if behind:
+            if self.missed == SKIP:
+                logger.info("Missed {} run(s) of {}, skipping to the next slot".format(behind + 1, self.name))
+                self.missed_runs += behind + 1
+                self.advance(behind + 1, jitter)
+                return False
+
+            # Run now, for the most recent slot
+            logger.info("Missed {} run(s) of {}, running now".format(behind, self.name))
+            self.missed_runs += behind
+            self.slot += behind * self.interval
+
+        if self.cadence:
+            try:
+                self.interval = self.cadence()
+            except Exception:
+                logger.exception("Couldn't get the interval for {}, keeping it at {}s".format(self.name, self.interval))
+
+        self.advance(1, jitter)
+        return True
+
+    @property
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "interval": self.interval,
+            "jitter": self.jitter,
+            "missed": self.missed,
+            "running": self.running,
+            "runs": self.runs,
+            "missed_runs": self.missed_runs,
+            "failures": self.failures,
+            "last_started": self.last_started,
+            "last_finished": self.last_finished,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error
+        }
+
+
+class Scheduler:
+    """ Run jobs on their own intervals.
+
+    The scheduler sleeps until the next job is due (or until it's stopped or a job is added), rather than waking up
+    periodically to check. By default, each run is started on its own thread so that a slow job doesn't hold up the
+    others.
+    """
+
+    def __init__(self, clock: Clock = None, runner: Callable = None, seed: int = None):
+        """
+        :param clock: the time source (defaults to the system clock)
+        :type clock: Clock
+        :param runner: called with a function to start it running (defaults to starting a thread)
+        :type runner: Callable
+        :param seed: seed for the jitter
+        :type seed: int
+        """
+
+        self.clock = clock or Clock()
+        self.runner = runner or self.start_thread
+        self.random = random.Random(seed)
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+
+    @staticmethod
+    def start_thread(func: Callable) -> None:
+        threading.Thread(target=func, daemon=True).start()
+
+    def add(self, name: str, func: Callable, interval: float, jitter: float = 0, missed: str = SKIP,
+            delay: float = 0, cadence: Callable[[], float] = None) -> Job:
+        """ Add a job.
+
+        :param name: the name of the job
+        :type name: str
+        :param func: the function to run
+        :type func: Callable
+        :param interval: how often to run the job, in seconds
+        :type interval: float
+        :param jitter: the most a run can be delayed past its slot, in seconds
+        :type jitter: float
+        :param missed: what to do about missed runs (SKIP or RUN_ONCE)
+        :type missed: str
+        :param delay: how long to wait before the first run, in seconds
+        :type delay: float
+        :param cadence: called to get the interval before each run, in seconds
+        :type cadence: Callable
+        :returns: the new job
+        :rtype: Job
+        """
+
+        job = Job(name, func, interval, jitter, missed, start=self.clock.monotonic() + delay, cadence=cadence)
+
+        with self.lock:
+            self.jobs.append(job)
+
+        self.wakeup.set()
+        return job
+
+    def get(self, name: str) -> Optional[Job]:
+        """ Return the job with the given name, if there is one. """
+
+        for job in self.jobs:
+            if job.name == name:
+                return job
+
+        return None
+
+    def execute(self, job: Job) -> None:
+        """ Run a job, and record how it went. """
+
+        start = self.clock.monotonic()
+
+        try:
+            job.func()
+            job.last_error = None
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            logger.exception("Job {} failed".format(job.name))
+        finally:
+            job.last_duration = self.clock.monotonic() - start
+            job.last_finished = self.clock.now()
+            job.running = False
+            logger.debug("Job {} took {:.3f}s".format(job.name, job.last_duration))
+
+            # Let the loop reschedule anything that was waiting for this job
+            self.wakeup.set()
+
+    def run_pending(self) -> List[Job]:
+        """ Start every job that's due.
+
+        :returns: the jobs that were started
+        :rtype: list
+        """
+
+        now = self.clock.monotonic()
+        started = []
+
+        with self.lock:
+            for job in self.jobs:
+                if job.due > now:
+                    continue
+
+                jitter = self.random.uniform(0, job.jitter) if job.jitter else 0
+
+                if not job.start(now, jitter):
+                    continue
+
+                job.running = True
+                job.runs += 1
+                job.last_started = self.clock.now()
+                started.append(job)
+
+        for job in started:
+            logger.debug("Starting job {}".format(job.name))
+            self.runner(lambda job=job: self.execute(job))
+
+        return started
+
+    def next_due(self) -> Optional[float]:
+        """ Return how long until the next job is due, in seconds, or None if there aren't any jobs. """
+
+        with self.lock:
+            if not self.jobs:
+                return None
+
+            return max(min(job.due for job in self.jobs) - self.clock.monotonic(), 0)
+
+    def run(self) -> None:
+        """ Run jobs until stop() is called.
+
+        :returns: nothing
+        :rtype: None
+        """
+
+        logger.info("Scheduler started with {} jobs".format(len(self.jobs)))
+
+        while not self.stopped:
+            self.wakeup.clear()
+            self.run_pending()
+
+            timeout = self.next_due()
+            if timeout is None or timeout > 0:
+                self.clock.wait(self.wakeup, timeout)
+
+        logger.info("Scheduler stopped")
+
+    def stop(self) -> None:
+        """ Stop the scheduler. Runs that have already started carry on until they finish.
+
+        :returns: nothing
+        :rtype: None
+        """
+
+        self.stopped = True
+        self.wakeup.set()
+
+    @property
+    def as_dict(self) -> dict:
+        return {
+            "stopped": self.stopped,
+            "jobs": [job.as_dict for job in self.jobs]
+        }
@@ -0,0 +1,196 @@
+from django.db.models import OuterRef, Subquery, prefetch_related_objects
+from collections import defaultdict
+from typing import Iterable, Iterator, List
+import logging
+
+from .models import EventLog, Ferry, Sailing, SailingNorm
+
+logger = logging.getLogger(__name__)
+
+
+def prefetch_ferries(ferries: Iterable[Ferry]) -> None:
+    """ Load the current and next sailings for a number of Ferry objects at once.
+
+    This primes the current and next sailings that Ferry.as_dict uses on each Ferry, so that it doesn't have to
+    query for them.
+
+    :param ferries: the Ferry objects to prime
+    :type ferries: Iterable[Ferry]
+    :returns: nothing
+    :rtype: None
+    """
+
+    ferries = list(ferries)
+    if not ferries:
+        return
+
+    # Work out the current and next sailing IDs for each ferry in a single query, using the same
+    # filtering and ordering as the Ferry.current_sailing and Ferry.next_sailing properties
+    current = Sailing.objects.filter(
+        ferry=OuterRef('pk'), departed=True, arrived=False
+    ).order_by("-scheduled_departure").values('pk')[:1]
+    upcoming = Sailing.objects.filter(
+        ferry=OuterRef('pk'), departed=False
+    ).order_by("-scheduled_departure").values('pk')[:1]
+
+    sailing_ids = {
+        pk: (current_id, next_id) for pk, current_id, next_id in Ferry.objects.filter(
+            pk__in={ferry.pk for ferry in ferries}
+        ).annotate(
+            current_sailing_id=Subquery(current),
+            next_sailing_id=Subquery(upcoming)
+        ).values_list('pk', 'current_sailing_id', 'next_sailing_id')
+    }
+
+    # Load all of those sailings (and their routes) in one go
+    sailings = Sailing.objects.select_related('route').in_bulk(
+        {pk for ids in sailing_ids.values() for pk in ids if pk}
+    )
+
+    for ferry in ferries:
+        current_id, next_id = sailing_ids.get(ferry.pk, (None, None))
+
+        # Ferry.current_sailing only applies to ferries which are under way
+        ferry._prefetched_sailings = (
+            sailings.get(current_id) if ferry.status == "Under Way" else None,
+            sailings.get(next_id)
+        )
+
+
+def prefetch_events(sailings: Iterable[Sailing]) -> None:
+    """ Load the events for a number of Sailing objects at once.
+
+    This primes the cached events property on each Sailing from the flat event log.
+
+    :param sailings: the Sailing objects to prime
+    :type sailings: Iterable[Sailing]
+    :returns: nothing
+    :rtype: None
+    """
+
+    sailings = list(sailings)
+    events = defaultdict(list)
+
+    for event in EventLog.objects.filter(
+        entity="sailing", entity_id__in=[sailing.pk for sailing in sailings]
+    ).order_by('timestamp', 'event_id'):
+        events[event.entity_id].append(event)
+
+    for sailing in sailings:
+        sailing.events = events.get(sailing.pk, [])
+
+
+def prefetch_norms(sailings: Iterable[Sailing]) -> None:
+    """ Load the historical norms for a number of Sailing objects at once.
+
+    This primes the cached norm property on each Sailing, which the aggregates are read from.
+
+    :param sailings: the Sailing objects to prime
+    :type sailings: Iterable[Sailing]
+    :returns: nothing
+    :rtype: None
+    """
+
+    sailings = list(sailings)
+    if not sailings:
+        return
+
+    # This may pull in a few more norms than we need, but it's a single query
+    norms = {
+        (norm.route_id, norm.sailing_time, norm.day_of_week): norm for norm in SailingNorm.objects.filter(
+            route__in={sailing.route_id for sailing in sailings},
+            sailing_time__in={sailing.sailing_time for sailing in sailings},
+            day_of_week__in={sailing.day_of_week for sailing in sailings}
+        )
+    }
+
+    for sailing in sailings:
+        sailing.norm = norms.get((sailing.route_id, sailing.sailing_time, sailing.day_of_week))
+
+
+def prime_sailings(sailings: List[Sailing]) -> List[Sailing]:
+    """ Load everything Sailing.as_dict needs for a list of Sailings, which have already been loaded along with their
+    route, status and ferry.
+
+    The number of queries this makes is fixed, regardless of the number of sailings.
+
+    :param sailings: list of Sailings to prime
+    :type sailings: list
+    :returns: the same list of Sailings
+    :rtype: list
+    """
+
+    # Sailings sharing a ferry can share the same Ferry object, so that it only gets primed once
+    ferries = {}
+    for sailing in sailings:
+        if sailing.ferry_id:
+            sailing.ferry = ferries.setdefault(sailing.ferry_id, sailing.ferry)
+
+    prefetch_related_objects(list(ferries.values()), 'amenities')
+    prefetch_ferries(ferries.values())
+    prefetch_events(sailings)
+    prefetch_norms(sailings)
+
+    return sailings
+
+
+def prefetch_sailings(sailings) -> list:
+    """ Load a QuerySet of Sailings, along with everything Sailing.as_dict needs.
+
+    The number of queries this makes is fixed, regardless of the number of sailings.
+
+    :param sailings: QuerySet of Sailings to load
+    :type sailings: QuerySet
+    :returns: list of primed Sailing objects
+    :rtype: list
+    """
+
+    return prime_sailings(list(
+        sailings.select_related('route', 'status', 'ferry', 'ferry__destination')
+    ))
+
+
+def sailings_as_dicts(sailings) -> list:
+    """ Return a list of dict representations of a QuerySet of Sailings.
+
+    This is equivalent to calling as_dict on each Sailing, but without the per-sailing queries.
+
+    :param sailings: QuerySet of Sailings
+    :type sailings: QuerySet
+    :returns: list of dicts representing each Sailing
+    :rtype: list
+    """
+
+    return [
+        sailing.as_dict for sailing in prefetch_sailings(sailings)
+    ]
+
+
+def iter_sailings_as_dicts(sailings, chunk_size: int = 500) -> Iterator[dict]:
+    """ Yield the dict representation of each Sailing in a QuerySet, a chunk at a time.
+
+    Unlike sailings_as_dicts, only one chunk of sailings is held in memory at once, however many there are. Each
+    chunk takes the same fixed number of queries to prime.
+
+    :param sailings: QuerySet of Sailings
+    :type sailings: QuerySet
+    :param chunk_size: how many sailings to load at once
+    :type chunk_size: int
+    :returns: iterator of dicts representing each Sailing
+    :rtype: Iterator[dict]
+    """
+
+    chunk = []
+
+    for sailing in sailings.select_related(
+        'route', 'status', 'ferry', 'ferry__destination'
+    ).iterator(chunk_size=chunk_size):
+        chunk.append(sailing)
+
+        if len(chunk) == chunk_size:
+            for primed in prime_sailings(chunk):
+                yield primed.as_dict
+            chunk = []
+
+    for primed in prime_sailings(chunk):
+        yield primed.as_dict
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_save
+import logging
+
+from .models import EventLog
+
+logger = logging.getLogger(__name__)
+
+
+def log_event(sender, instance, created, raw=False, **kwargs):
+    """ Add newly-saved events to the flat event log.
+
+    Events inserted in bulk by an EventSink are logged by the sink instead.
+    """
+
+    if created and not raw:
+        EventLog.from_event(instance).save()
+
+
+# Events are saved as one of the event subclasses, which are what the signal is sent for
+for model, entity, field in EventLog.event_models():
+    post_save.connect(log_event, sender=model, dispatch_uid="log_event_{}".format(model.__name__))
@@ -0,0 +1,174 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.db import connection
+from functools import partial
+from time import monotonic
+from typing import Callable, Dict, Iterable
+
+from .cadence import TimetableCadence
+from .client import get_client
+from .jobqueue import JobQueue
+from .locations import get_location_poller, LOCATION_ROUTES
+from .utils import get_actual_departures, get_current_conditions, get_ferry_locations
+
+logger = logging.getLogger(__name__)
+
+
+class TaskGraph:
+    """ Run a set of tasks, each one as soon as the tasks it comes after have finished.
+
+    Tasks that don't depend on each other run at the same time, each on its own thread (and so with its own database
+    connection), so the whole graph takes as long as its longest chain of tasks. A task runs once the tasks it comes
+    after have finished, whether or not they succeeded, just as if they'd been run one after another.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def add(self, name: str, func: Callable, after: Iterable[str] = None) -> None:
+        """ Add a task. The tasks it comes after have to be added first, so there can't be any cycles.
+
+        :param name: the name of the task
+        :type name: str
+        :param func: the function to run
+        :type func: Callable
+        :param after: the names of the tasks it has to wait for
+        :type after: Iterable[str]
+        :returns: nothing
+        :rtype: None
+        """
+
+        after = list(after or [])
+
+        if name in self.tasks:
+            raise ValueError("Task {} has already been added".format(name))
+
+        for dependency in after:
+            if dependency not in self.tasks:
+                raise ValueError("Task {} comes after {}, which hasn't been added".format(name, dependency))
+
+        self.tasks[name] = (func, after)
+
+    def execute(self, name: str) -> dict:
+        """ Run a single task, and record how it went. """
+
+        func, _ = self.tasks[name]
+        start = monotonic()
+        result = {"result": None, "error": None}
+
+        logger.debug("Starting task {}".format(name))
+
+        try:
+            result["result"] = func()
+        except Exception as e:
+            logger.exception("Task {} failed".format(name))
+            result["error"] = str(e)
+        finally:
+            # Each task runs on its own thread, so don't leave its connection open
+            connection.close()
+
+        result["duration"] = monotonic() - start
+        logger.debug("Task {} took {:.3f}s".format(name, result["duration"]))
+
+        return result
+
+    def run(self, concurrency: int = None) -> Dict[str, dict]:
+        """ Run all of the tasks.
+
+        :param concurrency: the most tasks to run at once (defaults to as many as can run)
+        :type concurrency: int
+        :returns: dict of task name to its result, error and duration
+        :rtype: dict
+        """
+
+        pending = dict(self.tasks)
+        running = {}
+        finished = {}
+        start = monotonic()
+
+        with ThreadPoolExecutor(max_workers=concurrency or max(len(self.tasks), 1)) as executor:
+            while pending or running:
+                for name, (_, after) in list(pending.items()):
+                    if all(dependency in finished for dependency in after):
+                        running[executor.submit(self.execute, name)] = name
+                        del pending[name]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished[running.pop(future)] = future.result()
+
+        logger.info("Ran {} tasks in {:.3f}s ({})".format(
+            len(finished), monotonic() - start,
+            ", ".join("{} {:.3f}s".format(name, finished[name]["duration"]) for name in self.tasks)
+        ))
+
+        return finished
+
+
+def get_update_graph(locations: bool = True, queue: JobQueue = None) -> TaskGraph:
+    """ Return the tasks for a full update.
+
+    Conditions are matched against the sailings that departures creates, so they come after departures. Ferry
+    locations don't depend on either, so they're fetched at the same time.
+
+    If a queue is given, each part of the update is run as the queue's task of the same name, so an update never
+    scrapes a page at the same time as a run of that page asked for on its own.
+
+    :param locations: whether to fetch the ferry locations for every route too
+    :type locations: bool
+    :param queue: the queue to run the parts of the update through
+    :type queue: JobQueue
+    :returns: the tasks for a full update
+    :rtype: TaskGraph
+    """
+
+    def task(name: str, func: Callable) -> Callable:
+        return partial(queue.run, name) if queue else func
+
+    graph = TaskGraph()
+    graph.add("departures", task("departures", get_actual_departures))
+    graph.add("conditions", task("conditions", get_current_conditions), after=["departures"])
+
+    if locations:
+        graph.add("locations", task("locations", get_ferry_locations))
+
+    return graph
+
+
+def get_update_cadence(locations: bool = True) -> TimetableCadence:
+    """ Return the cadence for running full updates.
+
+    Each update makes one request for departures, one for conditions and (if they're included) one for each ferry
+    locations map.
+
+    :param locations: whether the updates fetch the ferry locations for every route
+    :type locations: bool
+    :returns: the cadence for full updates
+    :rtype: TimetableCadence
+    """
+
+    return TimetableCadence(requests=2 + (len(LOCATION_ROUTES) if locations else 0))
+
+
+def poll_locations() -> bool:
+    """ Fetch the ferry locations for the routes that are due, according to the LocationPoller.
+
+    Only as many routes as the request budget has room for are fetched. The rest are still due next time.
+
+    :returns: whether we succeeded or not
+    :rtype: bool
+    """
+
+    route_numbers = get_location_poller().due()
+
+    remaining = get_client().budget.remaining
+    if remaining is not None and len(route_numbers) > remaining:
+        logger.warning("Only fetching {} of the {} routes due, to stay within the request budget".format(
+            remaining, len(route_numbers)
+        ))
+        route_numbers = route_numbers[:remaining]
+
+    if not route_numbers:
+        return True
+
+    return get_ferry_locations(route_numbers=route_numbers)
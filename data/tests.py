@@ -1,3 +1,1471 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Avg, Max, Min, Q
+from django.db.models.signals import post_save
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from threading import Barrier, Event, Thread
+from time import monotonic, sleep
+from unittest import mock, skipUnless
+import json
+import os
+import tempfile
+import pytz
 
-# Create your tests here.
+from . import clock
+from .cadence import TimetableCadence
+from .client import BudgetExceeded, Client, RequestBudget
+from .fetcher import Fetcher
+from .jobqueue import FAILED, FINISHED, JobQueue, QueuedJob
+from .locations import LocationPoller
+from .eventsink import EventSink
+from .models import (Amenity, Destination, EventLog, Ferry, Route, Sailing, SailingEvent, SailingNorm, Status, Terminal,
+                     ArrivalTimeEvent, CancelledEvent, DepartedEvent, DepartureTimeEvent, FerryEvent, HeadingEvent,
+                     InPortEvent, LocationEvent, PercentFullEvent, StatusEvent, UnderWayEvent)
+from .parsers import (available_parsers, location_rows, parse_conditions, parse_departures, parse_later_sailings,
+                      parse_locations, parse_sailing_detail, soup_location_rows)
+from .references import ReferenceCache, get_reference_cache
+from .scheduler import RUN_ONCE, SKIP, Scheduler
+from .serializers import prefetch_ferries, sailings_as_dicts
+from .tasks import TaskGraph, get_update_cadence, get_update_graph, poll_locations
+from .unitofwork import UnitOfWork
+from .utils import apply_conditions, apply_departures, apply_locations
+from api.views import latest_run
+from collector.models import ConditionsRun, DeparturesRun, LocationsRun, Run
+from data.management.commands.backfill import Command as BackfillCommand, service_day
+from data.management.commands.replay import Command as ReplayCommand
+
+
+class RouteTestMixin:
+    """ Set up the Tsawwassen to Swartz Bay route that most of the tests use. """
+
+    # Any other fields to set on the route
+    route_fields = {}
+
+    def setUp(self):
+        super().setUp()
+
+        self.terminal = Terminal.objects.create(name="Tsawwassen", short_name="TSA")
+        self.destination = Destination.objects.create(name="Swartz Bay")
+        self.route = Route.objects.create(
+            name="Tsawwassen to Swartz Bay", source=self.terminal, destination=self.destination, route_code=1,
+            duration=95, **self.route_fields
+        )
+
+
+class SailingNormTestCase(RouteTestMixin, TestCase):
+    """ Check that the norms match the aggregates over the stored sailings, as sailings arrive and are corrected. """
+
+    def setUp(self):
+        super().setUp()
+
+        # The same sailing on three Wednesdays, leaving and arriving a fraction of a minute off the hour
+        start = datetime(2020, 7, 1, 14, 0, tzinfo=pytz.UTC)
+        for weeks, late, percent_full in [(0, 150, 80), (1, 450, None), (2, -90, 100)]:
+            scheduled = start + timedelta(weeks=weeks)
+            Sailing(
+                route=self.route,
+                scheduled_departure=scheduled,
+                actual_departure=scheduled + timedelta(seconds=late),
+                eta_or_arrival_time=scheduled + timedelta(minutes=95, seconds=late * 2),
+                departed=True,
+                arrived=True,
+                percent_full=percent_full
+            ).save()
+
+    def assertNormsMatch(self):
+        sailings = Sailing.objects.filter(arrived=True, duration__isnull=False)
+        norm = SailingNorm.objects.get()
+
+        self.assertEqual(norm.sailings, sailings.count())
+
+        for name, field in SailingNorm.NORMS:
+            expected = sailings.aggregate(average=Avg(field), minimum=Min(field), maximum=Max(field))
+            actual = norm.aggregate(name)
+
+            self.assertAlmostEqual(actual.pop("average"), expected.pop("average"))
+            self.assertEqual(actual, expected)
+
+    def test_arrivals(self):
+        self.assertNormsMatch()
+        self.assertEqual(SailingNorm.objects.get().leaving["maximum"], 7)
+
+    def test_corrections(self):
+        sailing = Sailing.objects.order_by('scheduled_departure').first()
+        sailing.percent_full = 10
+        sailing.late_arriving = -30
+        sailing.save()
+        self.assertNormsMatch()
+
+        # A sailing that no longer counts is taken back out of the norms
+        sailing.arrived = False
+        sailing.save()
+        self.assertNormsMatch()
+
+    def test_rebuild(self):
+        SailingNorm.objects.all().delete()
+        self.assertEqual(SailingNorm.rebuild(), 1)
+        self.assertNormsMatch()
+
+
+@skipUnless(connection.vendor == "sqlite", "query plans are checked against SQLite")
+class SailingIndexTestCase(TestCase):
+    """ Check that the hot-path Sailing queries are planned against the Sailing indexes. """
+
+    def query_plan(self, queryset) -> str:
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN {}".format(sql), params)
+            return "\n".join(row[-1] for row in cursor.fetchall())
+
+    def setUp(self):
+        self.now = datetime.now(pytz.UTC)
+
+    def test_route_and_departure_lookup(self):
+        plan = self.query_plan(
+            Sailing.objects.filter(route_id=1, scheduled_departure=self.now)
+        )
+        self.assertIn("USING INDEX sailing_route_departure_idx", plan)
+
+    def test_route_window(self):
+        plan = self.query_plan(
+            Sailing.objects.filter(route_id=1, scheduled_departure__gt=self.now)
+        )
+        self.assertIn("USING INDEX sailing_route_departure_idx", plan)
+
+    def test_departure_window(self):
+        plan = self.query_plan(
+            Sailing.objects.filter(scheduled_departure__gt=self.now).order_by('scheduled_departure')
+        )
+        self.assertIn("USING INDEX sailing_departure_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_keyset_page(self):
+        plan = self.query_plan(
+            Sailing.objects.filter(
+                Q(scheduled_departure__gt=self.now) | Q(scheduled_departure=self.now, pk__gt=1),
+                scheduled_departure__gte=self.now
+            ).order_by('scheduled_departure', 'pk')[:100]
+        )
+        self.assertIn("USING INDEX sailing_departure_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_arrival_window(self):
+        plan = self.query_plan(
+            Sailing.objects.filter(eta_or_arrival_time__gt=self.now)
+        )
+        self.assertIn("USING INDEX sailing_eta_arrival_idx", plan)
+
+    def test_upcoming_window(self):
+        # The window the sailing views use, which needs both sides of the OR to be indexed
+        window = Q(scheduled_departure__gt=self.now) | Q(eta_or_arrival_time__gt=self.now - timedelta(hours=1))
+
+        plan = self.query_plan(Sailing.objects.filter(window))
+        self.assertIn("MULTI-INDEX OR", plan)
+        self.assertIn("USING INDEX sailing_departure_idx", plan)
+        self.assertIn("USING INDEX sailing_eta_arrival_idx", plan)
+        self.assertNotIn("SCAN", plan)
+
+        plan = self.query_plan(Sailing.objects.filter(window, route_id=1))
+        self.assertIn("USING INDEX sailing_route_departure_idx", plan)
+        self.assertNotIn("SCAN", plan)
+
+    def test_norms_lookup(self):
+        plan = self.query_plan(
+            Sailing.objects.filter(
+                route_id=1,
+                sailing_time="07:00",
+                day_of_week="Monday",
+                arrived=True,
+                duration__isnull=False
+            )
+        )
+        self.assertIn("USING INDEX sailing_norms_idx", plan)
+
+    def test_event_log_lookup(self):
+        plan = self.query_plan(
+            EventLog.objects.filter(entity="sailing", entity_id=1).order_by('timestamp', 'event_id')
+        )
+        self.assertIn("USING INDEX eventlog_entity_idx", plan)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Serve a short page after a delay, or a 404 for /missing. """
+
+    def do_GET(self):
+        sleep(0.1)
+        if self.path == "/missing":
+            self.send_response(404)
+            self.end_headers()
+        else:
+            body = "page {}".format(self.path).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FetcherTestCase(SimpleTestCase):
+    """ Check the Fetcher against a local stub HTTP server. """
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = "http://127.0.0.1:{}".format(self.server.server_port)
+        self.client = Client(retries=0, pool_size=8)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetch_all_is_concurrent(self):
+        urls = ["{}/route{}.html".format(self.base, i) for i in range(8)]
+
+        start = monotonic()
+        results = Fetcher(concurrency=8, rate_limit=0, client=self.client).fetch_all(urls)
+        elapsed = monotonic() - start
+
+        self.assertEqual([url for url, response in results], urls)
+        self.assertEqual(
+            [response.text for url, response in results],
+            ["page /route{}.html".format(i) for i in range(8)]
+        )
+        # Eight 100ms requests in parallel should take nowhere near 800ms
+        self.assertLess(elapsed, 0.5)
+
+    def test_fetch_all_is_rate_limited(self):
+        urls = ["{}/route{}.html".format(self.base, i) for i in range(5)]
+
+        start = monotonic()
+        Fetcher(concurrency=5, rate_limit=20, client=self.client).fetch_all(urls)
+        elapsed = monotonic() - start
+
+        # At 20 requests per second, the last request can't start until 200ms in
+        self.assertGreaterEqual(elapsed, 0.2)
+
+    def test_fetch_all_returns_errors(self):
+        results = dict(Fetcher(concurrency=2, rate_limit=0, client=self.client).fetch_all([
+            "{}/missing".format(self.base),
+            "http://127.0.0.1:1/unreachable"
+        ]))
+
+        self.assertEqual(results["{}/missing".format(self.base)].status_code, 404)
+        self.assertIsInstance(results["http://127.0.0.1:1/unreachable"], Exception)
+
+    def test_client_counts_requests_per_host(self):
+        self.client.get("{}/route0.html".format(self.base))
+        self.client.get("{}/missing".format(self.base))
+
+        stats = self.client.host_stats["127.0.0.1:{}".format(self.server.server_port)]
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["bytes"], len("page /route0.html"))
+
+    def test_client_request_budget(self):
+        clock = FakeClock()
+        client = Client(retries=0, budget=RequestBudget(2, clock=clock))
+        url = "{}/route0.html".format(self.base)
+
+        client.get(url)
+        clock.time = 1800
+        client.get(url)
+
+        with self.assertRaises(BudgetExceeded):
+            client.get(url)
+
+        # Refused requests aren't made, and fetches report them like any other error
+        results = Fetcher(concurrency=2, rate_limit=0, client=client).fetch_all([url])
+        self.assertIsInstance(results[0][1], BudgetExceeded)
+        self.assertEqual(client.host_stats["127.0.0.1:{}".format(self.server.server_port)]["requests"], 2)
+        self.assertEqual(client.budget.as_dict, {"budget": 2, "remaining": 0, "refused": 2})
+
+        # The first request frees up its slot an hour after it was made
+        clock.time = 3600
+        self.assertEqual(client.budget.remaining, 1)
+        self.assertEqual(client.get(url).text, "page /route0.html")
+
+    def test_worker_reports_host_stats(self):
+        import worker
+
+        with mock.patch("worker.get_client", return_value=self.client):
+            self.client.get("{}/route0.html".format(self.base))
+            status = worker.app.test_client().get("/status").get_json()
+
+        self.assertEqual(status["hosts"]["127.0.0.1:{}".format(self.server.server_port)]["requests"], 1)
+
+
+class LocationRowsTestCase(SimpleTestCase):
+    """ Check the regex extraction of route location pages against BeautifulSoup. """
+
+    PAGE = (
+        "<html><body><table><tr><th>Vessel</th><th>Status</th></tr>"
+        "<tr><td>Queen of New Westminster</td><td>Under Way</td><td>Swartz Bay</td><td>10:05 AM</td></tr>"
+        "<tr class='odd'><td><b>Spirit of British Columbia</b></td><td>In Port</td><td>Tsawwassen &amp; Back</td><td>9:58 AM</td></tr>"
+        "<tr><td colspan='4'>Last updated</td></tr>"
+        "</table></body></html>"
+    )
+
+    def test_matches_soup(self):
+        self.assertEqual(location_rows(self.PAGE), soup_location_rows(self.PAGE, "html.parser"))
+        self.assertEqual(location_rows(self.PAGE)[1], (
+            "Spirit of British Columbia", "In Port", "Tsawwassen & Back", "9:58 AM"
+        ))
+
+    def test_nested_tables_fall_back(self):
+        page = self.PAGE.replace("<td>9:58 AM</td>", "<td><table><tr><td>9:58 AM</td></tr></table></td>")
+        self.assertEqual(location_rows(page), soup_location_rows(page, "html.parser"))
+
+
+@skipUnless("lxml" in available_parsers(), "lxml isn't installed")
+class ParserParityTestCase(SimpleTestCase):
+    """ Check that the pages parse the same with lxml as with html.parser, stray markup and all. """
+
+    DEPARTURES = (
+        '<html><body><span class="titleSmInv">Wednesday, July 01, 2020</span><table><tr><td class="content"><table>'
+        '<a name="#TSA1"></a><table><tr><td><span>Tsawwassen to Swartz Bay<br/>Sailing time: 1 hour 35 minutes'
+        '</span></td></tr></table><table><tr><th>Vessel</th></tr>'
+        '<tr><td>Spirit of British Columbia</td><td>7:00 AM</td><td>7:04 AM</td><td>8:38 AM</td><td>On Time</td></tr>'
+        '<tr><td>Coastal Renaissance</td><td>9:00 AM</td><td>9:02 AM</td><td>ETA: 10:39 AM</td><td>Delayed</td></tr>'
+        '<tr><td>Queen of Oak Bay</td><td>11:00 AM</td><td></td><td>...</td><td>On Time</td></tr></table>'
+        '<a name="#HSB2"></a><table><tr><td><span>Horseshoe Bay to Departure Bay<br/>Sailing time: 1 hour 40 minutes'
+        '</span></td></tr></table><table><tr><th>Vessel</th></tr>'
+        '<tr><td>Queen of Cowichan</td><td>1:00 PM</td><td></td><td></td><td>Cancelled</td></tr></table>'
+        '</table></td></tr></table></body></html>'
+    )
+
+    CONDITIONS = (
+        '<html><body><table><tbody><tr><td><span>Tsawwassen</span></td></tr></tbody><tbody><tr><td>header</td></tr>'
+        '<tr><td>Tsawwassen to Swartz Bay</td><td><div><table><tr><td>1:00pm</td><td>20% full</td></tr>'
+        '<tr><td>3:00pm</td><td>Cancelled</td></tr></table></div></td><td>1</td><td>0</td>'
+        '<td> 5:00pm 7:00pm *7:00am</td><td>x</td><td>x</td><td><a href="at.asp?route=01&dept=TSA">x</a></td></tr>'
+        '<tr><td>Vehicle space on this route is fully booked</td></tr><tr><td>footer</td></tr></tbody>'
+        '<tbody><tr><td><span>Horseshoe Bay</span></td></tr></tbody><tbody><tr><td>header</td></tr>'
+        '<tr><td>Horseshoe Bay to Departure Bay</td><td><div>N/A</div></td><td>0</td><td>2</td>'
+        '<td> 3:00pm *9:00am</td><td>x</td><td>x</td><td><a href="at.asp?route=02&dept=HSB">x</a></td></tr>'
+        '<tr><td>footer</td></tr></tbody></table></body></html>'
+    )
+
+    SAILING_DETAIL = (
+        '<html><body><font size="3">Tsawwassen to Swartz Bay</font>'
+        '<a href="arrivals-departures.html?dept=TSA&route=01">Departures</a>'
+        '<form><select name="sailing"><option value="sailingDetail.asp?route=01&dept=TSA&time=1300">1:00 PM'
+        '<option value="sailingDetail.asp?route=01&dept=TSA&time=1500">3:00 PM</select></form>'
+        '<table><tr><td><span class="bold">Sailing Details: 1:00 PM Departure</span>'
+        '<td><a href="onboard/spirit-of-british-columbia.html">Spirit of British Columbia</a>'
+        '<a href="onboard/">&nbsp;</a></td></tr>'
+        '<tr><td><a href="parking.html">Parking</a> 45% full</td>'
+        '<td><a href="#" onclick="window.open(&quot;DeckSpace_pop.asp?os=20&uh=35&tm=1300&quot;)">Deck space</a></td>'
+        '</tr></table></body></html>'
+    )
+
+    captured_at = pytz.UTC.localize(datetime(2020, 7, 1, 19, 0))
+
+    def parse(self, parser, *args):
+        with self.settings(BCF_HTML_PARSER="html.parser"):
+            expected = parser(*args)
+
+        with self.settings(BCF_HTML_PARSER="lxml"):
+            self.assertEqual(parser(*args), expected)
+
+        return expected
+
+    def test_departures(self):
+        departures = self.parse(parse_departures, self.DEPARTURES, self.captured_at)
+        self.assertEqual([len(route["sailings"]) for route in departures["routes"]], [3, 1])
+
+    def test_conditions(self):
+        conditions = self.parse(parse_conditions, self.CONDITIONS, self.captured_at)
+        self.assertEqual([route["full"] for route in conditions["routes"]], [True, False])
+
+    def test_sailing_detail(self):
+        self.assertEqual(self.parse(parse_sailing_detail, self.SAILING_DETAIL, self.captured_at), {
+            "route_name": "Tsawwassen to Swartz Bay",
+            "terminal_code": "TSA",
+            "sailing_details": "Sailing Details: 1:00 PM Departure",
+            "scheduled_departure": pytz.timezone("America/Vancouver").localize(datetime(2020, 7, 1, 13, 0)),
+            "cancelled": False,
+            "ferry": "Spirit of British Columbia",
+            "car_percent_full": None,
+            "oversize_percent_full": None,
+            "parking": 45,
+            "other_sailings": [
+                "sailingDetail.asp?route=01&dept=TSA&time=1300", "sailingDetail.asp?route=01&dept=TSA&time=1500"
+            ]
+        })
+
+        # The deck space is only picked up from the page source as it's sent
+        deck_space = self.parse(
+            parse_sailing_detail, self.SAILING_DETAIL.replace("&quot;", '"'), self.captured_at
+        )
+        self.assertEqual((deck_space["car_percent_full"], deck_space["oversize_percent_full"]), (35, 20))
+
+        # Pages for sailings which have been cancelled, or when there are no more sailings, have less on them
+        cancelled = self.parse(
+            parse_sailing_detail, self.SAILING_DETAIL.replace("Departure<", "Departure CANCELLED<"), self.captured_at
+        )
+        self.assertEqual((cancelled["cancelled"], cancelled["ferry"]), (True, None))
+
+        finished = self.parse(parse_sailing_detail, self.SAILING_DETAIL.replace(
+            "Sailing Details: 1:00 PM Departure", "No more scheduled sailings for today"
+        ), self.captured_at)
+        self.assertEqual((finished["sailing_details"], finished["other_sailings"], finished["parking"]), (None, [], 45))
+
+    def test_locations(self):
+        self.assertEqual(soup_location_rows(LocationRowsTestCase.PAGE, "lxml"), location_rows(LocationRowsTestCase.PAGE))
+
+
+class ParserTestCase(SimpleTestCase):
+    """ Check that pages are parsed as of the time they were captured. """
+
+    tz = pytz.timezone("America/Vancouver")
+
+    def test_locations_from_yesterday(self):
+        ferries = parse_locations(LocationRowsTestCase.PAGE, self.tz.localize(datetime(2020, 7, 2, 10, 0)))
+        self.assertEqual(ferries[1]["updated"], self.tz.localize(datetime(2020, 7, 2, 9, 58)))
+
+        # A time after the page was captured must have been yesterday
+        self.assertEqual(ferries[0]["updated"], self.tz.localize(datetime(2020, 7, 1, 10, 5)))
+
+    def test_sailing_detail_day(self):
+        # The sailing is on the local day the page was captured, whatever the time is now
+        captured_at = pytz.UTC.localize(datetime(2020, 7, 2, 6, 30))
+        detail = parse_sailing_detail(ParserParityTestCase.SAILING_DETAIL, captured_at)
+        self.assertEqual(detail["scheduled_departure"], self.tz.localize(datetime(2020, 7, 1, 13, 0)))
+
+    def test_later_sailings(self):
+        today = self.tz.localize(datetime(2020, 7, 1, 12, 0))
+
+        sailings = parse_later_sailings(["5:40pm", "*9:05pm-Cancelled", "*9:55am"], today, today + timedelta(days=1))
+
+        # The last sailing is earlier than the one before it, so it's the day after tomorrow
+        self.assertEqual(sailings, [
+            self.tz.localize(datetime(2020, 7, 1, 17, 40)),
+            self.tz.localize(datetime(2020, 7, 2, 21, 5)),
+            self.tz.localize(datetime(2020, 7, 3, 9, 55)),
+        ])
+
+
+class UnitOfWorkTestCase(TestCase):
+    """ Check that a UnitOfWork writes in batches, records its writes, and rolls back on failure. """
+
+    def setUp(self):
+        self.run = DeparturesRun()
+        self.run.set_status("Data parsed")
+
+    def test_records_writes(self):
+        with UnitOfWork(self.run, batch_size=2) as uow:
+            ferries = [Ferry.objects.create(name="Ferry {}".format(i)) for i in range(3)]
+            for ferry in ferries:
+                ferry.status = "In Port"
+                uow.update(ferry, 'status')
+
+        self.assertEqual(Ferry.objects.filter(status="In Port").count(), 3)
+        # Three inserts, then the updates in a batch of two and a batch of one
+        self.assertEqual(self.run.writes, 6)
+        self.assertIsNotNone(self.run.commit_time)
+
+    def test_rolls_back(self):
+        with self.assertRaises(ValueError):
+            with UnitOfWork(self.run):
+                Ferry.objects.create(name="Queen of Nowhere")
+                raise ValueError()
+
+        self.assertFalse(Ferry.objects.exists())
+        self.assertEqual(self.run.status, "Failed while writing changes")
+
+
+class EventSinkTestCase(TestCase):
+    """ Check that an EventSink inserts polymorphic events in bulk. """
+
+    def test_flush(self):
+        ferry = Ferry.objects.create(name="Queen of Nowhere")
+        InPortEvent(ferry=ferry).save()
+
+        sink = EventSink()
+        sink.add([
+            HeadingEvent(ferry=ferry, old_value="N", new_value="S"),
+            InPortEvent(ferry=ferry),
+            HeadingEvent(ferry=ferry, old_value="S", new_value="E")
+        ])
+
+        with self.assertNumQueries(5):
+            # One insert for each of the three tables, one to get the new IDs back, and one for the event log
+            self.assertEqual(sink.flush(), 3)
+
+        events = list(LocationEvent.objects.order_by('pk'))
+        self.assertEqual([type(event) for event in events], [InPortEvent, HeadingEvent, InPortEvent, HeadingEvent])
+        self.assertEqual(events[3].new_value, "E")
+        self.assertIsNotNone(events[1].timestamp)
+        self.assertEqual(
+            list(EventLog.objects.order_by('event_id').values_list('event_type', 'new_value')),
+            [("InPortEvent", None), ("HeadingEvent", "S"), ("InPortEvent", None), ("HeadingEvent", "E")]
+        )
+
+        # Later saves carry on after the inserted IDs
+        event = InPortEvent(ferry=ferry)
+        event.save()
+        self.assertEqual(event.pk, events[3].pk + 1)
+
+    def test_other_databases(self):
+        ferry = Ferry.objects.create(name="Queen of Nowhere")
+
+        sink = EventSink()
+        sink.add([HeadingEvent(ferry=ferry, old_value="N", new_value="S"), InPortEvent(ferry=ferry)])
+
+        # Without a way to get the IDs from a bulk insert, the base rows are inserted on their own, but not saved
+        with mock.patch.object(connection, 'vendor', 'other'), mock.patch.object(LocationEvent, 'save') as save:
+            with self.assertLogs('data.eventsink', 'WARNING'):
+                self.assertEqual(sink.flush(), 2)
+
+        save.assert_not_called()
+        self.assertEqual(
+            [(type(event), event.pk) for event in LocationEvent.objects.order_by('pk')],
+            [(HeadingEvent, event.event_id) for event in EventLog.objects.filter(event_type="HeadingEvent")] +
+            [(InPortEvent, event.event_id) for event in EventLog.objects.filter(event_type="InPortEvent")]
+        )
+
+
+class EventLogCommandTestCase(TestCase):
+    """ Check that the eventlog command fills the event log from the stored events. """
+
+    def test_if_empty(self):
+        ferry = Ferry.objects.create(name="Queen of Nowhere")
+        HeadingEvent(ferry=ferry, old_value="N", new_value="S").save()
+        EventLog.objects.all().delete()
+
+        out = StringIO()
+        call_command('eventlog', '--if-empty', stdout=out)
+        self.assertIn("Logged 1 events", out.getvalue())
+        self.assertEqual(list(EventLog.objects.values_list('event_type', 'new_value')), [("HeadingEvent", "S")])
+
+        out = StringIO()
+        call_command('eventlog', '--if-empty', stdout=out)
+        self.assertIn("already been built", out.getvalue())
+        self.assertEqual(EventLog.objects.count(), 1)
+
+    def test_rebuild(self):
+        ferry = Ferry.objects.create(name="Queen of Nowhere")
+        HeadingEvent(ferry=ferry, old_value="N", new_value="S").save()
+        InPortEvent(ferry=ferry).save()
+        HeadingEvent(ferry=ferry, old_value="S", new_value="E").save()
+        logged = list(EventLog.objects.order_by('event_id').values_list('event_type', 'event_id', 'new_value'))
+
+        # Every event is logged once, whatever the size of the batches
+        self.assertEqual(EventLog.rebuild(batch_size=1), 3)
+        self.assertEqual(list(EventLog.objects.order_by('event_id').values_list('event_type', 'event_id', 'new_value')),
+                         logged)
+
+    def test_senders(self):
+        # Only saving an event logs it
+        self.assertTrue(all(post_save.has_listeners(model) for model, entity, field in EventLog.event_models()))
+        self.assertFalse(post_save.has_listeners(Ferry))
+
+        Ferry.objects.create(name="Queen of Nowhere")
+        self.assertEqual(EventLog.objects.count(), 0)
+
+
+class ReferenceCacheTestCase(TestCase):
+    """ Check the reference data lookups against the database. """
+
+    def setUp(self):
+        self.cache = ReferenceCache(ttl=3600)
+
+    def test_lookups_are_cached_between_runs(self):
+        references = self.cache.session()
+        ferry, created = references.get_or_create(Ferry, name="Queen of Nowhere")
+        self.assertTrue(created)
+        self.assertIs(references.get(Ferry, name="Queen of Nowhere"), ferry)
+
+        ferry.status = "In Port"
+        ferry.save()
+        references.publish()
+
+        with self.assertNumQueries(1):
+            # Only the fields that runs update are read from the database
+            ferry = self.cache.session().get(Ferry, name="Queen of Nowhere")
+        self.assertEqual(ferry.status, "In Port")
+
+    def test_mutable_fields_are_read_fresh(self):
+        Ferry.objects.create(name="Queen of Nowhere", status="In Port", heading="N")
+        Status.objects.create(status="On Time")
+
+        references = self.cache.session()
+        stale = references.get(Ferry, name="Queen of Nowhere")
+        with self.assertNumQueries(0):
+            references.get(Status, status="On Time")
+
+        # Another process moves the ferry, and then this run finishes
+        Ferry.objects.filter(name="Queen of Nowhere").update(status="Under Way", heading="S")
+        references.publish()
+
+        ferry = self.cache.session().get(Ferry, name="Queen of Nowhere")
+        self.assertEqual(stale.heading, "N")
+        self.assertEqual((ferry.status, ferry.heading), ("Under Way", "S"))
+
+    def test_misses_reload_the_cache(self):
+        self.cache.load()
+        Ferry.objects.create(name="Spirit of Somewhere")
+
+        self.assertEqual(self.cache.session().get(Ferry, name="Spirit of Somewhere").name, "Spirit of Somewhere")
+        with self.assertRaises(Ferry.DoesNotExist):
+            self.cache.session().get(Ferry, name="Queen of Nowhere")
+
+    def test_startswith(self):
+        Destination.objects.create(name="Swartz Bay")
+        Destination.objects.create(name="Swartz Bay (Victoria)")
+
+        references = self.cache.session()
+        self.assertEqual(references.get(Destination, name__startswith="Swartz Bay (").name, "Swartz Bay (Victoria)")
+        with self.assertRaises(Destination.MultipleObjectsReturned):
+            references.get(Destination, name__startswith="Swartz")
+
+
+class FakeClock:
+    """ A clock that only moves when it's told to. """
+
+    def __init__(self):
+        self.time = 0
+
+    def monotonic(self):
+        return self.time
+
+    def now(self):
+        return datetime.fromtimestamp(self.time, pytz.UTC)
+
+    def wait(self, event, timeout):
+        if event.is_set():
+            return True
+
+        self.time += timeout
+        return False
+
+
+class SchedulerTestCase(SimpleTestCase):
+    """ Check that jobs are run on their own cadence. """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.runs = []
+        self.scheduler = Scheduler(clock=self.clock, runner=lambda func: func(), seed=1)
+
+    def job(self, duration=0):
+        def run():
+            self.runs.append(self.clock.time)
+            self.clock.time += duration
+        return run
+
+    def at(self, time):
+        self.clock.time = time
+        return self.scheduler.run_pending()
+
+    def test_slow_runs_keep_the_cadence(self):
+        self.scheduler.add("departures", self.job(duration=4), interval=10)
+
+        for time in [0, 5, 10, 19, 20]:
+            self.at(time)
+
+        self.assertEqual(self.runs, [0, 10, 20])
+
+    def test_missed_runs_are_skipped(self):
+        job = self.scheduler.add("departures", self.job(duration=35), interval=10, missed=SKIP)
+
+        self.at(0)
+        self.at(35)
+        self.assertEqual(job.missed_runs, 3)
+        self.assertEqual(self.scheduler.next_due(), 5)
+
+        self.at(40)
+        self.assertEqual(self.runs, [0, 40])
+
+    def test_missed_runs_are_run_once(self):
+        job = self.scheduler.add("departures", self.job(duration=35), interval=10, missed=RUN_ONCE)
+
+        self.at(0)
+        self.at(35)
+        self.assertEqual(job.missed_runs, 2)
+        self.assertEqual(self.runs, [0, 35])
+
+        # The run at 35 overran too, missing the slots at 40, 50 and 60
+        self.at(70)
+        self.assertEqual(self.runs, [0, 35, 70])
+        self.assertEqual(job.missed_runs, 5)
+
+    def test_no_overlap(self):
+        started = []
+        scheduler = Scheduler(clock=self.clock, runner=started.append)
+        job = scheduler.add("departures", self.job(), interval=10)
+
+        self.clock.time = 0
+        scheduler.run_pending()
+        self.clock.time = 10
+        scheduler.run_pending()
+        self.assertEqual(len(started), 1)
+        self.assertEqual(job.missed_runs, 1)
+
+        # Once the first run has finished, the next slot runs as usual
+        started[0]()
+        self.clock.time = 20
+        scheduler.run_pending()
+        self.assertEqual(len(started), 2)
+
+    def test_jitter(self):
+        job = self.scheduler.add("departures", self.job(), interval=10, jitter=5)
+
+        for slot in [0, 10, 20, 30]:
+            self.at(job.due)
+            self.assertGreaterEqual(job.due, slot + 10)
+            self.assertLess(job.due, slot + 15)
+
+    def test_cadence(self):
+        intervals = iter([10, 30, 20])
+        self.scheduler.add("departures", self.job(), interval=10, cadence=lambda: next(intervals))
+
+        for time in range(0, 70, 5):
+            self.at(time)
+
+        self.assertEqual(self.runs, [0, 10, 40, 60])
+
+    def test_run_wakes_when_jobs_are_due(self):
+        self.scheduler.add("departures", self.job(), interval=600)
+        self.scheduler.add("sailing_detail", self.job(), interval=3600, delay=1500)
+        self.scheduler.add("stop", self.scheduler.stop, interval=3600, delay=2000)
+
+        self.scheduler.run()
+
+        self.assertEqual(self.runs, [0, 600, 1200, 1500, 1800])
+
+
+class TaskGraphTestCase(SimpleTestCase):
+    """ Check that tasks run in order, and in parallel where they can. """
+
+    def test_independent_tasks_run_together(self):
+        # Both tasks have to be running at once to get past the barrier
+        barrier = Barrier(2, timeout=5)
+        order = []
+
+        graph = TaskGraph()
+        graph.add("departures", lambda: order.append("departures") or barrier.wait())
+        graph.add("conditions", lambda: order.append("conditions"), after=["departures"])
+        graph.add("locations", lambda: order.append("locations") or barrier.wait())
+
+        results = graph.run()
+
+        self.assertEqual(set(results), {"departures", "conditions", "locations"})
+        self.assertTrue(all(result["error"] is None for result in results.values()))
+        self.assertEqual(order[-1], "conditions")
+
+    def test_failures_dont_stop_later_tasks(self):
+        def fail():
+            raise ValueError("Page not found")
+
+        graph = TaskGraph()
+        graph.add("departures", fail)
+        graph.add("conditions", lambda: True, after=["departures"])
+
+        results = graph.run()
+
+        self.assertEqual(results["departures"]["error"], "Page not found")
+        self.assertTrue(results["conditions"]["result"])
+
+    def test_dependencies_must_exist(self):
+        graph = TaskGraph()
+
+        with self.assertRaises(ValueError):
+            graph.add("conditions", lambda: True, after=["departures"])
+
+
+class TimetableCadenceTestCase(RouteTestMixin, TestCase):
+    """ Check that updates are polled for more often around departures and arrivals. """
+
+    def setUp(self):
+        super().setUp()
+
+        self.now = datetime(2020, 7, 1, 12, 0, tzinfo=pytz.UTC)
+        self.clock = FakeClock()
+        self.client = Client(budget=RequestBudget(120, clock=self.clock))
+        self.cadence = TimetableCadence(requests=10, client=self.client, cadence={
+            "active": 120, "underway": 600, "idle": 1800, "boarding": 45, "departing": 10, "arriving": 15
+        })
+
+    def sailing(self, minutes):
+        Sailing.objects.bulk_create([
+            Sailing(route=self.route, scheduled_departure=self.now + timedelta(minutes=minutes))
+        ])
+
+    def test_idle(self):
+        self.assertEqual(self.cadence.interval(self.now), 1800)
+
+    def test_boarding(self):
+        self.sailing(30)
+        self.assertEqual(self.cadence.interval(self.now), 120)
+
+    def test_arriving(self):
+        self.sailing(-100)
+        self.assertEqual(self.cadence.interval(self.now), 120)
+
+    def test_underway(self):
+        self.sailing(-30)
+        self.assertEqual(self.cadence.interval(self.now), 600)
+
+    def test_wakes_up_for_the_next_departure(self):
+        self.sailing(65)
+        self.assertEqual(self.cadence.interval(self.now), 1200)
+
+    def test_request_budget(self):
+        self.sailing(30)
+
+        # Other jobs have used all but 5 of the budget over the last hour
+        for time in range(0, 1150, 10):
+            self.clock.time = time
+            self.client.budget.take()
+
+        # The update needs 10 requests, so it waits until the 5th oldest frees up
+        self.assertEqual(self.cadence.interval(self.now), 3640 - self.clock.time)
+
+    def test_worker_stays_within_the_budget(self):
+        """ Run the worker's schedule for a few busy hours, with every job fetching through the same client. """
+
+        self.sailing(30)
+        routes = 25
+        ferries = 35
+
+        def simulate(budget):
+            clock = FakeClock()
+            client = Client(budget=RequestBudget(budget, clock=clock))
+            poller = LocationPoller(config=settings.BCF_LOCATION_POLLING, clock=clock)
+            requests = {}
+
+            def get(name, count):
+                for _ in range(count):
+                    try:
+                        client.get("https://www.bcferries.com/")
+                    except BudgetExceeded:
+                        continue
+                    requests.setdefault(name, []).append(clock.time)
+
+            def get_ferry_locations(route_numbers):
+                for route_number in route_numbers:
+                    get("poll_locations", 1)
+                    # Every page has changed, so the routes are fetched as often as they can be
+                    poller.record(route_number, changed=True)
+                return True
+
+            jobs = {
+                "update": lambda: get("update", 2),
+                "poll_locations": poll_locations,
+                "sailing_detail": lambda: get("sailing_detail", routes),
+                "ferry_details": lambda: get("ferry_details", ferries + 1),
+            }
+
+            with mock.patch("data.cadence.get_client", return_value=client):
+                # The update cadence is the one the worker uses, so it backs off when the other jobs use up the budget
+                cadence = get_update_cadence(locations=False)
+
+            scheduler = Scheduler(clock=clock, runner=lambda func: func(), seed=1)
+            for name, options in settings.BCF_SCHEDULE.items():
+                scheduler.add(name, jobs[name], cadence=(lambda: cadence.interval(self.now)) if name == "update" else None,
+                              **options)
+
+            with mock.patch("data.tasks.get_client", return_value=client), \
+                    mock.patch("data.tasks.get_location_poller", return_value=poller), \
+                    mock.patch("data.tasks.get_ferry_locations", side_effect=get_ferry_locations), \
+                    mock.patch.object(client.session, "get", return_value=mock.Mock(raw=None, content=b"", status_code=200)):
+                while clock.time < 4 * 3600:
+                    scheduler.run_pending()
+                    clock.time += max(scheduler.next_due(), 1)
+
+            return requests
+
+        for budget in [settings.BCF_REQUEST_BUDGET, 200]:
+            requests = simulate(budget)
+            times = sorted(time for name_times in requests.values() for time in name_times)
+
+            # No hour has more requests than the budget, counting every job
+            for time in times:
+                self.assertLessEqual(len([other for other in times if time <= other < time + 3600]), budget)
+
+            # Every job still gets to fetch something, and updates are never more often than the active interval
+            self.assertEqual(set(requests), set(settings.BCF_SCHEDULE))
+            self.assertLessEqual(len(requests["update"]), 2 * (4 * 3600 / 120 + 1))
+
+        # The tighter budget holds the updates back
+        self.assertLess(len(requests["update"]), len(simulate(settings.BCF_REQUEST_BUDGET)["update"]))
+
+
+class LocationPollerTestCase(SimpleTestCase):
+    """ Check that ferry locations are fetched per route, backing off while they're unchanged. """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.poller = LocationPoller(routes=['1', '2'], clock=self.clock, config={
+            "interval": 120, "backoff": 2, "max_interval": 400, "routes": {"2": {"interval": 60}}
+        })
+
+    def fetch(self, time, **changed):
+        self.clock.time = time
+        due = self.poller.due()
+        for route_number in due:
+            self.poller.record(route_number, changed=changed.get(route_number, False))
+        return due
+
+    def test_backoff(self):
+        self.assertEqual(self.fetch(0), ['1', '2'])
+        self.assertEqual(self.fetch(60), [])
+        self.assertEqual(self.fetch(120), ['2'])
+        self.assertEqual(self.fetch(240), ['1'])
+
+        # Route 1 backs off to its maximum, while route 2 drops back to its own interval when it changes
+        self.assertEqual(self.fetch(360, **{"2": True}), ['2'])
+        self.assertEqual(self.poller.routes['1'].interval, 400)
+        self.assertEqual(self.poller.routes['2'].interval, 60)
+        self.assertEqual(self.fetch(420), ['2'])
+
+    def test_errors_retry_at_the_same_interval(self):
+        self.fetch(0)
+        self.clock.time = 240
+        self.poller.record('1', changed=False, error=True)
+
+        self.assertEqual(self.poller.routes['1'].interval, 240)
+        self.assertEqual(self.poller.routes['1'].due, 480)
+
+    def test_stats(self):
+        self.fetch(0, **{"2": True})
+        self.fetch(1800)
+        self.fetch(3600, **{"2": True})
+
+        stats = self.poller.as_dict['2']
+        self.assertEqual(stats["fetches"], 3)
+        self.assertEqual(stats["changes"], 2)
+        self.assertEqual(stats["fetches_per_hour"], 3)
+        self.assertEqual(stats["change_rate"], 2 / 3)
+        self.assertEqual(stats["last_changed"], 0)
+
+
+class JobQueueTestCase(SimpleTestCase):
+    """ Check that queued tasks are deduplicated and never run twice at once. """
+
+    def setUp(self):
+        self.release = Event()
+        self.runs = []
+
+        def departures():
+            self.runs.append("departures")
+            self.release.wait(5)
+            return True
+
+        def conditions():
+            raise ValueError("Page not found")
+
+        self.queue = JobQueue({"departures": departures, "conditions": conditions})
+
+    def tearDown(self):
+        self.release.set()
+        self.queue.shutdown()
+
+    def test_duplicates_are_queued_once(self):
+        running = self.queue.submit("departures")
+        queued = self.queue.submit("departures")
+
+        # Asking again while one run is queued just returns the queued run
+        self.assertNotEqual(running.id, queued.id)
+        self.assertEqual(self.queue.submit("departures").id, queued.id)
+        self.assertEqual(self.queue.as_dict["queue_depth"], 1)
+
+        self.release.set()
+        self.assertTrue(queued.wait(5))
+
+        self.assertEqual(self.runs, ["departures", "departures"])
+        self.assertEqual(self.queue.get(running.id).status, FINISHED)
+        self.assertEqual(self.queue.get(queued.id).as_dict["result"], True)
+        self.assertEqual(self.queue.as_dict["queue_depth"], 0)
+
+    def test_failures(self):
+        job = self.queue.submit("conditions")
+        self.assertTrue(job.wait(5))
+
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.error, "Page not found")
+        self.assertEqual(self.queue.as_dict["tasks"]["conditions"]["last_run"]["id"], job.id)
+
+    def test_unknown_task(self):
+        with self.assertRaises(KeyError):
+            self.queue.submit("ferries")
+
+    def test_updates_share_runs_with_their_parts(self):
+        self.queue.tasks["update"] = lambda: get_update_graph(locations=False, queue=self.queue).run()
+
+        running = self.queue.submit("departures")
+        update = self.queue.submit("update")
+
+        # The update waits behind the departures run already going, and queues the next one
+        for _ in range(50):
+            if self.queue.as_dict["queue_depth"]:
+                break
+            sleep(0.01)
+        queued = self.queue.submit("departures")
+        self.assertNotEqual(queued.id, running.id)
+
+        self.release.set()
+        self.assertTrue(update.wait(5))
+
+        # Asking for departures while the update's was queued didn't scrape them a third time
+        self.assertEqual(self.runs, ["departures", "departures"])
+        self.assertEqual(update.result["departures"]["result"], True)
+        self.assertEqual(update.result["conditions"]["error"], "Task conditions failed: Page not found")
+
+    def test_worker_polls_locations_by_route(self):
+        import worker
+
+        self.assertNotIn("locations", worker.queue.tasks)
+
+        clock = FakeClock()
+        poller = LocationPoller(routes=['1', '2'], clock=clock, config=settings.BCF_LOCATION_POLLING)
+        poller.record('1', changed=False)
+        poller.record('2', changed=False)
+        self.assertEqual(poller.due(), [])
+
+        with mock.patch("worker.get_location_poller", return_value=poller), \
+                mock.patch.object(worker.queue, "submit", return_value=QueuedJob("poll_locations")) as submit:
+            worker.app.test_client().post("/locations")
+
+        submit.assert_called_once_with("poll_locations")
+        self.assertEqual(poller.due(), ['1', '2'])
+
+
+class ReplayTestCase(SimpleTestCase):
+    """ Check that replayed pages are grouped into collector runs. """
+
+    def test_pages(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ["1-departures.html", "2-conditions.html", "3-route0.html", "3-route2.html", "4-route0.html",
+                         "5-departures.html", "notes.txt"]:
+                open(os.path.join(directory, name), 'w').close()
+
+            pages = [
+                (kind, sorted(os.path.basename(path) for path in source.values()) if kind == "locations"
+                 else os.path.basename(source))
+                for kind, source in ReplayCommand().pages(directory)
+            ]
+
+        self.assertEqual(pages, [
+            ("departures", "1-departures.html"),
+            ("conditions", "2-conditions.html"),
+            ("locations", ["3-route0.html", "3-route2.html"]),
+            ("locations", ["4-route0.html"]),
+            ("departures", "5-departures.html"),
+        ])
+
+
+class ReplayCommandTestCase(TestCase):
+    """ Check the counts the replay command reports for a directory of pages. """
+
+    def setUp(self):
+        get_reference_cache().invalidate()
+        # One of the ferries on the locations page is doing a round trip
+        Destination.objects.create(name="Tsawwassen & Back")
+
+    def test_replay(self):
+        # The conditions page has the 1pm and 3pm Tsawwassen sailings on it, so make sure the departures do too
+        departures = ParserParityTestCase.DEPARTURES.replace(
+            '</table><a name="#HSB2">',
+            '<tr><td>Queen of Oak Bay</td><td>1:00 PM</td><td></td><td>...</td><td>On Time</td></tr>'
+            '<tr><td>Queen of Oak Bay</td><td>3:00 PM</td><td></td><td></td><td>Cancelled</td></tr>'
+            '</table><a name="#HSB2">'
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            for name, data in [("1-departures.html", departures),
+                               ("2-conditions.html", ParserParityTestCase.CONDITIONS),
+                               ("3-route1.html", LocationRowsTestCase.PAGE),
+                               ("3-route2.html", LocationRowsTestCase.PAGE),
+                               ("4-departures.html", departures.replace("<td>7:04 AM</td>", ""))]:
+                with open(os.path.join(directory, name), 'w') as fp:
+                    fp.write(data)
+
+            # Replay against the test database rather than a scratch one
+            out = StringIO()
+            with mock.patch.object(connection.creation, "create_test_db"), \
+                    mock.patch.object(connection.creation, "destroy_test_db"), \
+                    mock.patch("django.utils.timezone.now", return_value=ParserParityTestCase.captured_at):
+                call_command('replay', '--directory', directory, '--json', '--no-memory', stdout=out)
+
+        results = json.loads(out.getvalue())
+
+        self.assertEqual(
+            {kind: (result["pages"], result["runs"], result["failures"]) for kind, result in results.items()},
+            {"departures": (2, 2, 1), "conditions": (1, 1, 0), "locations": (2, 1, 0)}
+        )
+        self.assertGreater(results["departures"]["queries"], 0)
+        self.assertGreaterEqual(results["departures"]["write_seconds"], 0)
+
+
+class BackfillTestCase(TestCase):
+    """ Check that archived pages are processed as of when they were captured, and partitioned by service day. """
+
+    def test_captured_at(self):
+        captured = datetime(2020, 7, 1, 19, 30, tzinfo=pytz.utc)
+        ferry = Ferry.objects.create(name="Queen of Nowhere")
+
+        with clock.captured_at(captured):
+            self.assertEqual(clock.now(), captured)
+            sink = EventSink()
+            sink.add([InPortEvent(ferry=ferry)])
+            sink.flush()
+
+        self.assertNotEqual(clock.now(), captured)
+        self.assertEqual(LocationEvent.objects.get().timestamp, captured)
+        self.assertEqual(EventLog.objects.get().timestamp, captured)
+
+    def test_partition(self):
+        tz = pytz.timezone("America/Vancouver")
+        pages = [
+            (1, "departures", 1, tz.localize(datetime(2020, 7, 1, 23, 50))),
+            (2, "locations", 2, tz.localize(datetime(2020, 7, 1, 23, 55))),
+            (3, "conditions", 3, tz.localize(datetime(2020, 7, 2, 1, 0))),
+            (4, "departures", 4, tz.localize(datetime(2020, 7, 2, 5, 0))),
+            (5, "departures", 5, tz.localize(datetime(2020, 7, 2, 6, 0))),
+        ]
+
+        with self.settings(DISPLAY_TIME_ZONE="America/Vancouver"):
+            # Sailings just after midnight still belong to the previous day
+            self.assertEqual(service_day(pages[2][3]).isoformat(), "2020-07-01")
+
+            # Conditions carry the route waits over from one page to the next, so they're kept in order, after the
+            # departures have created the sailings they update
+            self.assertEqual(BackfillCommand().partition(pages + [
+                (6, "conditions", 6, tz.localize(datetime(2020, 7, 2, 6, 5)))
+            ]), [
+                [
+                    ("2020-07-02", [(4, "departures"), (5, "departures")]),
+                    ("2020-07-01", [(1, "departures")]),
+                    ("locations", [(2, "locations")])
+                ],
+                [
+                    ("conditions", [(3, "conditions"), (6, "conditions")])
+                ]
+            ])
+
+    def test_runs_are_stamped_with_the_capture_time(self):
+        captured = datetime(2020, 7, 1, 19, 30, tzinfo=pytz.utc)
+        live = DeparturesRun()
+        live.set_status("Completed", successful=True)
+
+        with clock.captured_at(captured):
+            run = DeparturesRun()
+            run.set_status("Completed", successful=True)
+
+        # Runs for pages processed again don't look like the latest live run
+        self.assertEqual(Run.objects.get(pk=run.pk).timestamp, captured)
+        self.assertEqual(latest_run(mock.Mock(spec=[])), Run.objects.get(pk=live.pk).timestamp)
+
+
+class SailingSerializerTestCase(RouteTestMixin, TestCase):
+    """ Check that sailings_as_dicts matches Sailing.as_dict, in a fixed number of queries. """
+
+    def setUp(self):
+        super().setUp()
+        self.status = Status.objects.create(status="On Time")
+
+        amenity = Amenity.objects.create(name="Coastal Cafe")
+        self.ferries = []
+        for name, status in [("Queen of Nowhere", "Under Way"), ("Spirit of Somewhere", "In Port")]:
+            ferry = Ferry.objects.create(name=name, status=status, destination=self.destination, heading="NW")
+            ferry.amenities.add(amenity)
+            self.ferries.append(ferry)
+
+        self.start = datetime.now(pytz.UTC).replace(minute=0, second=0, microsecond=0)
+        self.days = 0
+
+    def add_sailings(self, days: int) -> None:
+        """ Add a week-old arrived sailing, and a departed and an upcoming sailing, for each of a number of days. """
+
+        for day in range(self.days, self.days + days):
+            scheduled = self.start + timedelta(days=day)
+
+            # An arrived sailing from the week before, so the later sailings have norms
+            Sailing(
+                route=self.route, scheduled_departure=scheduled - timedelta(weeks=1), status=self.status,
+                actual_departure=scheduled - timedelta(weeks=1, minutes=-5),
+                eta_or_arrival_time=scheduled - timedelta(weeks=1, minutes=-100),
+                departed=True, arrived=True, percent_full=90
+            ).save()
+
+            departed = Sailing.objects.create(
+                route=self.route, ferry=self.ferries[0], scheduled_departure=scheduled, status=self.status,
+                actual_departure=scheduled + timedelta(minutes=2), eta_or_arrival_time=scheduled + timedelta(minutes=97),
+                departed=True, percent_full=40
+            )
+            PercentFullEvent.objects.create(sailing=departed, old_value=None, new_value=40)
+            FerryEvent.objects.create(sailing=departed, old_ferry=None, new_ferry=self.ferries[0])
+
+            upcoming = Sailing.objects.create(
+                route=self.route, ferry=self.ferries[1], scheduled_departure=scheduled + timedelta(hours=2)
+            )
+            PercentFullEvent.objects.create(sailing=upcoming, old_value=10, new_value=25)
+
+        self.days += days
+
+    def test_matches_as_dict(self):
+        self.add_sailings(3)
+        sailings = Sailing.objects.order_by('pk')
+
+        dicts = sailings_as_dicts(sailings)
+        self.assertEqual(dicts, [sailing.as_dict for sailing in sailings])
+
+        # Make sure there was something to prefetch
+        departed = dicts[1]
+        self.assertEqual(departed["aggregates"]["percent_full"]["average"], 90)
+        self.assertIn("current_sailing", departed["ferry"])
+        self.assertEqual(departed["ferry"]["amenities"], ["Coastal Cafe"])
+        self.assertEqual(len(departed["events"]), 2)
+
+    def test_ferry_sailings_are_not_cached(self):
+        ferry = Ferry.objects.get(pk=self.ferries[0].pk)
+        prefetch_ferries([ferry])
+        self.assertIsNone(ferry.current_sailing)
+
+        # Priming the sailings for as_dict leaves the properties reading the latest sailings
+        self.add_sailings(1)
+        self.assertEqual(ferry.current_sailing, Sailing.objects.get(ferry=ferry, departed=True))
+        self.assertNotIn("current_sailing", ferry.as_dict)
+
+    def test_queries_are_fixed(self):
+        self.add_sailings(2)
+        with CaptureQueriesContext(connection) as queries:
+            sailings_as_dicts(Sailing.objects.all())
+
+        self.add_sailings(4)
+        with self.assertNumQueries(len(queries)):
+            self.assertEqual(len(sailings_as_dicts(Sailing.objects.all())), 18)
+
+
+class DeparturesReconcilerTestCase(TestCase):
+    """ Check that parsed departures are reconciled against the stored sailings, writing only what has changed. """
+
+    tz = pytz.timezone("America/Vancouver")
+
+    def setUp(self):
+        # Don't pick up terminals, routes and the like from other tests
+        get_reference_cache().invalidate()
+        self.day = self.tz.localize(datetime(2020, 7, 1))
+
+    def departures(self, **changes):
+        """ Return a parsed departures page with two sailings, with any changes to the second one. """
+
+        sailings = [
+            {"ferry": "Spirit of British Columbia", "scheduled_departure": self.day.replace(hour=7),
+             "actual_departure": self.day.replace(hour=7, minute=4), "departed": True,
+             "eta_or_arrival": self.day.replace(hour=8, minute=38), "arrived": True, "status": "On Time"},
+            {"ferry": "Coastal Renaissance", "scheduled_departure": self.day.replace(hour=9),
+             "actual_departure": None, "departed": False, "eta_or_arrival": None, "arrived": False,
+             "status": "On Time"},
+        ]
+        sailings[1].update(changes)
+
+        return {
+            "captured_at": self.day.replace(hour=9),
+            "date": self.day,
+            "terminals": {"Tsawwassen": "TSA", "Swartz Bay": "SWB"},
+            "routes": [{
+                "route_name": "Tsawwassen to Swartz Bay", "route_code": "1", "source": "Tsawwassen",
+                "source_code": "TSA", "destination": "Swartz Bay", "sailing_time": 95, "sailings": sailings
+            }]
+        }
+
+    def apply(self, records):
+        run = DeparturesRun.objects.create()
+        apply_departures(records, run)
+        return run
+
+    def events(self, sailing):
+        return [type(event) for event in SailingEvent.objects.filter(sailing=sailing).order_by('pk')]
+
+    def test_new(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.apply(self.departures())
+
+        # The new sailings are inserted together, whether or not the database returns their IDs
+        self.assertEqual(len([query for query in queries if query["sql"].startswith('INSERT INTO "data_sailing"')]), 1)
+
+        first, second = Sailing.objects.order_by('scheduled_departure')
+        self.assertEqual((first.ferry.name, first.status.status, first.arrived), ("Spirit of British Columbia", "On Time",
+                                                                                  True))
+        self.assertEqual(first.late_leaving, 4)
+        self.assertEqual(self.events(second), [FerryEvent, StatusEvent])
+        self.assertEqual(EventLog.objects.filter(entity="sailing").count(), SailingEvent.objects.count())
+
+        # The arrived sailing is in the norms
+        self.assertEqual(SailingNorm.objects.get().sailings, 1)
+
+    def test_changed(self):
+        self.apply(self.departures())
+        created = Sailing.objects.get(scheduled_departure=self.day.replace(hour=9)).sailing_created
+
+        self.apply(self.departures(
+            ferry="Queen of Oak Bay", actual_departure=self.day.replace(hour=9, minute=2), departed=True,
+            eta_or_arrival=self.day.replace(hour=10, minute=40)
+        ))
+
+        sailing = Sailing.objects.get(scheduled_departure=self.day.replace(hour=9))
+        self.assertEqual(sailing.ferry.name, "Queen of Oak Bay")
+        self.assertEqual((sailing.departed, sailing.late_leaving), (True, 2))
+        self.assertGreater(sailing.sailing_created, created)
+        self.assertEqual(self.events(sailing)[2:], [FerryEvent, DepartureTimeEvent, DepartedEvent, ArrivalTimeEvent])
+
+    def test_unchanged(self):
+        self.apply(self.departures())
+        sailings = list(Sailing.objects.order_by('pk').values())
+        events = SailingEvent.objects.count()
+
+        run = self.apply(self.departures())
+
+        self.assertEqual(list(Sailing.objects.order_by('pk').values()), sailings)
+        self.assertEqual(SailingEvent.objects.count(), events)
+        self.assertEqual(run.writes, 0)
+
+    def test_cancelled(self):
+        self.apply(self.departures())
+        self.apply(self.departures(status="Cancelled"))
+
+        sailing = Sailing.objects.get(scheduled_departure=self.day.replace(hour=9))
+        self.assertEqual(sailing.status.status, "Cancelled")
+        self.assertEqual(self.events(sailing)[2:], [CancelledEvent, StatusEvent])
+
+    def test_ids_are_looked_up(self):
+        # Databases that can't return IDs from a bulk insert (like SQLite) still insert new sailings in bulk, and look
+        # their IDs up for the events afterwards
+        with mock.patch.object(connection.features, "can_return_ids_from_bulk_insert", False), \
+                mock.patch.object(Sailing, "save", autospec=True, side_effect=Sailing.save) as save:
+            self.apply(self.departures())
+
+        save.assert_not_called()
+        self.assertEqual(set(SailingEvent.objects.values_list('sailing', flat=True)),
+                         set(Sailing.objects.values_list('pk', flat=True)))
+        self.assertEqual(self.events(Sailing.objects.get(scheduled_departure=self.day.replace(hour=9))),
+                         [FerryEvent, StatusEvent])
+
+
+class ApplyConditionsTestCase(RouteTestMixin, TestCase):
+    """ Check that a conditions page only writes the sailings that have changed, and keeps the norms up to date. """
+
+    # No waits, so the conditions pages only change how full the sailings are
+    route_fields = {"car_waits": 0, "oversize_waits": 0}
+
+    tz = pytz.timezone("America/Vancouver")
+
+    def setUp(self):
+        super().setUp()
+        get_reference_cache().invalidate()
+
+        self.captured_at = self.tz.localize(datetime(2020, 7, 1, 12, 0))
+        self.arrived = Sailing.objects.create(
+            route=self.route, scheduled_departure=self.captured_at.replace(hour=9),
+            actual_departure=self.captured_at.replace(hour=9, minute=5), departed=True,
+            eta_or_arrival_time=self.captured_at.replace(hour=10, minute=40), arrived=True, percent_full=60
+        )
+        self.upcoming = [
+            Sailing.objects.create(route=self.route, scheduled_departure=self.captured_at.replace(hour=hour))
+            for hour in [13, 15]
+        ]
+
+    def conditions(self, full=False, **percent_full):
+        """ Return a parsed conditions page, with how full each sailing is given by its hour. """
+
+        return {
+            "captured_at": self.captured_at,
+            "routes": [{
+                "route_name": self.route.name, "full": full, "car_waits": 0, "oversize_waits": 0,
+                "sailings": [
+                    {"time": hour, "scheduled_departure": self.captured_at.replace(hour=int(hour[1:])),
+                     "percent_full": value}
+                    for hour, value in sorted(percent_full.items())
+                ],
+                "later_sailings": [self.captured_at.replace(hour=15)]
+            }]
+        }
+
+    def apply(self, records):
+        run = ConditionsRun.objects.create()
+        apply_conditions(records, run)
+        return run
+
+    def test_unchanged(self):
+        self.apply(self.conditions(h13=20))
+        sailings = list(Sailing.objects.order_by('pk').values())
+
+        run = self.apply(self.conditions(h13=20))
+        self.assertEqual(run.writes, 0)
+        self.assertEqual(list(Sailing.objects.order_by('pk').values()), sailings)
+
+    def test_changed(self):
+        self.apply(self.conditions(h13=20))
+        untouched = Sailing.objects.get(pk=self.upcoming[1].pk).sailing_created
+
+        # Only the sailing that changed is written, along with its event
+        self.apply(self.conditions(h13=35))
+        self.assertEqual(Sailing.objects.get(pk=self.upcoming[0].pk).percent_full, 35)
+        self.assertEqual(Sailing.objects.get(pk=self.upcoming[1].pk).sailing_created, untouched)
+        self.assertEqual(
+            list(PercentFullEvent.objects.order_by('pk').values_list('old_value', 'new_value')), [(None, 20), (20, 35)]
+        )
+
+    def test_norms(self):
+        self.assertEqual(SailingNorm.objects.get().percent_full["maximum"], 60)
+
+        self.apply(self.conditions(h9=75))
+        self.assertEqual(SailingNorm.objects.get().percent_full["maximum"], 75)
+
+    def test_full(self):
+        self.apply(self.conditions(full=True, h13=90))
+
+        # Today's later sailings are all full, and the ones on the page are as full as it says
+        self.assertEqual(
+            list(Sailing.objects.order_by('scheduled_departure').values_list('percent_full', flat=True)), [60, 90, 100]
+        )
+        self.assertEqual(list(PercentFullEvent.objects.filter(sailing=self.upcoming[0]).order_by('pk').values_list(
+            'old_value', 'new_value'
+        )), [(None, 100), (100, 90)])
+
+
+class ApplyLocationsTestCase(TestCase):
+    """ Check that the ferries on the location pages are written together. """
+
+    tz = pytz.timezone("America/Vancouver")
+
+    def setUp(self):
+        get_reference_cache().invalidate()
+
+        self.destination = Destination.objects.create(name="Swartz Bay")
+        Ferry.objects.create(name="Spirit of British Columbia", status="In Port")
+        Ferry.objects.create(name="Coastal Celebration", status="In Port")
+
+        self.updated = self.tz.localize(datetime(2020, 7, 1, 12, 0))
+
+    def test_batched(self):
+        records = {"1": [
+            {"ferry": "Spirit of British Columbia", "status": "Under Way", "destination": "Swartz Bay",
+             "time": "12:00 PM", "updated": self.updated},
+            {"ferry": "Coastal Celebration", "status": "Under Way", "destination": "Swartz Bay",
+             "time": "12:00 PM", "updated": self.updated}
+        ]}
+
+        run = LocationsRun.objects.create()
+        with CaptureQueriesContext(connection) as queries:
+            apply_locations(records, run)
+
+        # Both ferries are written in one statement, rather than one save() each
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "data_ferry"')]
+        self.assertEqual(len(updates), 1)
+
+        self.assertEqual(
+            list(Ferry.objects.order_by('pk').values_list('status', 'destination')),
+            [("Under Way", self.destination.pk), ("Under Way", self.destination.pk)]
+        )
+        self.assertEqual(UnderWayEvent.objects.count(), 2)
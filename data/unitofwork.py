@@ -0,0 +1,151 @@
+import logging
+from django.conf import settings
+from django.db import connection, models, transaction
+from time import monotonic
+
+from . import clock
+from .eventsink import EventSink
+from .references import get_reference_cache
+
+logger = logging.getLogger(__name__)
+
+
+class UnitOfWork:
+    """ Write the changes from a collector run in a single transaction.
+
+    Everything written inside the block is committed once at the end (or not at all if something goes wrong), rather
+    than each save() being committed on its own. Updates passed to update() are held back and written with
+    bulk_update in batches, and events passed to add() are inserted in bulk by an EventSink. Reference data should be
+    looked up through references, which is only published back to the shared cache if the run commits.
+
+    The number of rows written and how long the commit took are recorded on the Run, and saved along with its next
+    status update.
+    """
+
+    def __init__(self, run, batch_size: int = None):
+        """
+        :param run: the Run the changes belong to
+        :type run: Run
+        :param batch_size: how many pending updates to hold before writing them
+        :type batch_size: int
+        """
+
+        self.run = run
+        self.batch_size = batch_size or settings.BCF_WRITE_BATCH_SIZE
+        self.pending = {}
+        self.events = EventSink()
+        self.references = get_reference_cache().session()
+        self.writes = 0
+
+    def count(self, execute, sql, params, many, context):
+        """ Count the rows written by each statement. """
+
+        result = execute(sql, params, many, context)
+
+        if sql.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            self.writes += max(context['cursor'].rowcount, 0)
+
+        return result
+
+    def update(self, obj: models.Model, *fields: str) -> None:
+        """ Queue an update to an existing object.
+
+        :param obj: the object to update
+        :type obj: models.Model
+        :param fields: the fields to write (defaults to all of them)
+        :type fields: str
+        :returns: nothing
+        :rtype: None
+        """
+
+        model = type(obj)
+        if not fields:
+            fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+
+        objs, pending_fields = self.pending.setdefault(model, ({}, set()))
+        objs[obj.pk] = obj
+        pending_fields.update(fields)
+
+        self.check()
+
+    def add(self, *events: models.Model) -> None:
+        """ Queue new events to be inserted.
+
+        :param events: the events to insert
+        :type events: models.Model
+        :returns: nothing
+        :rtype: None
+        """
+
+        self.events.add(events)
+        self.check()
+
+    def check(self) -> None:
+        """ Write everything that's queued up if we're holding a full batch. """
+
+        if sum(len(objs) for objs, _ in self.pending.values()) + len(self.events) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Write all of the queued updates and events.
+
+        :returns: nothing
+        :rtype: None
+        """
+
+        now = clock.now()
+
+        for model, (objs, fields) in self.pending.items():
+            # bulk_update doesn't touch auto_now fields, so set those the same way save() would
+            for field in model._meta.concrete_fields:
+                if getattr(field, 'auto_now', False):
+                    for obj in objs.values():
+                        setattr(obj, field.attname, now)
+                    fields.add(field.name)
+
+            model.objects.bulk_update(objs.values(), fields)
+            logger.debug("Wrote {} {} objects".format(len(objs), model.__name__))
+
+        self.pending = {}
+        self.events.flush()
+
+    def __enter__(self) -> "UnitOfWork":
+        self.atomic = transaction.atomic()
+        self.atomic.__enter__()
+        self.wrapper = connection.execute_wrapper(self.count)
+        self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        except Exception as e:
+            self.close(type(e), e, e.__traceback__)
+            raise
+
+        self.close(exc_type, exc_value, traceback)
+
+    def close(self, exc_type, exc_value, traceback) -> None:
+        """ Commit the transaction (or roll it back if something went wrong), and record the outcome on the Run.
+
+        :returns: nothing
+        :rtype: None
+        """
+
+        self.wrapper.__exit__(exc_type, exc_value, traceback)
+
+        start = monotonic()
+        self.atomic.__exit__(exc_type, exc_value, traceback)
+        commit_time = monotonic() - start
+
+        if exc_type is None:
+            self.references.publish()
+            self.run.writes = self.writes
+            self.run.commit_time = commit_time
+            logger.info("Committed {} writes in {:.3f}s".format(self.writes, commit_time))
+        else:
+            # The cached reference data may have changes that have just been rolled back
+            get_reference_cache().invalidate()
+            logger.error("Rolled back {} writes: {}".format(self.writes, exc_value))
+            self.run.set_status("Failed while writing changes")
@@ -1,13 +1,7 @@
-import requests
 import re
 import logging
-import pytz
-from time import sleep
-from bs4 import BeautifulSoup
 from django.conf import settings
-from collections import deque
-from dateutil.parser import parse
-from datetime import datetime, timedelta
+from typing import Dict, List
 from .models import (Terminal, Route, Ferry, Sailing, Destination, Status,
                      SailingEvent, ArrivalTimeEvent, ArrivedEvent, StatusEvent,
                      FerryEvent, DepartureTimeEvent, DepartedEvent,
@@ -17,23 +11,26 @@ from .models import (Terminal, Route, Ferry, Sailing, Destination, Status,
                      ParkingEvent, CarPercentFullEvent,
                      OversizePercentFullEvent, Amenity)
 
+from . import clock
+from .client import get_client
+from .fetcher import get_fetcher
+from .locations import get_location_poller, LOCATION_ROUTES
+from .parsers import (make_soup, parse_conditions, parse_departures, parse_locations, parse_sailing_detail,
+                      ParseError, timezone)
+from .reconcile import DeparturesReconciler
+from .unitofwork import UnitOfWork
+
 from collector.models import (ConditionsRun, DeparturesRun, LocationsRun,
                               SailingDetailRun, ConditionsRawHTML, DeparturesRawHTML,
                               LocationsRawHTML)
 
 logger = logging.getLogger(__name__)
 
-timezone = pytz.timezone("America/Vancouver")
-
 
 def get_local_time(timestamp):
     return timezone.localize(timestamp).strftime("%H:%M")
 
 
-def get_local_day():
-    return datetime.now().astimezone(timezone).strftime("%Y-%m-%d")
-
-
 def median_value(queryset, term):
     count = queryset.count()
     values = queryset.values_list(term, flat=True).order_by(term)
@@ -43,7 +40,7 @@ def median_value(queryset, term):
         return sum(values[count/2-1:count/2+1])/2.0
 
 
-def get_actual_departures(input_file: str=None) -> bool:
+def get_actual_departures(input_file: str=None, page: DeparturesRawHTML=None) -> bool:
     """ Pull data from actualDepartures.asp page on the BC Ferries website.
 
     This will query https://orca.bcferries.com/cc/marqui/actualDepartures.asp
@@ -52,6 +49,8 @@ def get_actual_departures(input_file: str=None) -> bool:
 
     :param input_file: optional local file to read from
     :type input_file: str
+    :param page: optional archived page to process again (it isn't stored a second time)
+    :type page: RawHTML
     :returns: whether it succeeded or failed
     :rtype: bool
     """
@@ -61,18 +60,32 @@ def get_actual_departures(input_file: str=None) -> bool:
     # Build the URL to pull data from
     url = "{}/{}".format(settings.BCF_BASE_URL, "actualDepartures.asp")
 
-    if input_file:
+    headers = {}
+
+    if page:
+        # If an archived page is given, process that again
+        data = page.content
+    elif input_file:
         # If an input file is given, read from that instead
         fp = open(input_file, 'r')
         data = fp.read()
     else:
+        # Get the page we processed last time, so we can tell if it's changed
+        previous = DeparturesRawHTML.latest()
+
         try:
             # Request page
             logger.info("Querying BCF for data...")
-            response = requests.get(url)
-            if response.status_code == 200:
+            response = get_client().get(url, headers=previous.conditional_headers if previous else {})
+            if previous and previous.is_unchanged(response):
+                # Nothing's changed since the last run, so there's nothing to do
+                logger.info("Departures are unchanged since the last run")
+                run.set_status("Unchanged", successful=True, changed=False)
+                return True
+            elif response.status_code == 200:
                 logger.debug("Successfully queried BCF for data")
                 data = response.text
+                headers = response.headers
             else:
                 # Something went wrong - log that it went wrong and return
                 # TODO - fixup status
@@ -91,425 +104,308 @@ def get_actual_departures(input_file: str=None) -> bool:
 
     # Data retrieved
     run.set_status("Data retrieved from BCF")
-    raw_html = DeparturesRawHTML(
-        run=run,
-        data=data
-    )
-    raw_html.save()
-
-    # Load data into the BeautifulSoup parser
-    b = BeautifulSoup(data, 'html.parser')
-
-    # Parse out the routes
-    # Create a deque object containing the routes and sailings
-    routes = deque(
-        b.find('td', class_='content').find('table').find_all('table')
-    )
-
-    # Parse out the current date
-    date = b.find('span', class_='titleSmInv').text
-
-    routes_list = []
-    terminals = {}
-
-    # Iterate over the routes
-    while len(routes) != 0:
-        # Pop off the next route
-        route = routes.popleft()
-
-        # Parse out the route name and the sailing time
-        route_name, sailing_time = route.span.decode_contents().split('<br/>')
-
-        # Parse out the source, destination, the source code and route code
-        source, destination = re.search(r'(.*) to (.*)', route_name).groups()
-        source_code, route_code = re.search(r'#([A-Z]+)(\d+)', route.find_previous_sibling().attrs['name']).groups()
-
-        # Parse out the sailing time
-        sailing_time = re.search("Sailing time: (.*)", sailing_time).groups()[0]
-
-        # Some sailings (i.e. those to the Gulf Islands) are variable as BC Ferries doesn't provide live details for
-        # them. For these, we can't get a duration - so skip them.
-        if sailing_time != "Variable":
-            # Sailing time is fixed, so parse out the hours and minutes for the duration
-            times = re.search(r'(([0-9]+) hours?\s?)?(([0-9]+) minutes)?.*', sailing_time).groups()
-
-            # Convert minutes to an integer
-            if times[3]:
-                minutes = int(times[3])
-            else:
-                minutes = 0
-
-            # Convert hours to minutes
-            if times[1]:
-                minutes += int(times[1]) * 60
-
-            logger.debug("Minutes: {}".format(minutes))
-
-        # Add a mapping of terminal name to terminal source code
-        terminals[source] = source_code
-
-        # Pop off the sailings
-        sailings = routes.popleft()
-
-        # Create a dict with the details we've parsed out so far
-        # TODO - minutes could potentially be unassigned
-        route_details = {
-            "source_code": source_code,
-            "source": source,
-            "destination": destination,
-            "route_name": route_name,
-            "route_code": route_code,
-            "sailing_time": minutes
-        }
+    if not page:
+        raw_html = DeparturesRawHTML(
+            run=run,
+            data=data,
+            etag=headers.get('ETag'),
+            last_modified=headers.get('Last-Modified')
+        )
+        raw_html.save()
 
-        sailings_list = []
+    # Parse the page, as of the time it was captured
+    try:
+        records = parse_departures(data, clock.now())
+    except ParseError as e:
+        run.info = e.info
+        run.set_status("Failed during sailing parsing", False)
+        return False
 
-        # Iterate over the sailings
-        for sailing in sailings.find_all('tr')[1:]:
-            # Parse out the ferry, the scheduled departure time, the actual departure time, the ETA (or arrival time)
-            # and the current status for this sailing
+    # At this point, we've successfully parsed out the data from the HTML
+    run.set_status("Data parsed")
 
-            try:
-                ferry, scheduled, actual, eta_arrival, status = [td.text.strip() for td in sailing.find_all('td')]
-            except ValueError as e:
-                logger.error("Couldn't parse out sailing details: {}".format(e))
-                logger.error("Tried parsing: {}".format(sailing.find_all('td')))
-                run.info = sailing.find_all('td')
-                run.set_status("Failed during sailing parsing", False)
-                return False
+    apply_departures(records, run)
 
-            # Append the parsed details as a dict to our sailings list
-            sailings_list.append({
-                "ferry": ferry,
-                "scheduled": scheduled,
-                "actual": actual,
-                "eta_or_arrival": eta_arrival,
-                "status": status
-            })
+    # We've finished parsing and updating the departures information
+    run.set_status("Completed", successful=True)
+    logger.info("Finished retrieving and processing departures")
+    return True
 
-        route_details.update({"sailings": sailings_list})
-        routes_list.append(route_details)
 
-    # At this point, we've successfully parsed out the data from the HTML
-    run.set_status("Data parsed")
+def apply_departures(records: dict, run: DeparturesRun) -> None:
+    """ Update the routes and sailings from a parsed departures page, in a single transaction.
 
-    # Iterate over each route
-    for route in routes_list:
+    :param records: the parsed page, from parse_departures()
+    :type records: dict
+    :param run: the run the changes are for
+    :type run: DeparturesRun
+    :returns: nothing
+    :rtype: None
+    """
 
-        logger.debug("--- Parsing new route ---")
+    terminals = records['terminals']
 
-        # Get the source and destination name, and the source code
-        destination_name = route['destination']
-        source_name = route['source']
-        source_code = route['source_code']
+    # Write everything in a single transaction
+    with UnitOfWork(run) as uow:
+        # Load what we already know about today's departures, so we can compare against it in memory
+        reconciler = DeparturesReconciler(records['date'])
+        references = uow.references
 
-        # TODO - sailing_time is from above, probably shouldn't be here
-        logger.debug("Sailing time is '{}'".format(sailing_time))
+        # Iterate over each route
+        for route in records['routes']:
 
-        # Get or create the Terminal object for the source
-        source_o, created = Terminal.objects.get_or_create(
-            name=source_name,
-            short_name=source_code
-        )
+            logger.debug("--- Parsing new route ---")
 
-        # Log if we found or created a new Terminal object
-        if created:
-            logger.info("Created terminal {} for {}".format(
-                source_code, source_name
-            ))
-        else:
-            logger.debug("Found terminal {} for {}".format(
-                source_o.name, source_o.short_name
-            ))
+            # Get the source and destination name, and the source code
+            destination_name = route['destination']
+            source_name = route['source']
+            source_code = route['source_code']
 
-        # See if the destination is a terminal, or just a description
-        if destination_name not in terminals:
-            logger.debug("{} not found in terminal list".format(destination_name))
+            logger.debug("Sailing time is '{}'".format(route['sailing_time']))
 
-            # Create Destination object without an associated terminal
-            dest_o, created = Destination.objects.get_or_create(
-                name=destination_name
-            )
+            # Get or create the Terminal object for the source
+            source_o, created = references.get_or_create(Terminal, name=source_name, short_name=source_code)
 
-            # Log if we found or created a new Destination object
-            if created:
-                logger.info("Created destination for {}".format(
-                    destination_name
-                ))
-            else:
-                logger.debug("Found destination for {}".format(
-                    dest_o.name
-                ))
-        else:
-            # Get or create the Terminal object for the destination
-            destination_o, created = Terminal.objects.get_or_create(
-                name=destination_name,
-                short_name=terminals[destination_name]
-            )
-
-            # Log if we found or created a new Terminal object for the destination
+            # Log if we found or created a new Terminal object
             if created:
                 logger.info("Created terminal {} for {}".format(
-                    destination_name, terminals[destination_name]
+                    source_code, source_name
                 ))
             else:
                 logger.debug("Found terminal {} for {}".format(
-                    destination_o.name, destination_o.short_name
+                    source_o.name, source_o.short_name
                 ))
 
-            # Create Destination object (different to the actual Terminal
-            # object for the destination)
-            dest_o, created = Destination.objects.get_or_create(
-                name=destination_name,
-                terminal=destination_o
-            )
-
-            # Log if we found or created a new Destination object
-            if created:
-                logger.info("Created destination for {} ({})".format(
-                    destination_name, destination_o
-                ))
-            else:
-                logger.debug("Found destination for {} ({})".format(
-                    dest_o.name, dest_o.terminal
-                ))
+            # See if the destination is a terminal, or just a description
+            if destination_name not in terminals:
+                logger.debug("{} not found in terminal list".format(destination_name))
 
-        # Get the route code
-        route_code = route['route_code']
+                # Create Destination object without an associated terminal
+                dest_o, created = references.get_or_create(Destination, name=destination_name)
 
-        # Get or create a Route object for the route
-        route_o, created = Route.objects.get_or_create(
-            name=route['route_name'],
-            source=source_o,
-            destination=dest_o,
-            route_code=route_code
-        )
+                # Log if we found or created a new Destination object
+                if created:
+                    logger.info("Created destination for {}".format(
+                        destination_name
+                    ))
+                else:
+                    logger.debug("Found destination for {}".format(
+                        dest_o.name
+                    ))
+            else:
+                # Get or create the Terminal object for the destination
+                destination_o, created = references.get_or_create(
+                    Terminal, name=destination_name, short_name=terminals[destination_name]
+                )
 
-        # Log if we found or created a new Route object
-        if created:
-            logger.info("Created route {} ({} -> {})".format(
-                route_o.route_code, route_o.source, route_o.destination
-            ))
-        else:
-            logger.debug("Found route {} ({} -> {})".format(
-                route_o.route_code, route_o.source, route_o.destination
-            ))
+                # Log if we found or created a new Terminal object for the destination
+                if created:
+                    logger.info("Created terminal {} for {}".format(
+                        destination_name, terminals[destination_name]
+                    ))
+                else:
+                    logger.debug("Found terminal {} for {}".format(
+                        destination_o.name, destination_o.short_name
+                    ))
 
-        if not route_o.duration and route['sailing_time']:
-            # We didn't previously have a duration for this route, but we do now - so update the Route object with it
-            logger.debug("Setting sailing time to {}".format(route['sailing_time']))
-            route_o.duration = route['sailing_time']
-            route_o.save()
-
-        # Iterate over the sailings for this route
-        for sailing in route['sailings']:
-            logger.debug(">>>>>> Parsing new sailing")
-            ferry = sailing['ferry']
-            scheduled_departure = sailing['scheduled']
-            actual_departure = sailing['actual']
-            eta_or_arrival = sailing['eta_or_arrival']
-            status = sailing['status']
-
-            # Get or create a Ferry object for this sailing's ferry
-            ferry_o, created = Ferry.objects.get_or_create(
-                name=ferry
-            )
+                # Create Destination object (different to the actual Terminal
+                # object for the destination)
+                dest_o, created = references.get_or_create(
+                    Destination, name=destination_name, terminal=destination_o
+                )
 
-            # Log if we found or created a new Ferry object
-            if created:
-                logger.info("Created ferry {}".format(ferry))
-            else:
-                logger.debug("Found ferry {}".format(ferry))
-
-            # Parse and convert the scheduled departure time
-            # TODO - this shouldn't reuse the same name - it's ugly
-            sched = parse("{} {}".format(date, scheduled_departure))
-            sched = timezone.localize(sched)
-
-            if actual_departure:
-                # This sailing has left, so parse and convert the acual departure time...
-                actual = parse("{} {}".format(date, actual_departure))
-                actual = timezone.localize(actual)
-                # ...and set the sailing to departed
-                departed = True
-            else:
-                # No actual departure time found
-                logger.debug("No actual departure time for this sailing")
-                actual = None
-                departed = False
-
-            # Usefully (not), the ETA/arrival time can be '...' (unknown). We need to handle this gracefully
-            if eta_or_arrival and eta_or_arrival != '...':
-                if 'ETA' in eta_or_arrival:
-                    # We have an ETA, so parse it out
-                    eta = re.search(r'ETA: (.*)', eta_or_arrival).groups()[0]
-                    eta_or_arrival = parse("{} {}".format(date, eta))
-                    eta_or_arrival = timezone.localize(eta_or_arrival)
-                    logger.debug("ETA for this sailing is {}".format(eta_or_arrival))
-                    # Since we have an ETA, this means this sailing hasn't arrived yet
-                    arrived = False
+                # Log if we found or created a new Destination object
+                if created:
+                    logger.info("Created destination for {} ({})".format(
+                        destination_name, destination_o
+                    ))
                 else:
-                    # No ETA but an arrival time means this sailing has arrived
-                    eta_or_arrival = parse("{} {}".format(date, eta_or_arrival))
-                    eta_or_arrival = timezone.localize(eta_or_arrival)
-                    logger.debug("Arrival time for this sailing was {}".format(eta_or_arrival))
-                    arrived = True
-            else:
-                logger.debug("No ETA or arrival time")
-                eta_or_arrival = None
-                arrived = False
+                    logger.debug("Found destination for {} ({})".format(
+                        dest_o.name, dest_o.terminal
+                    ))
+
+            # Get the route code
+            route_code = route['route_code']
 
-            # Get or create a Status object for this sailing
-            status_o, created = Status.objects.get_or_create(
-                status=status
+            # Get or create a Route object for the route
+            route_o, created = references.get_or_create(
+                Route, name=route['route_name'], source=source_o, destination=dest_o, route_code=route_code
             )
 
-            # Log if we found or created a new Status object
+            # Log if we found or created a new Route object
             if created:
-                logger.info("Created status {}".format(status))
+                logger.info("Created route {} ({} -> {})".format(
+                    route_o.route_code, route_o.source, route_o.destination
+                ))
             else:
-                logger.debug("Found status {}".format(status))
+                logger.debug("Found route {} ({} -> {})".format(
+                    route_o.route_code, route_o.source, route_o.destination
+                ))
 
-            # Get or create a Sailing object for this sailing
-            sailing_o, created = Sailing.objects.get_or_create(
-                route=route_o,
-                scheduled_departure=sched
-            )
+            if not route_o.duration and route['sailing_time']:
+                # We didn't previously have a duration for this route, but we do now - so update the Route object with it
+                logger.debug("Setting sailing time to {}".format(route['sailing_time']))
+                route_o.duration = route['sailing_time']
+                route_o.save()
 
-            # Log if we found or created a new Destination object
-            if created:
-                logger.info("Created sailing {}".format(sailing_o))
-            else:
-                logger.debug("Found sailing {}".format(sailing_o))
+            # Iterate over the sailings for this route
+            for sailing in route['sailings']:
+                logger.debug(">>>>>> Parsing new sailing")
+                ferry = sailing['ferry']
+                scheduled_departure = sailing['scheduled_departure']
+                actual = sailing['actual_departure']
+                departed = sailing['departed']
+                eta_or_arrival = sailing['eta_or_arrival']
+                arrived = sailing['arrived']
+                status = sailing['status']
+
+                # Get or create a Ferry object for this sailing's ferry
+                ferry_o, created = references.get_or_create(Ferry, name=ferry)
+
+                # Log if we found or created a new Ferry object
+                if created:
+                    logger.info("Created ferry {}".format(ferry))
+                else:
+                    logger.debug("Found ferry {}".format(ferry))
 
-            # Since we track changes to the sailing, we now need to see if anything's changed between the details
-            # we just parsed and the details we already had for this sailing
+                # Get or create a Status object for this sailing
+                status_o, created = references.get_or_create(Status, status=status)
 
-            # Check if the ferry has changed
-            if sailing_o.ferry != ferry_o:
-                # Ferry has changed
-                logger.debug("Ferry has changed ({} to {})".format(
-                    sailing_o.ferry, ferry_o
-                ))
+                # Log if we found or created a new Status object
+                if created:
+                    logger.info("Created status {}".format(status))
+                else:
+                    logger.debug("Found status {}".format(status))
 
-                # Create a FerryEvent
-                event_o = FerryEvent(
-                    sailing=sailing_o,
-                    old_ferry=sailing_o.ferry,
-                    new_ferry=ferry_o
-                )
-                sailing_o.ferry = ferry_o
+                # Get or create a Sailing object for this sailing (new sailings are saved along with the changes below)
+                sailing_o, created = reconciler.sailing(route_o, scheduled_departure)
 
-                event_o.save()
-                sailing_o.save()
+                # Log if we found or created a new Destination object
+                if created:
+                    logger.info("Created sailing {}".format(sailing_o))
+                else:
+                    logger.debug("Found sailing {}".format(sailing_o))
 
-            # Check if the actual departure time has changed (and yes, it can apparently)
-            if sailing_o.actual_departure != actual:
-                # Actual departure time has changed
-                logger.debug("Actual departure has changed ({} to {})".format(
-                    sailing_o.actual_departure, actual
-                ))
+                # Since we track changes to the sailing, we now need to see if anything's changed between the details
+                # we just parsed and the details we already had for this sailing
 
-                # But wait! Has the actual departure time disappeared?
-                if not actual:
-                    # Yes, this can happen too
-                    logger.debug("Actual departure time has been removed")
+                # Check if the ferry has changed
+                if sailing_o.ferry_id != ferry_o.pk:
+                    # Ferry has changed
+                    logger.debug("Ferry has changed ({} to {})".format(
+                        sailing_o.ferry, ferry_o
+                    ))
 
-                # Create a new DepartureTimeEvent
-                event_o = DepartureTimeEvent(
-                    sailing=sailing_o,
-                    old_departure=sailing_o.actual_departure,
-                    new_departure=actual
-                )
-                sailing_o.actual_departure = actual
+                    # Create a FerryEvent
+                    event_o = FerryEvent(
+                        sailing=sailing_o,
+                        old_ferry=sailing_o.ferry,
+                        new_ferry=ferry_o
+                    )
+                    sailing_o.ferry = ferry_o
 
-                event_o.save()
-                sailing_o.save()
+                    reconciler.changed(sailing_o, event_o)
 
-            # Check if the sailing has departed (or un-departed - this can probably happen too)
-            if sailing_o.departed != departed:
-                # Departure status has changed
-                logger.debug("Departed has changed ({} to {})".format(
-                    sailing_o.departed, departed
-                ))
+                # Check if the actual departure time has changed (and yes, it can apparently)
+                if sailing_o.actual_departure != actual:
+                    # Actual departure time has changed
+                    logger.debug("Actual departure has changed ({} to {})".format(
+                        sailing_o.actual_departure, actual
+                    ))
 
-                # Create a new DepartedEvent
-                event_o = DepartedEvent(
-                    sailing=sailing_o
-                )
-                sailing_o.departed = departed
+                    # But wait! Has the actual departure time disappeared?
+                    if not actual:
+                        # Yes, this can happen too
+                        logger.debug("Actual departure time has been removed")
 
-                event_o.save()
-                sailing_o.save()
+                    # Create a new DepartureTimeEvent
+                    event_o = DepartureTimeEvent(
+                        sailing=sailing_o,
+                        old_departure=sailing_o.actual_departure,
+                        new_departure=actual
+                    )
+                    sailing_o.actual_departure = actual
 
-            # Check if the ETA or arrival time has changed
-            if sailing_o.eta_or_arrival_time != eta_or_arrival:
-                # The ETA or arrival time has changed
-                logger.debug("ETA or arrival time has changed ({} to {})".format(
-                    sailing_o.eta_or_arrival_time, eta_or_arrival
-                ))
+                    reconciler.changed(sailing_o, event_o)
 
-                # Create a new ArrivalTimeEvent
-                event_o = ArrivalTimeEvent(
-                    sailing=sailing_o,
-                    old_arrival=sailing_o.eta_or_arrival_time,
-                    new_arrival=eta_or_arrival,
-                    is_eta=not arrived
-                )
-                sailing_o.eta_or_arrival_time = eta_or_arrival
+                # Check if the sailing has departed (or un-departed - this can probably happen too)
+                if sailing_o.departed != departed:
+                    # Departure status has changed
+                    logger.debug("Departed has changed ({} to {})".format(
+                        sailing_o.departed, departed
+                    ))
 
-                event_o.save()
-                sailing_o.save()
+                    # Create a new DepartedEvent
+                    event_o = DepartedEvent(
+                        sailing=sailing_o
+                    )
+                    sailing_o.departed = departed
 
-            # Check if the sailing has arrived
-            if sailing_o.arrived != arrived:
-                # Arrival status has changed
-                logger.debug("Arrival has changed ({} to {})".format(
-                    sailing_o.arrived, arrived
-                ))
+                    reconciler.changed(sailing_o, event_o)
 
-                # Create a new ArrivedEvent
-                event_o = ArrivedEvent(
-                    sailing=sailing_o
-                )
-                sailing_o.arrived = arrived
+                # Check if the ETA or arrival time has changed
+                if sailing_o.eta_or_arrival_time != eta_or_arrival:
+                    # The ETA or arrival time has changed
+                    logger.debug("ETA or arrival time has changed ({} to {})".format(
+                        sailing_o.eta_or_arrival_time, eta_or_arrival
+                    ))
 
-                event_o.save()
-                sailing_o.save()
+                    # Create a new ArrivalTimeEvent
+                    event_o = ArrivalTimeEvent(
+                        sailing=sailing_o,
+                        old_arrival=sailing_o.eta_or_arrival_time,
+                        new_arrival=eta_or_arrival,
+                        is_eta=not arrived
+                    )
+                    sailing_o.eta_or_arrival_time = eta_or_arrival
 
-            # Check if the sailing status has changed
-            if sailing_o.status != status_o:
-                # Sailing status has changed
-                logger.debug("Status has changed ({} to {})".format(
-                    sailing_o.status, status_o
-                ))
+                    reconciler.changed(sailing_o, event_o)
 
-                # Create a new StatusEvent
-                event_o = StatusEvent(
-                    sailing=sailing_o,
-                    old_status=sailing_o.status,
-                    new_status=status_o
-                )
-                sailing_o.status = status_o
+                # Check if the sailing has arrived
+                if sailing_o.arrived != arrived:
+                    # Arrival status has changed
+                    logger.debug("Arrival has changed ({} to {})".format(
+                        sailing_o.arrived, arrived
+                    ))
 
-                # If the status is now Cancelled, additionally create a CancelledEvent
-                # TODO - do we need to set the cancelled value here?
-                if sailing_o.status == "Cancelled":
-                    cancelled_o = CancelledEvent(
+                    # Create a new ArrivedEvent
+                    event_o = ArrivedEvent(
                         sailing=sailing_o
                     )
-                    cancelled_o.save()
+                    sailing_o.arrived = arrived
 
-                event_o.save()
-                sailing_o.save()
+                    reconciler.changed(sailing_o, event_o)
 
-    # We've finished parsing and updating the departures information
-    run.set_status("Completed", successful=True)
-    logger.info("Finished retrieving and processing departures")
-    return True
+                # Check if the sailing status has changed
+                if sailing_o.status != status_o:
+                    # Sailing status has changed
+                    logger.debug("Status has changed ({} to {})".format(
+                        sailing_o.status, status_o
+                    ))
+
+                    # Create a new StatusEvent
+                    event_o = StatusEvent(
+                        sailing=sailing_o,
+                        old_status=sailing_o.status,
+                        new_status=status_o
+                    )
+                    sailing_o.status = status_o
 
+                    # If the status is now Cancelled, additionally create a CancelledEvent
+                    # TODO - do we need to set the cancelled value here?
+                    if status_o.status == "Cancelled":
+                        cancelled_o = CancelledEvent(
+                            sailing=sailing_o
+                        )
+                        reconciler.changed(sailing_o, cancelled_o)
 
-def get_current_conditions(input_file: str=None) -> bool:
+                    reconciler.changed(sailing_o, event_o)
+
+        # Write all of the changes in one go
+        reconciler.save(uow)
+
+
+def get_current_conditions(input_file: str=None, page: ConditionsRawHTML=None) -> bool:
     """ Pull data from the current conditions/"at-a-glance" page on the BC Ferries website.
 
     This will query https://orca.bcferries.com/cc/marqui/at-a-glance.asp and parse it. This
@@ -519,6 +415,8 @@ def get_current_conditions(input_file: str=None) -> bool:
 
     :param input_file: optional local file to read from
     :type input_file: str
+    :param page: optional archived page to process again (it isn't stored a second time)
+    :type page: RawHTML
     :returns: whether it succeeded or failed
     :rtype: bool
     """
@@ -528,19 +426,33 @@ def get_current_conditions(input_file: str=None) -> bool:
     # Build the URL to pull data from
     url = "{}/{}".format(settings.BCF_BASE_URL, "at-a-glance.asp")
 
-    if input_file:
+    headers = {}
+
+    if page:
+        # If an archived page is given, process that again
+        data = page.content
+    elif input_file:
         # If an input file is given, read from that instead
         # TODO - should be in a context
         fp = open(input_file, 'r')
         data = fp.read()
     else:
+        # Get the page we processed last time, so we can tell if it's changed
+        previous = ConditionsRawHTML.latest()
+
         try:
             # Request page
             logger.info("Querying BCF for data...")
-            response = requests.get(url)
-            if response.status_code == 200:
+            response = get_client().get(url, headers=previous.conditional_headers if previous else {})
+            if previous and previous.is_unchanged(response):
+                # Nothing's changed since the last run, so there's nothing to do
+                logger.info("Conditions are unchanged since the last run")
+                run.set_status("Unchanged", successful=True, changed=False)
+                return True
+            elif response.status_code == 200:
                 logger.info("Successfully queried BCF for data")
                 data = response.text
+                headers = response.headers
             else:
                 # Something went wrong (i.e. we got something other than a 200 OK)
                 logger.error("Could not retrieve details from the BC Ferries website: {}".format(response.status_code))
@@ -558,315 +470,208 @@ def get_current_conditions(input_file: str=None) -> bool:
 
     # Data retrieved
     run.set_status("Data retrieved from BCF")
-    raw_html = ConditionsRawHTML(
-        run=run,
-        data=data
-    )
-    raw_html.save()
-
-    # Load data into the BeautifulSoup parser
-    s = BeautifulSoup(data, 'html.parser')
-
-    # TODO - this might be unused
-    terminals = {}
-
-    j_routes = []
-    full_routes = []
-
-    # Iterate over each section
-    for section in s.find_all('tbody'):
-        current_terminal = None
-        if section.span:
-            terminal_name = section.span.contents[0]
-            terminal_id = terminal_name.lower().replace(' ', '_')
-        else:
-            # Parse out each sailing
-            previously_parsed = None
-
-            # Iterate over each sailing row
-            for route in section.find_all('tr', recursive=False)[1:-1]:
-                j_route = {}
-                route_name = route.td.text
-                details = route.find_all('td', recursive=False)
-
-                fully_booked = False
-                route_id = None
-
-                try:
-                    # Match the route ID
-                    route_id = re.match('.*route=(\d+)&dept=(\w+).*', details[7].a.get('href')).groups()[0]
-                except IndexError as e:
-                    # If matching the above didn't work, it's possible the sailing is fully booked
-                    if 'Vehicle space on this route is fully booked' in details[0].text:
-                        logger.debug("All sailings today on the previously-parsed route are fully booked")
-                        logger.debug("This was: {}".format(previously_parsed))
-                        fully_booked = True
-                        full_routes.append(previously_parsed)
-                    else:
-                        # Who knows?
-                        logger.error("Unknown error: {}".format(e))
-
-                if route_id:
-                    # Store the route ID and route name
-                    j_route['route_id'] = route_id
-                    j_route['route_name'] = route_name
-
-                    if details[1].div.text == "N/A":
-                        # Sometimes the sailing details are "N/A" - so not much we can do with them
-                        next_sailing = "N/A"
-                        percent_full = "N/A"
-                        j_route['sailings'] = None
-                    else:
-                        # Parse out each sailing
-                        sailing_details = {}
-                        sailings = details[1].div.table.find_all('tr')
-                        j_sailings = []
-
-                        # Iterate over each sailing
-                        for sailing in sailings:
-                            # Get the next sailing
-                            next_sailing = sailing.td.text
-
-                            # Check if the sailing has been cancelled
-                            if sailing.td.next_sibling.text == "Cancelled":
-                                # Sailing is cancelled
-                                j_sailings.append({
-                                    'time': next_sailing,
-                                    'cancelled': True
-                                })
-                            else:
-                                # Sailing isn't cancelled, so parse out how full this sailing is
-                                percent_full = int(sailing.td.next_sibling.text.split('% ')[0])
-                                sailing_details.update({next_sailing: percent_full})
-
-                                j_sailings.append({
-                                    'time': next_sailing,
-                                    'percent_full': percent_full,
-                                })
-
-                        # Save this sailings
-                        j_route['sailings'] = j_sailings
-
-                        # Parse out the number of car and oversize waits
-                        car_waits = int(details[2].text.rstrip('\n'))
-                        oversize_waits = int(details[3].text.rstrip('\n'))
-
-                        # ...and save those too
-                        j_route['car_waits'] = car_waits
-                        j_route['oversize_waits'] = oversize_waits
-
-                    # Parse out later sailings. These are the ones which we don't have full
-                    # details for yet
-                    next_sailings = details[4].text.lstrip(' ').split(' ')
-                    j_route['later_sailings'] = next_sailings
-
-                    # Save all the sailings for this route
-                    j_routes.append(j_route)
-                    previously_parsed = route_name
-
-    # Iterate over each route
-    for route in j_routes:
-        # Get the route name
-        route_name = route['route_name']
-        logger.debug("Found route {}".format(route_name))
-
-        # Get the Route object for this route
-        route_o = Route.objects.get(name=route_name)
-
-        # Check if this route is full for today
-        if route_name in full_routes:
-            logger.debug("All of today's sailings are now full")
-
-            # Set all of today's sailings to 100%
-            for full_sailing in route_o.sailings_today:
-                logger.debug("Setting sailing {} to 100% full...".format(
-                    full_sailing
-                ))
-
-                # If this sailing wasn't previously full, set it to full
-                if full_sailing.percent_full != 100:
-                    logger.debug("Percent full has changed ({} -> {})".format(
-                        full_sailing.percent_full, 100
-                    ))
-
-                    # Create a PercentFullEvent
-                    percentfull_o = PercentFullEvent(
-                        sailing=full_sailing,
-                        old_value=full_sailing.percent_full,
-                        new_value=100
-                    )
-
-                    full_sailing.percent_full = 100
-                    full_sailing.save()
+    if not page:
+        raw_html = ConditionsRawHTML(
+            run=run,
+            data=data,
+            etag=headers.get('ETag'),
+            last_modified=headers.get('Last-Modified')
+        )
+        raw_html.save()
 
-                    percentfull_o.save()
-                else:
-                    logger.debug("Sailing was already 100% full")
+    # Parse the page, as of the time it was captured
+    records = parse_conditions(data, clock.now())
 
-        # Get the car and oversize waits
-        car_waits = route.get('car_waits', None)
-        oversize_waits = route.get('oversize_waits', None)
+    apply_conditions(records, run)
 
-        # Check if the waits have changed
-        if route_o.car_waits != car_waits:
-            # Car waits has changed
-            logger.debug("Car waits has changed ({} -> {})".format(
-                route_o.car_waits, car_waits
-            ))
+    # Parsing completed
+    run.set_status("Completed", successful=True)
+    logger.info("Finished retrieving and processing conditions")
+    return True
 
-            # Create a CarWaitEvent
-            carwaitevent_o = CarWaitEvent(
-                route=route_o,
-                old_value=route_o.car_waits,
-                new_value=car_waits
-            )
 
-            route_o.car_waits = car_waits
+def apply_conditions(records: dict, run: ConditionsRun) -> None:
+    """ Update the routes and sailings from a parsed conditions page, in a single transaction.
 
-            carwaitevent_o.save()
-            route_o.save()
+    :param records: the parsed page, from parse_conditions()
+    :type records: dict
+    :param run: the run the changes are for
+    :type run: ConditionsRun
+    :returns: nothing
+    :rtype: None
+    """
 
-        if route_o.oversize_waits != oversize_waits:
-            # Oversize waits has changed
-            logger.debug("Oversize waits has changed ({} -> {})".format(
-                route_o.oversize_waits, oversize_waits
-            ))
+    # Sailings we've loaded, so a sailing that's updated twice is the same object both times
+    sailings = {}
 
-            # Create a OversizeWaitEvent
-            oversizewaitevent_o = OversizeWaitEvent(
-                route=route_o,
-                old_value=route_o.oversize_waits,
-                new_value=oversize_waits
-            )
+    # Sailings with changes queued up, which need the norms updating once they're written
+    changed_sailings = {}
 
-            route_o.oversize_waits = oversize_waits
+    def update_sailing(sailing_o: Sailing, *fields: str) -> None:
+        """ Queue up the given fields of a sailing to be written, along with any derived fields that change. """
 
-            oversizewaitevent_o.save()
-            route_o.save()
+        derived = {field: getattr(sailing_o, field) for field in Sailing.DERIVED_FIELDS}
+        sailing_o.calculate()
 
+        fields += tuple(field for field, value in derived.items() if getattr(sailing_o, field) != value)
+        if fields:
+            uow.update(sailing_o, *fields)
+            changed_sailings[sailing_o.pk] = sailing_o
 
-        # Check if there are any sailings for this route today
-        if not route['sailings']:
-            # Nope :(
-            logger.debug("No more sailings today for this route")
-        else:
-            # Iterate over each sailing
-            for sailing in route['sailings']:
-                logger.debug("Found sailing at {}".format(sailing['time']))
+    # Write everything in a single transaction, batching up the route and sailing updates
+    with UnitOfWork(run) as uow:
+        # Iterate over each route
+        for route in records['routes']:
+            # Get the route name
+            route_name = route['route_name']
+            logger.debug("Found route {}".format(route_name))
 
-                # Build time
-                today = datetime.now(timezone).strftime("%Y-%m-%d")
-                sailing_time = parse("{} {}".format(
-                    today,
-                    sailing['time']
-                ))
-                sailing_time = timezone.localize(sailing_time)
-                logger.debug("Sailing time is {}".format(sailing_time))
+            # Get the Route object for this route
+            route_o = uow.references.get(Route, name=route_name)
 
-                # Find sailing
-                sailing_o = Sailing.objects.get(
-                    route=route_o,
-                    scheduled_departure=sailing_time
-                )
+            # Check if this route is full for today
+            if route['full']:
+                logger.debug("All of today's sailings are now full")
 
-                # Check if the sailing was marked as cancelled
-                if 'cancelled' in sailing:
-                    logger.debug("Sailing has been cancelled")
-                else:
-                    # Get how full this sailing is
-                    percent_full = sailing['percent_full']
+                # Set all of today's sailings to 100%
+                for full_sailing in route_o.get_sailings_today(records['captured_at']):
+                    full_sailing = sailings.setdefault((route_o.pk, full_sailing.scheduled_departure), full_sailing)
+                    logger.debug("Setting sailing {} to 100% full...".format(
+                        full_sailing
+                    ))
 
-                    # Check if the loading has changed
-                    if sailing_o.percent_full != percent_full:
-                        # Loading has changed
+                    # If this sailing wasn't previously full, set it to full
+                    if full_sailing.percent_full != 100:
                         logger.debug("Percent full has changed ({} -> {})".format(
-                            sailing_o.percent_full, percent_full
+                            full_sailing.percent_full, 100
                         ))
 
                         # Create a PercentFullEvent
                         percentfull_o = PercentFullEvent(
-                            sailing=sailing_o,
-                            old_value=sailing_o.percent_full,
-                            new_value=percent_full
+                            sailing=full_sailing,
+                            old_value=full_sailing.percent_full,
+                            new_value=100
                         )
 
-                        sailing_o.percent_full = percent_full
-
-                        percentfull_o.save()
-
-                sailing_o.save()
-
-        # For some sailings (i.e. Tsawwassen to Southern Gulf Islands) the
-        # later sailings can actually include the day *after* tomorrow as
-        # well as tomorrow - e.g. "*11:10am *5:40pm *9:05pm *9:55am". This
-        # is as dumb as all hell but we have to handle it or we end up with
-        # phantom sailings being created
-        latest_time = None
-
-        # Iterate over the later sailings
-        for sailing in route['later_sailings']:
-            logger.debug("Found later sailing {}".format(sailing))
-
-            cancelled = False
-            # Check if the sailing is cancelled
-            if re.search('-Cancelled', sailing):
-                # Sailing is cancelled
-                logger.debug("Later sailing is cancelled")
-                cancelled = True
-                (sailing, _) = sailing.split('-')
-
-            # Check if the sailing is tomorrow
-            if sailing.startswith('*'):
-                # Sailing is tomorrow
-                tomorrow = (datetime.now(timezone) + timedelta(days=1)).strftime("%Y-%m-%d")
-                sailing_time = parse("{} {}".format(
-                    tomorrow, sailing[1:]
-                ))
-                sailing_time = timezone.localize(sailing_time)
-
-                # Check for the aforementioned stupidity
-                if latest_time and sailing_time < latest_time:
-                    # Sailing is for the day after tomorrow
-                    sailing_time = sailing_time + timedelta(days=1)
-                    logger.debug("Later sailing is for the DAY AFTER tomorrow: {}".format(
-                        sailing_time
-                    ))
-                    latest_time = sailing_time
-                else:
-                    # Sailing is for tomorrow
-                    logger.debug("Later sailing is tomorrow: {}".format(
-                        sailing_time
-                    ))
-                    latest_time = sailing_time
+                        full_sailing.percent_full = 100
 
-            else:
-                # Sailing is today. Parse the time.
-                today = datetime.now(timezone).strftime("%Y-%m-%d")
-                sailing_time = parse("{} {}".format(
-                    today, sailing
+                        uow.add(percentfull_o)
+                        update_sailing(full_sailing, 'percent_full')
+                    else:
+                        logger.debug("Sailing was already 100% full")
+
+            # Get the car and oversize waits
+            car_waits = route.get('car_waits', None)
+            oversize_waits = route.get('oversize_waits', None)
+
+            # Check if the waits have changed
+            if route_o.car_waits != car_waits:
+                # Car waits has changed
+                logger.debug("Car waits has changed ({} -> {})".format(
+                    route_o.car_waits, car_waits
                 ))
-                sailing_time = timezone.localize(sailing_time)
-                logger.debug("Later sailing is today: {}".format(
-                    sailing_time
+
+                # Create a CarWaitEvent
+                carwaitevent_o = CarWaitEvent(
+                    route=route_o,
+                    old_value=route_o.car_waits,
+                    new_value=car_waits
+                )
+
+                route_o.car_waits = car_waits
+
+                uow.add(carwaitevent_o)
+                uow.update(route_o, 'car_waits')
+
+            if route_o.oversize_waits != oversize_waits:
+                # Oversize waits has changed
+                logger.debug("Oversize waits has changed ({} -> {})".format(
+                    route_o.oversize_waits, oversize_waits
                 ))
-                latest_time = sailing_time
 
-            # Get or create a Sailing object for this sailing
-            sailing_o, created = Sailing.objects.get_or_create(
-                route=route_o,
-                scheduled_departure=sailing_time
-            )
+                # Create a OversizeWaitEvent
+                oversizewaitevent_o = OversizeWaitEvent(
+                    route=route_o,
+                    old_value=route_o.oversize_waits,
+                    new_value=oversize_waits
+                )
 
-            # Check if a Sailing object was created
-            if created:
-                logger.info("Created sailing for {}".format(sailing_time))
+                route_o.oversize_waits = oversize_waits
+
+                uow.add(oversizewaitevent_o)
+                uow.update(route_o, 'oversize_waits')
+
+
+            # Check if there are any sailings for this route today
+            if not route['sailings']:
+                # Nope :(
+                logger.debug("No more sailings today for this route")
             else:
-                logger.debug("Sailing for {} already existed".format(sailing_time))
+                # Iterate over each sailing
+                for sailing in route['sailings']:
+                    logger.debug("Found sailing at {}".format(sailing['time']))
+
+                    sailing_time = sailing['scheduled_departure']
+                    logger.debug("Sailing time is {}".format(sailing_time))
+
+                    # Find sailing
+                    sailing_o = sailings.get((route_o.pk, sailing_time))
+                    if sailing_o is None:
+                        sailing_o = sailings.setdefault((route_o.pk, sailing_time), Sailing.objects.get(
+                            route=route_o,
+                            scheduled_departure=sailing_time
+                        ))
 
-    # Parsing completed
-    run.set_status("Completed", successful=True)
-    logger.info("Finished retrieving and processing conditions")
-    return True
+                    # Any fields that have changed
+                    fields = []
+
+                    # Check if the sailing was marked as cancelled
+                    if 'cancelled' in sailing:
+                        logger.debug("Sailing has been cancelled")
+                    else:
+                        # Get how full this sailing is
+                        percent_full = sailing['percent_full']
+
+                        # Check if the loading has changed
+                        if sailing_o.percent_full != percent_full:
+                            # Loading has changed
+                            logger.debug("Percent full has changed ({} -> {})".format(
+                                sailing_o.percent_full, percent_full
+                            ))
+
+                            # Create a PercentFullEvent
+                            percentfull_o = PercentFullEvent(
+                                sailing=sailing_o,
+                                old_value=sailing_o.percent_full,
+                                new_value=percent_full
+                            )
+
+                            sailing_o.percent_full = percent_full
+                            fields.append('percent_full')
+
+                            uow.add(percentfull_o)
+
+                    # Only write the sailing if something has changed
+                    update_sailing(sailing_o, *fields)
+
+            # Iterate over the later sailings
+            for sailing_time in route['later_sailings']:
+                # Get or create a Sailing object for this sailing
+                sailing_o, created = Sailing.objects.get_or_create(
+                    route=route_o,
+                    scheduled_departure=sailing_time
+                )
+
+                # Check if a Sailing object was created
+                if created:
+                    logger.info("Created sailing for {}".format(sailing_time))
+                else:
+                    logger.debug("Sailing for {} already existed".format(sailing_time))
+
+        # Write the changed sailings, and bring the historical norms up to date with them
+        uow.flush()
+        for sailing_o in changed_sailings.values():
+            sailing_o.update_norms()
 
 
 def get_sailing_detail(input_file: str=None) -> bool:
@@ -896,290 +701,332 @@ def get_sailing_detail(input_file: str=None) -> bool:
             data.append(file_data)
 
     else:
-        # For each route, query the sailing detail page
-        for route in Route.objects.all():
+        # For each route, build the URL for the sailing detail page
+        urls = []
+        for route in Route.objects.select_related('source'):
             # Pad the route code with zeroes
             code = "{0:02d}".format(route.route_code)
 
             # Build the URL with the route code and source terminal
-            url = "{}?route={}&dept={}".format(
+            urls.append("{}?route={}&dept={}".format(
                 MAIN_PAGE, code, route.source.short_name
-            )
-
-            # Request pages
-            try:
-                logger.debug("Querying {}...".format(url))
-                page = requests.get(url)
-                data.append(page.content.decode())
+            ))
 
-                # Wait for 1 second so we don't hammer the BC Ferries website
-                sleep(1)
-            except Exception as e:
+        # Request pages. The fetcher rate limits these so we don't hammer the BC Ferries website
+        for url, page in get_fetcher().fetch_all(urls):
+            if isinstance(page, Exception):
                 # TODO - handle this better
-                logger.error("Error ({}): {}".format(url, e))
+                logger.error("Error ({}): {}".format(url, page))
+            else:
+                data.append(page.content.decode())
 
+    # Parse the pages we've retrieved
+    captured_at = clock.now()
+    details = [parse_sailing_detail(d, captured_at) for d in data]
 
     additional_urls = []
-    # Iterate over the pages we've retrieved
-    for d in data:
-        # Load data into our BeautifulSoup parser
-        b = BeautifulSoup(d, 'html.parser')
-
-        # Check for the "No more scheduled sailings for today" message
-        if "No more scheduled sailings for today" in d:
+    for detail in details:
+        # There are no other sailings if there are no more scheduled sailings today
+        if not detail["other_sailings"]:
             logger.debug("No more URLs to retrieve")
-        else:
-            # Get additional sailing times
-            for option in b.find('select').find_all('option'):
-                additional_urls.append("{}/{}".format(
-                    URL_BASE,
-                    option['value']
-                ))
+
+        # Get additional sailing times
+        for value in detail["other_sailings"]:
+            additional_urls.append("{}/{}".format(
+                URL_BASE,
+                value
+            ))
 
     if not input_file:
         # If we're not reading from a local file, retrieve the additional sailings
-        for additional_url in additional_urls:
-            try:
-                logger.debug("Querying {}...".format(additional_url))
-                page = requests.get(additional_url)
-                data.append(page.content.decode())
-
-                # Again, sleep for 1 second so we don't hammer the website
-                sleep(1)
-            except Exception as e:
+        for additional_url, page in get_fetcher().fetch_all(additional_urls):
+            if isinstance(page, Exception):
                 # TODO - handle this exception better
-                logger.error("Error ({}): {}".format(additional_url, e))
-
-    # Iterate over the additional pages we've retrieved
-    for d in data:
-        # Load data into the parser
-        b = BeautifulSoup(d, 'html.parser')
-
-        # Parse out the route name and terminal code
-        route_name = b.font.text
-        terminal_code = re.search(r'.*arrivals-departures.html\?dept=(\w+)&.*', d).groups()[0]
-        logger.debug("Terminal code: {}".format(terminal_code))
-        logger.debug("Route name: {}".format(route_name))
-
-        # Get the Route object, and the Terminal object for the source of this sailing
-        route_o = Route.objects.get(name=route_name)
-        terminal_o = Terminal.objects.get(short_name=terminal_code)
-
-        # Check for the "No more scheduled sailings for today" message
-        if 'No more scheduled sailings for today' in d:
-            # No more sailings today
-            logger.debug("No more scheduled sailings for today")
-        else:
-
-            # Parse the sailing details if they exist
-            sailing_details = next(
-                span.text for span in b.find_all('span') if 'Sailing Details' in span.text
-            )
-
-            # Parse the sailing time
-            sailing_time = re.search(r'.*:\s(\S+ \w+)', sailing_details).groups()[0]
-            logger.debug("Sailing time: {}".format(sailing_time))
-
-            # Localise the scheduled departure time
-            scheduled_departure = timezone.localize(parse("{} {}".format(
-                get_local_day(),
-                sailing_time
-            )))
-            logger.debug("Parsed timestamp: {}".format(scheduled_departure))
-
-            # Get the Sailing object for this sailing. Since we should be running this after
-            # the functions which pull the overall sailings information, this Sailing should
-            # already exist.
-            # TODO - should be a try/except
-            sailing_o = Sailing.objects.get(
-                route=route_o,
-                scheduled_departure=scheduled_departure
-            )
-
-            # Check if the sailing is cancelled
-            if "CANCELLED" in sailing_details:
-                # Boo
-                logger.debug("Sailing has been cancelled")
-                sailing_o.cancelled = True
-
+                logger.error("Error ({}): {}".format(additional_url, page))
             else:
-                # Get deck space
-                car_space = None
-                oversize_space = None
-                try:
-                    # Parse out the amount of deck space already committed by both cars
-                    # and oversize vehicles
-                    (oversize_space, car_space, timestamp) = re.search(
-                        r'.*"DeckSpace_pop.asp\?os=(-?\d+)&uh=(-?\d+)&tm=(\d+)".*',
-                        d).groups()
-                    logger.debug("Car space used: {}".format(car_space))
-                    logger.debug("Oversize space used: {}".format(oversize_space))
-
-                    # Cast them to integers
-                    car_percent = int(car_space)
-                    oversize_percent = int(oversize_space)
-
-                    # Check if the car deck space has changed
-                    if sailing_o.car_percent_full != car_percent:
-                        # Car deck space has changed
-                        logger.debug("Car % was {}%, now {}%".format(
-                            sailing_o.car_percent_full, car_percent
-                        ))
-
-                        # Create a new CarPercentFullEvent
-                        car_event_o = CarPercentFullEvent(
-                            sailing=sailing_o,
-                            old_value=sailing_o.car_percent_full,
-                            new_value=car_percent
-                        )
-                        car_event_o.save()
-
-                        sailing_o.car_percent_full = car_percent
-
-                    # Check if the oversize deck space has changed
-                    if sailing_o.oversize_percent_full != oversize_percent:
-                        # Oversize deck space has changed
-                        logger.debug("Oversize % was {}%, now {}%".format(
-                            sailing_o.oversize_percent_full, oversize_percent
-                        ))
-
-                        # Create a new OversizePercentFullEvent
-                        oversize_event_o = OversizePercentFullEvent(
-                            sailing=sailing_o,
-                            old_value=sailing_o.oversize_percent_full,
-                            new_value=oversize_percent
-                        )
-                        oversize_event_o.save()
+                details.append(parse_sailing_detail(page.content.decode(), captured_at))
+
+    # Each sailing is on its own page and in the other sailings of its route, so keep hold of the ones we've loaded
+    # and queue up the changes to them on the same objects
+    sailings = {}
+
+    # Sailings with changes queued up, which need the norms updating once they're written
+    changed_sailings = {}
+
+    def update_sailing(sailing_o: Sailing, *fields: str) -> None:
+        """ Queue up the given fields of a sailing to be written, along with any derived fields that change. """
+
+        derived = {field: getattr(sailing_o, field) for field in Sailing.DERIVED_FIELDS}
+        sailing_o.calculate()
+
+        fields += tuple(field for field, value in derived.items() if getattr(sailing_o, field) != value)
+        uow.update(sailing_o, *fields)
+        changed_sailings[sailing_o.pk] = sailing_o
+
+    # Write everything in a single transaction
+    with UnitOfWork(run) as uow:
+        # Iterate over all of the pages we've retrieved
+        for detail in details:
+            # Get the route name and terminal code
+            route_name = detail["route_name"]
+            terminal_code = detail["terminal_code"]
+            logger.debug("Terminal code: {}".format(terminal_code))
+            logger.debug("Route name: {}".format(route_name))
+
+            # Get the Route object, and the Terminal object for the source of this sailing
+            route_o = uow.references.get(Route, name=route_name)
+            terminal_o = uow.references.get(Terminal, short_name=terminal_code)
+
+            # The sailing details are only there if there are more scheduled sailings today
+            if detail["sailing_details"] is None:
+                # No more sailings today
+                logger.debug("No more scheduled sailings for today")
+            else:
+                scheduled_departure = detail["scheduled_departure"]
+                logger.debug("Scheduled departure: {}".format(scheduled_departure))
+
+                # Get the Sailing object for this sailing. Since we should be running this after
+                # the functions which pull the overall sailings information, this Sailing should
+                # already exist.
+                # TODO - should be a try/except
+                if (route_o.pk, scheduled_departure) not in sailings:
+                    sailings[(route_o.pk, scheduled_departure)] = Sailing.objects.get(
+                        route=route_o,
+                        scheduled_departure=scheduled_departure
+                    )
 
-                        sailing_o.oversize_percent_full = oversize_percent
+                sailing_o = sailings[(route_o.pk, scheduled_departure)]
 
-                    sailing_o.save()
+                # Check if the sailing is cancelled
+                if detail["cancelled"]:
+                    # Boo
+                    logger.debug("Sailing has been cancelled")
+                    if not sailing_o.cancelled:
+                        sailing_o.cancelled = True
+                        update_sailing(sailing_o, 'cancelled')
 
-                except Exception as e:
-                    # TODO - handle this better
-                    # Couldn't find the deck space details
-                    logger.warning("Couldn't find deck space usage: {}".format(
-                        e
-                    ))
+                else:
+                    # Get deck space
+                    if detail["car_percent_full"] is None:
+                        # TODO - handle this better
+                        # Couldn't find the deck space details
+                        logger.warning("Couldn't find deck space usage")
 
-                # Parse the ferry for this sailing, and load the corresponding Ferry object
-                ferry = next(a.text for a in b.find_all('a') if 'onboard' in a['href'] and a.text)
-                ferry_o = Ferry.objects.get(name=ferry)
-                logger.debug("Ferry: {}".format(ferry))
+                    else:
+                        car_percent = detail["car_percent_full"]
+                        oversize_percent = detail["oversize_percent_full"]
+                        logger.debug("Car space used: {}".format(car_percent))
+                        logger.debug("Oversize space used: {}".format(oversize_percent))
+
+                        # Check if the car deck space has changed
+                        if sailing_o.car_percent_full != car_percent:
+                            # Car deck space has changed
+                            logger.debug("Car % was {}%, now {}%".format(
+                                sailing_o.car_percent_full, car_percent
+                            ))
+
+                            # Create a new CarPercentFullEvent
+                            car_event_o = CarPercentFullEvent(
+                                sailing=sailing_o,
+                                old_value=sailing_o.car_percent_full,
+                                new_value=car_percent
+                            )
+                            uow.add(car_event_o)
+
+                            sailing_o.car_percent_full = car_percent
+                            update_sailing(sailing_o, 'car_percent_full')
+
+                        # Check if the oversize deck space has changed
+                        if sailing_o.oversize_percent_full != oversize_percent:
+                            # Oversize deck space has changed
+                            logger.debug("Oversize % was {}%, now {}%".format(
+                                sailing_o.oversize_percent_full, oversize_percent
+                            ))
+
+                            # Create a new OversizePercentFullEvent
+                            oversize_event_o = OversizePercentFullEvent(
+                                sailing=sailing_o,
+                                old_value=sailing_o.oversize_percent_full,
+                                new_value=oversize_percent
+                            )
+                            uow.add(oversize_event_o)
+
+                            sailing_o.oversize_percent_full = oversize_percent
+                            update_sailing(sailing_o, 'oversize_percent_full')
+
+                    # Load the Ferry object for the ferry on this sailing
+                    ferry = detail["ferry"]
+                    ferry_o = uow.references.get(Ferry, name=ferry)
+                    logger.debug("Ferry: {}".format(ferry))
+
+            # Get the parking available at the source terminal
+            parking = detail["parking"]
+            logger.debug("Parking: {}".format(parking))
+
+            # Check if the amount of parking available has changed
+            if terminal_o.parking != parking:
+                # Available parking has changed
+                logger.debug("Parking has changed from {}% to {}%".format(
+                    terminal_o.parking, parking
+                ))
 
-        # Parse out the parking available at the source terminal
-        parking = int(re.search(r'\s(\d+)%.*', next(td.text for td in b.find_all('td') if (len(td.find_all('a')) == 1 and td.a.text == "Parking"))).groups()[0])
-        logger.debug("Parking: {}".format(parking))
+                # Create a new ParkingEvent
+                parking_o = ParkingEvent(
+                    terminal=terminal_o,
+                    old_value=terminal_o.parking,
+                    new_value=parking
+                )
+                uow.add(parking_o)
+                terminal_o.parking = parking
+                uow.update(terminal_o, 'parking')
 
-        # Check if the amount of parking available has changed
-        if terminal_o.parking != parking:
-            # Available parking has changed
-            logger.debug("Parking has changed from {}% to {}%".format(
-                terminal_o.parking, parking
-            ))
-
-            # Create a new ParkingEvent
-            parking_o = ParkingEvent(
-                terminal=terminal_o,
-                old_value=terminal_o.parking,
-                new_value=parking
-            )
-            parking_o.save()
-            terminal_o.parking = parking
-            terminal_o.save()
+        # Write the changed sailings, and bring the historical norms up to date with them
+        uow.flush()
+        for sailing_o in changed_sailings.values():
+            sailing_o.update_norms()
 
     run.set_status("Completed", successful=True)
     logger.info("Finished retrieving and processing sailing details pages")
     return True
 
 
-def get_ferry_locations() -> bool:
+def get_ferry_locations(route_numbers: List[str] = None, input_files: Dict[str, str] = None,
+                        pages: Dict[str, LocationsRawHTML] = None) -> bool:
     """ Pull data on the ferry locations from the BC Ferries website.
 
-    This will pull the popups that show the locations of the ferries.
+    This will pull the popups that show the locations of the ferries. How each route's page was fetched is recorded
+    with the LocationPoller.
 
+    :param route_numbers: the routes to pull locations for (defaults to all of them)
+    :type route_numbers: list
+    :param input_files: optional dict of route number to local file to read from, instead of querying
+    :type input_files: dict
+    :param pages: optional dict of route number to archived page to process again (they aren't stored a second time)
+    :type pages: dict
     :returns: whether we succeeded or not
     :rtype: bool
     """
 
     # Set base URL and route numbers
     MAP_BASE = "https://orca.bcferries.com/cc/settings/includes/maps/"
-    route_numbers = ['0', '1', '2', '3', '4', '5', '6', '7', '13']
+    if pages:
+        route_numbers = list(pages)
+    elif input_files:
+        route_numbers = list(input_files)
+    elif route_numbers is None:
+        route_numbers = LOCATION_ROUTES
+    poller = get_location_poller()
 
     # Start a new LocationsRun
     run = LocationsRun()
 
+    # Build the URLs for each route
+    urls = {
+        "{}/route{}.html".format(MAP_BASE, i): i for i in route_numbers
+    }
+    run.set_status("Querying for locations")
+
     routes = {}
-    # Iterate over the route numbers
-    for i in route_numbers:
-        # Build URL for this route
-        url = "{}/route{}.html".format(MAP_BASE, i)
-        run.set_status("Querying for locations: {}".format(url))
 
-        try:
-            # Query for data
-            logger.info("Querying BCF for data...")
-            response = requests.get(url)
-            if response.status_code == 200:
+    if pages:
+        # If archived pages are given, process those again
+        routes = {route_number: page.content for route_number, page in pages.items()}
+    elif input_files:
+        # If input files are given, read from those instead
+        for url, route_number in urls.items():
+            with open(input_files[route_number], 'r') as fp:
+                routes[route_number] = fp.read()
+
+            raw_html = LocationsRawHTML(run=run, data=routes[route_number], url=url)
+            raw_html.save()
+    else:
+        # Get the pages we processed last time, so we can tell if they've changed
+        previous = {url: LocationsRawHTML.latest(url=url) for url in urls}
+
+        # Query for data
+        logger.info("Querying BCF for data...")
+        results = get_fetcher().fetch_all(urls, headers={
+            url: page.conditional_headers for url, page in previous.items() if page
+        })
+
+        # Iterate over the responses for each route
+        for url, response in results:
+            if isinstance(response, Exception):
+                # TODO - handle this better
+                poller.record(urls[url], changed=False, error=True)
+                logger.error("Could not retrieve details from the BC Ferries website. {}".format(response))
+                run.set_status("Could not retrieve details from the BC Ferries website (non-200 status code)")
+                return False
+            elif previous[url] and previous[url].is_unchanged(response):
+                # This page hasn't changed since the last run, so skip it
+                poller.record(urls[url], changed=False)
+                logger.debug("Locations for {} are unchanged since the last run".format(url))
+            elif response.status_code == 200:
+                poller.record(urls[url], changed=True)
                 # Success!
                 logger.info("Successfully queried BCF for data")
                 # Store the page
-                routes[i] = response.text
+                routes[urls[url]] = response.text
                 raw_html = LocationsRawHTML(
                     run=run,
                     data=response.text,
-                    url=url
+                    url=url,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified')
                 )
                 raw_html.save()
             else:
                 # Got a non-200 OK response
-                logger.error("Could not retrieve details from the BC Ferries website: {}".format(response.status_code))
+                poller.record(urls[url], changed=False, error=True)
+                logger.error(
+                    "Could not retrieve details from the BC Ferries website: {}".format(response.status_code)
+                )
                 run.set_status("Could not retrieve details from the BC Ferries website (non-200 status code)")
                 return False
-        except Exception as e:
-            # TODO - handle this better
-            logger.error("Could not retrieve details from the BC Ferries website. {}".format(e))
-            run.set_status("Could not retrieve details from the BC Ferries website (non-200 status code)")
-            return False
+
+    if not routes:
+        # None of the pages have changed, so there's nothing to do
+        logger.info("Locations are unchanged since the last run")
+        run.set_status("Unchanged", successful=True, changed=False)
+        return True
 
     run.set_status("Data retrieved from BCF")
-    #routes.append(open("_data/route0.html", "r").read())
-
-    # Iterate over each route
-    for route_number in routes:
-        # Retrieve page
-        data = routes[route_number]
-
-        # Parse page
-        b = BeautifulSoup(data, 'html.parser')
-
-        # Iterate over the page table
-        for tr in b.body.table.find_all('tr')[1:]:
-            # We only want rows with 4 entries - these are the ones with the ferry details
-            if len(tr.find_all('td')) == 4:
-                # Parse out the ferry name, status, destination and the last updated time
-                (ferry, status, destination, time) = [e.text for e in tr.find_all('td')]
-                logger.debug("Found {} (-> {}, {} @ {})".format(
-                    ferry, destination, status, time
-                ))
 
-                # Localise the times
-                now = datetime.now(timezone)
-                today = now.strftime("%Y-%m-%d")
-                updated_time = parse("{} {}".format(today, time))
-                updated_time = timezone.localize(updated_time)
+    # Parse the pages, as of the time they were captured
+    captured_at = clock.now()
+    records = {route_number: parse_locations(data, captured_at) for route_number, data in routes.items()}
+
+    apply_locations(records, run)
+
+    run.set_status("Completed", successful=True)
+    logger.info("Finished retrieving and processing locations")
+    return True
+
 
-                # Handle times that were yesterday
-                if updated_time > now:
-                    logger.debug("Updated time was yesterday")
-                    yesterday = (datetime.now(timezone) - timedelta(days=1)).strftime("%Y-%m-%d")
-                    updated_time = parse("{} {}".format(yesterday, time))
-                    updated_time = timezone.localize(updated_time)
+def apply_locations(records: Dict[str, List[dict]], run: LocationsRun) -> None:
+    """ Update the ferries from parsed route location pages, in a single transaction.
+
+    :param records: dict of route number to the ferries on its page, from parse_locations()
+    :type records: dict
+    :param run: the run the changes are for
+    :type run: LocationsRun
+    :returns: nothing
+    :rtype: None
+    """
+
+    # Write everything in a single transaction
+    with UnitOfWork(run) as uow:
+        # Iterate over each route
+        for route_number, ferries in records.items():
+            for row in ferries:
+                ferry = row['ferry']
+                status = row['status']
+                destination = row['destination']
+                time = row['time']
+                updated_time = row['updated']
 
                 # Get or create a Ferry object for this ferry
-                ferry_o, created = Ferry.objects.get_or_create(
-                    name=ferry
-                )
+                ferry_o, created = uow.references.get_or_create(Ferry, name=ferry)
 
                 # Check if a Ferry object was created
                 if created:
@@ -1202,18 +1049,18 @@ def get_ferry_locations() -> bool:
                             old_value=ferry_o.heading,
                             new_value=heading
                         )
-                        event_o.save()
+                        uow.add(event_o)
 
                         ferry_o.heading = heading
                         ferry_o.last_updated = updated_time
-                        ferry_o.save()
+                        uow.update(ferry_o, 'heading', 'last_updated')
 
                 else:
                     # Get Destination object for the sailing destination
-                    dest_o = Destination.objects.get(name__startswith=destination)
+                    dest_o = uow.references.get(Destination, name__startswith=destination)
 
                     # Check if the destination has changed
-                    if ferry_o.destination != dest_o:
+                    if ferry_o.destination_id != dest_o.pk:
                         # Destination has changed
                         logger.debug("Destination changed from {} to {}".format(
                             ferry_o.destination, dest_o
@@ -1225,11 +1072,11 @@ def get_ferry_locations() -> bool:
                             destination=dest_o,
                             last_updated=time
                         )
-                        event_o.save()
+                        uow.add(event_o)
 
                         ferry_o.destination = dest_o
                         ferry_o.last_updated = updated_time
-                        ferry_o.save()
+                        uow.update(ferry_o, 'destination', 'last_updated')
 
                 # Check if the status has changed
                 if ferry_o.status != status:
@@ -1244,35 +1091,31 @@ def get_ferry_locations() -> bool:
                             ferry=ferry_o,
                             last_updated=updated_time
                         )
-                        event_o.save()
+                        uow.add(event_o)
                     elif status == "Under Way":
                         event_o = UnderWayEvent(
                             ferry=ferry_o,
                             last_updated=updated_time
                         )
-                        event_o.save()
+                        uow.add(event_o)
                     elif status == "Stopped":
                         event_o = StoppedEvent(
                             ferry=ferry_o,
                             last_updated=updated_time
                         )
-                        event_o.save()
+                        uow.add(event_o)
                     elif status == "Temporarily Off Line":
                         event_o = OfflineEvent(
                             ferry=ferry_o,
                             last_updated=updated_time
                         )
-                        event_o.save()
+                        uow.add(event_o)
                     else:
                         logger.warning("Unknown status: {}".format(status))
 
                     ferry_o.status = status
                     ferry_o.last_updated = updated_time
-                    ferry_o.save()
-
-    run.set_status("Completed", successful=True)
-    logger.info("Finished retrieving and processing locations")
-    return True
+                    uow.update(ferry_o, 'status', 'last_updated')
 
 
 def get_ferry_details() -> bool:
@@ -1288,7 +1131,7 @@ def get_ferry_details() -> bool:
     try:
         # Query for data
         logger.info("Querying BCF for data...")
-        response = requests.get(url)
+        response = get_client().get(url)
         if response.status_code == 200:
             # Success!
             logger.info("Successfully queried BCF for data")
@@ -1302,18 +1145,18 @@ def get_ferry_details() -> bool:
         logger.error("Could not retrieve details from the BC Ferries website. {}".format(e))
         return False
 
-    b = BeautifulSoup(response.text, 'html.parser')
+    b = make_soup(response.text)
 
     for ferry in b.find_all('tbody')[1].find_all('td'):
         if ferry.a and '/fleet/' in ferry.a['href']:
             ferry_url = ferry.a['href']
             ferry_name = ferry.text.strip()
 
-            ferry_detail_page = requests.get(
+            ferry_detail_page = get_client().get(
                 "http://www.bcferries.com{}".format(ferry_url)
             )
 
-            ferry_detail = BeautifulSoup(ferry_detail_page.text, 'html.parser')
+            ferry_detail = make_soup(ferry_detail_page.text)
 
             details = ferry_detail.find_all('table')[1].find_all('tr')[7].\
                 find_all('td')[1].text
@@ -1,11 +1,9 @@
-from flask import Flask, request
+from flask import Flask, jsonify, request
 from django.apps import apps
 from django.conf import settings
-from threading import Thread, Event
+from threading import Thread
 import os
-from time import sleep
 import logging
-from datetime import datetime, timedelta
 import pytz
 
 if 'DJANGO_SETTINGS_MODULE' not in os.environ:
@@ -13,92 +11,126 @@ if 'DJANGO_SETTINGS_MODULE' not in os.environ:
 
 apps.populate(settings.INSTALLED_APPS)
 
+from django.db import connection
+from data.client import get_client
 from data.models import Sailing
+from data.jobqueue import JobQueue
+from data.scheduler import Scheduler
+from data.locations import get_location_poller
+from data.tasks import get_update_cadence, get_update_graph, poll_locations
 from data.utils import (get_actual_departures, get_current_conditions,
-                        get_ferry_locations, get_sailing_detail)
+                        get_sailing_detail, get_ferry_details)
 
 app = Flask(__name__)
-last_run = datetime.utcfromtimestamp(0)
-last_detail_run = datetime.utcfromtimestamp(0)
 
 tz = pytz.timezone(settings.DISPLAY_TIME_ZONE)
 
-interval = 600
+def update_cycle():
+    # Ferry locations are polled route by route, so they're left out of updates. Departures and conditions are run
+    # through the queue, so they're never scraped by an update and on their own at the same time.
+    return get_update_graph(locations=False, queue=queue).run()
+
+# Everything the worker runs goes through the queue, so the same task is never run twice at once. Ferry locations are
+# only ever fetched by the per-route poller.
+queue = JobQueue({
+    "update": update_cycle,
+    "departures": get_actual_departures,
+    "conditions": get_current_conditions,
+    "poll_locations": poll_locations,
+    "sailing_detail": get_sailing_detail,
+    "ferry_details": get_ferry_details,
+})
 
 def shutdown_flask():
     func = request.environ.get('werkzeug.server.shutdown')
     func()
 
-def periodic_update():
-    global last_run
-    while e.is_set() is False:
-        td = datetime.now() - last_run
+def run_queued(name):
+    def run():
+        job = queue.submit(name)
+        job.wait()
+        return job.result
+    return run
 
-        if td.seconds > 600:
-            print("Querying departures...")
-            get_actual_departures()
-            print("Querying conditions...")
-            get_current_conditions()
-            print("Querying ferry locations...")
-            get_ferry_locations()
-            last_run = datetime.now()
-        else:
-            print("Sleeping ({} seconds to go)".format(interval - td.seconds))
+def run_cadence(cadence):
+    def run():
+        try:
+            return cadence()
+        finally:
+            # The cadence is worked out on the scheduler's thread, so don't leave its connection open
+            connection.close()
+    return run
 
-        sleep(10)
+# Updates are run more often around departures and arrivals
+cadences = {
+    "update": run_cadence(get_update_cadence(locations=False)),
+}
 
-    print("Shutdown worker")
+scheduler = Scheduler()
+for name, options in settings.BCF_SCHEDULE.items():
+    scheduler.add(name, run_queued(name), cadence=cadences.get(name), **options)
 
-def periodic_detail_update():
-    global last_detail_run
-    while e.is_set() is False:
-        td = datetime.now() - last_detail_run
+def enqueue(*names):
+    jobs = [queue.submit(name).as_dict for name in names]
+    return jsonify(jobs[0] if len(jobs) == 1 else {"jobs": jobs}), 202
 
-        if td.seconds > 3600:
-            get_sailing_detail()
-            last_detail_run = datetime.now()
-        else:
-            print("Sleeping ({} seconds to go)".format(3600 - td.seconds))
 
-        sleep(10)
+@app.route("/status")
+def status():
+    return jsonify({
+        "queue": queue.as_dict,
+        "schedule": scheduler.as_dict,
+        # Requests, bytes transferred and latency for each host the collectors fetch from
+        "hosts": get_client().host_stats,
+        # How much of the hourly request budget all of the jobs together have left
+        "budget": get_client().budget.as_dict
+    })
 
-    print("Shutdown worker")
 
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = queue.get(job_id)
 
-@app.route("/status")
-def status():
-    return str(last_run)
+    if job is None:
+        return jsonify({"error": "Unknown job {}".format(job_id)}), 404
+
+    return jsonify(job.as_dict)
 
 
-@app.route("/departures")
+@app.route("/departures", methods=["GET", "POST"])
 def departures():
-    get_actual_departures()
-    return "OK"
+    return enqueue("departures")
 
 
-@app.route("/conditions")
+@app.route("/conditions", methods=["GET", "POST"])
 def conditions():
-    get_current_conditions()
-    return "OK"
+    return enqueue("conditions")
 
 
-@app.route("/locations")
+def poll_all_locations():
+    # Fetch every route the next time the locations are polled, rather than waiting for each one to come due
+    get_location_poller().expedite()
+    return "poll_locations"
+
+
+@app.route("/locations", methods=["GET", "POST"])
 def locations():
-    get_ferry_locations()
-    return "OK"
+    return enqueue(poll_all_locations())
+
 
+@app.route("/locations/stats")
+def location_stats():
+    return jsonify(get_location_poller().as_dict)
 
-@app.route("/update")
+
+@app.route("/update", methods=["GET", "POST"])
 def update():
-    get_actual_departures()
-    get_current_conditions()
-    get_ferry_locations()
-    return "OK"
+    return enqueue("update", poll_all_locations())
 
 
 @app.route("/shutdown")
 def shutdown():
-    e.set()
+    scheduler.stop()
     shutdown_flask()
     return "OK"
 
@@ -108,14 +140,10 @@ def index():
     return str(Sailing.objects.count())
 
 
-e = Event()
-t = Thread(target=periodic_update)
-d = Thread(target=periodic_detail_update)
-a = Thread(target=app.run, kwargs={
-    "host": "0.0.0.0", "port": 6124
-})
+t = Thread(target=scheduler.run)
 
 if __name__=='__main__':
     t.start()
-    # d.start()
-    a.start()
+    # The control API only queues up jobs, so requests never wait on a scrape
+    app.run(host="0.0.0.0", port=6124, threaded=True)
+    queue.shutdown()